@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Course, Student, Attendance
+from .models import Course, Student, Attendance, DailyAttendanceSummary, EnrollmentJob
 
 @admin.register(Course)
 class CourseAdmin(admin.ModelAdmin):
@@ -20,3 +20,16 @@ class AttendanceAdmin(admin.ModelAdmin):
     search_fields = ('student__student_id', 'student__first_name', 'student__last_name')
     list_filter = ('status', 'date', 'student__course')
     ordering = ('-date', '-time_in')
+
+@admin.register(DailyAttendanceSummary)
+class DailyAttendanceSummaryAdmin(admin.ModelAdmin):
+    list_display = ('date', 'course', 'present', 'late', 'absent', 'updated_at')
+    list_filter = ('date', 'course')
+    ordering = ('-date',)
+
+@admin.register(EnrollmentJob)
+class EnrollmentJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'student', 'status', 'stage', 'confidence', 'created_at', 'finished_at')
+    search_fields = ('student__student_id',)
+    list_filter = ('status',)
+    ordering = ('-created_at',)
@@ -0,0 +1,215 @@
+"""
+Approximate nearest-neighbour search for very large face galleries.
+
+An exact 1:N match multiplies the probe with every enrolled encoding. At
+100k+ students that product dominates a check-in. ``IVFIndex`` is an
+inverted-file index: spherical k-means splits the unit-length gallery into
+``n_lists`` cells, and a search only scores the rows in the ``probes`` cells
+whose centroids are closest to the probe. Those candidates are re-ranked
+against the gallery matrix itself, so the similarities returned are exact
+and only recall is approximate.
+
+The index holds centroids and one cell number per student pk, never the
+vectors, so the gallery matrix (private or memory-mapped) stays the only
+copy. ``add`` files newly enrolled encodings under their nearest centroids.
+Rows the index has not seen, e.g. students enrolled through another worker,
+are assigned the same way on the next search. Training is the only
+expensive step, so the index is saved to ``FACE_ANN_INDEX_FILE`` and reused
+after a restart; it is retrained once the gallery has grown to
+``RETRAIN_GROWTH`` times the size it was trained on.
+"""
+import logging
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+TRAINING_POINTS_PER_LIST = 64
+RETRAIN_GROWTH = 2.0
+ASSIGN_CHUNK = 8192
+
+
+def default_lists(size):
+    """About sqrt(N) cells: probing a few of them touches ~probes/sqrt(N) of the gallery"""
+    return max(1, min(size, int(round(np.sqrt(size)))))
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+class IVFIndex:
+    """Inverted-file index over a FaceGallery's normalized encoding matrix"""
+
+    def __init__(self, centroids, pks, cells, model_version, trained_size):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.model_version = model_version
+        self.trained_size = int(trained_size)
+        # Cell of every known student, sorted by pk for searchsorted lookups
+        order = np.argsort(pks, kind='stable')
+        self._pks = np.asarray(pks, dtype=np.int64)[order]
+        self._cells = np.asarray(cells, dtype=np.int32)[order]
+        self._lock = threading.Lock()
+        self._postings = None
+
+    @property
+    def n_lists(self):
+        return self.centroids.shape[0]
+
+    @property
+    def dimension(self):
+        return self.centroids.shape[1]
+
+    def fits(self, matrix, model_version):
+        """Whether this index can serve a gallery without retraining"""
+        return (
+            model_version == self.model_version
+            and matrix.shape[1] == self.dimension
+            and matrix.shape[0] <= self.trained_size * RETRAIN_GROWTH
+        )
+
+    @classmethod
+    def train(cls, matrix, pks, model_version, n_lists=None, iterations=10, seed=0):
+        """Spherical k-means over a sample of the gallery, then assign every row"""
+        size = len(pks)
+        n_lists = min(size, n_lists or default_lists(size))
+        rng = np.random.default_rng(seed)
+        sample_size = min(size, n_lists * TRAINING_POINTS_PER_LIST)
+        sample = np.asarray(matrix[np.sort(rng.choice(size, sample_size, replace=False))], dtype=np.float32)
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            order = np.argsort(assignment, kind='stable')
+            counts = np.bincount(assignment, minlength=n_lists)
+            filled = np.flatnonzero(counts)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[filled]
+            centroids[filled] = np.add.reduceat(sample[order], starts, axis=0)
+            empty = np.flatnonzero(counts == 0)
+            if empty.size:
+                # Reseed empty cells from random sample points
+                centroids[empty] = sample[rng.choice(sample_size, empty.size, replace=False)]
+            centroids = _normalize_rows(centroids).astype(np.float32)
+
+        index = cls(centroids, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int32), model_version, size)
+        index.postings(matrix, pks)
+        return index
+
+    def nearest_cells(self, vectors):
+        """Closest centroid for each row of ``vectors``, in bounded-memory chunks"""
+        cells = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), ASSIGN_CHUNK):
+            chunk = np.asarray(vectors[start:start + ASSIGN_CHUNK], dtype=np.float32)
+            cells[start:start + len(chunk)] = np.argmax(chunk @ self.centroids.T, axis=1)
+        return cells
+
+    def _merge(self, pks, cells):
+        # New assignments win over old ones for the same pk
+        with self._lock:
+            merged_pks = np.concatenate([pks, self._pks])
+            merged_cells = np.concatenate([cells, self._cells])
+            self._pks, first = np.unique(merged_pks, return_index=True)
+            self._cells = merged_cells[first]
+            self._postings = None
+
+    def add(self, pks, vectors):
+        """File (re-)enrolled encodings, one row of ``vectors`` per pk, under their nearest centroids"""
+        cells = self.nearest_cells(np.asarray(vectors, dtype=np.float32))
+        self._merge(np.asarray(pks, dtype=np.int64), cells)
+
+    def cells_for(self, matrix, pks):
+        """Cell of every gallery row, assigning rows the index has not seen yet"""
+        known_pks, known_cells = self._pks, self._cells
+        cells = np.zeros(len(pks), dtype=np.int32)
+        known = np.zeros(len(pks), dtype=bool)
+        if known_pks.size:
+            position = np.minimum(np.searchsorted(known_pks, pks), known_pks.size - 1)
+            known = known_pks[position] == pks
+            cells[known] = known_cells[position[known]]
+        if known.all():
+            return cells
+
+        missing = np.flatnonzero(~known)
+        cells[missing] = self.nearest_cells(matrix[missing])
+        self._merge(np.asarray(pks)[missing], cells[missing])
+        return cells
+
+    def postings(self, matrix, pks):
+        """
+        Gallery rows grouped by cell: rows of cell c are ``order[offsets[c]:offsets[c + 1]]``.
+        Cached for the current snapshot of the gallery arrays.
+        """
+        cached = self._postings
+        if cached is not None and cached[0] is pks:
+            return cached[1], cached[2]
+        cells = self.cells_for(matrix, pks)
+        order = np.argsort(cells, kind='stable')
+        offsets = np.searchsorted(cells[order], np.arange(self.n_lists + 1))
+        self._postings = (pks, order, offsets)
+        return order, offsets
+
+    def search_batch(self, probes, matrix, pks, top_k=1, n_probes=8):
+        """
+        Up to ``top_k`` (student_pk, cosine_similarity) pairs per row of the
+        normalized ``probes`` matrix, scoring only rows in the nearest cells.
+        """
+        order, offsets = self.postings(matrix, pks)
+        n_probes = min(n_probes, self.n_lists)
+        coarse = probes @ self.centroids.T
+        if n_probes < self.n_lists:
+            nearest = np.argpartition(-coarse, n_probes - 1, axis=1)[:, :n_probes]
+        else:
+            nearest = np.broadcast_to(np.arange(self.n_lists), coarse.shape)
+
+        results = []
+        for probe, cells in zip(probes, nearest):
+            rows = np.concatenate([order[offsets[cell]:offsets[cell + 1]] for cell in cells])
+            if not rows.size:
+                results.append([])
+                continue
+            # Ascending rows read the matrix sequentially and keep enrollment order for ties
+            rows.sort()
+            scores = matrix[rows] @ probe
+            k = min(top_k, rows.size)
+            best = np.argpartition(-scores, k - 1)[:k] if k < rows.size else np.arange(rows.size)
+            best = best[np.argsort(-scores[best], kind='stable')]
+            results.append([(int(pks[rows[i]]), float(scores[i])) for i in best])
+        return results
+
+    def save(self, path):
+        """Atomically write centroids and cell assignments to ``path``"""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.ann-', suffix='.npz')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(
+                    f, format_version=FORMAT_VERSION, centroids=self.centroids, pks=self._pks,
+                    cells=self._cells, model_version=self.model_version, trained_size=self.trained_size,
+                )
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path):
+        """Read an index saved by ``save``; returns None if it is missing or unreadable"""
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                if int(data['format_version']) != FORMAT_VERSION:
+                    raise ValueError(f"format version {int(data['format_version'])}")
+                return cls(data['centroids'], data['pks'], data['cells'],
+                           str(data['model_version']), int(data['trained_size']))
+        except FileNotFoundError:
+            return None
+        except (OSError, KeyError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable face ANN index {path}: {e}")
+            return None
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class AttendanceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'attendance'
+
+    def ready(self):
+        from . import jobs, signals  # noqa: F401
+        # Web server processes pick up enrollment jobs the previous run left behind
+        jobs.start()
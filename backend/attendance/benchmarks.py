@@ -0,0 +1,403 @@
+"""
+Reproducible, offline benchmarks for the face pipeline.
+
+Run them with ``python manage.py benchmark_face_pipeline``. Cases use the
+sample photos shipped in ``media/student_photos`` and synthetic galleries
+(seeded, so every run sees the same data). The endpoint cases run against a
+throwaway test database and a throwaway face gallery (file), never the real
+ones. Results are plain dicts that
+the command writes as JSON, so runs from different commits can be diffed.
+"""
+import logging
+import platform
+import statistics
+import subprocess
+from contextlib import contextmanager
+from datetime import date, timedelta
+from pathlib import Path
+from time import perf_counter
+
+import cv2
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+SEED = 1234
+# Students per course in the synthetic galleries (a typical lecture roster)
+COURSE_SIZE = 200
+
+
+def measure(fn, repeat=20, warmup=2):
+    """Time ``fn`` and return summary statistics in milliseconds"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = perf_counter()
+        fn()
+        samples.append((perf_counter() - started) * 1000)
+    samples.sort()
+    mean = statistics.fmean(samples)
+    return {
+        'repeat': repeat,
+        'mean_ms': round(mean, 4),
+        'p50_ms': round(samples[len(samples) // 2], 4),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 4),
+        'min_ms': round(samples[0], 4),
+        'ops_per_s': round(1000 / mean, 2) if mean else None,
+    }
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+            capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    from .descriptors import get_descriptor
+    return {
+        'commit': commit,
+        'timestamp': timezone.now().isoformat(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'machine': platform.machine(),
+        'descriptor': get_descriptor().version,
+    }
+
+
+def sample_photos():
+    """Sample frames shipped with the repo, plus a synthetic 12 MP frame"""
+    photos = sorted((Path(settings.MEDIA_ROOT) / 'student_photos').glob('*.jpg'))
+    frames = {photo.name: photo.read_bytes() for photo in photos[:3]}
+    if photos:
+        # Upscale a real photo to phone-camera size for the large-upload cases
+        image = cv2.imread(str(photos[0]))
+        large = cv2.resize(image, (4000, 3000), interpolation=cv2.INTER_CUBIC)
+        frames['synthetic_12mp.jpg'] = cv2.imencode('.jpg', large)[1].tobytes()
+    return frames
+
+
+def synthetic_gallery(size, dimension, rng):
+    """Random non-negative encodings, the same distribution the descriptors produce"""
+    return rng.random((size, dimension), dtype=np.float32)
+
+
+@contextmanager
+def face_log_mode(mode):
+    """Temporarily switch the attendance loggers between production and verbose levels"""
+    logger = logging.getLogger('attendance')
+    previous_level, previous_handlers = logger.level, logger.handlers
+    logger.setLevel(logging.DEBUG if mode == 'verbose' else logging.INFO)
+    # Keep formatting cost, drop terminal I/O noise
+    logger.handlers = [logging.NullHandler()] if mode == 'production' else [_FormattingHandler()]
+    try:
+        yield
+    finally:
+        logger.setLevel(previous_level)
+        logger.handlers = previous_handlers
+
+
+@contextmanager
+def isolated_face_gallery():
+    """
+    Swap a fresh FaceGallery in for the process-wide one, publishing to a
+    temporary file, so the endpoint cases never rewrite the gallery or ANN
+    index files that running workers share.
+    """
+    import tempfile
+    from unittest import mock
+
+    from django.test.utils import override_settings
+
+    from .gallery import FaceGallery
+
+    gallery = FaceGallery()
+    with tempfile.TemporaryDirectory() as tmp, \
+            override_settings(FACE_GALLERY_FILE=str(Path(tmp) / 'gallery.bin'), FACE_ANN_INDEX_FILE=None), \
+            mock.patch('attendance.gallery.face_gallery', gallery), \
+            mock.patch('attendance.views.face_gallery', gallery), \
+            mock.patch('attendance.signals.face_gallery', gallery):
+        yield gallery
+
+
+class _FormattingHandler(logging.Handler):
+    """Formats every record (like a real handler would) but writes nowhere"""
+
+    def emit(self, record):
+        self.format(record)
+
+
+def bench_image_pipeline(frames, repeat):
+    from .caches import frame_cache
+    from .views import DecodedImage, detect_face, extract_face_encoding, preprocess_image
+
+    results = []
+    for name, data in frames.items():
+        params = {'frame': name, 'bytes': len(data)}
+        results.append({'name': 'preprocess_image', 'params': params,
+                        **measure(lambda: preprocess_image(_upload(data)), repeat)})
+        results.append({'name': 'decode_for_encoding', 'params': params,
+                        **measure(lambda: DecodedImage(_upload(data)), repeat)})
+        results.append({'name': 'detect_face', 'params': params,
+                        **measure(lambda: (frame_cache.clear(), detect_face(data)), repeat)})
+        results.append({'name': 'extract_face_encoding', 'params': params,
+                        **measure(lambda: extract_face_encoding(_upload(data)), repeat)})
+        results += bench_probe(data, name, repeat)
+    return results
+
+
+def bench_probe(data, name, repeat):
+    """The compact payloads a kiosk with on-device detection sends instead of the frame"""
+    from .probes import read_probe
+    from .views import DecodedImage, encode_probe
+
+    decoded = DecodedImage(data)
+    faces = decoded.detect()
+    if not len(faces):
+        return []
+    x, y, w, h = max(faces, key=lambda face: face[2] * face[3])
+    pad = int(0.1 * w)
+    region = cv2.resize(decoded.gray[max(0, y - pad):y + h + pad, max(0, x - pad):x + w + pad], (128, 128))
+    box = ','.join(str(v) for v in decoded.to_source((x, y, w, h)))
+
+    results = []
+    for payload, probe_data in (('raw', region.tobytes()), ('jpeg', cv2.imencode('.jpg', region)[1].tobytes())):
+        params = {'frame': name, 'payload': payload, 'bytes': len(probe_data)}
+        results.append({'name': 'encode_probe', 'params': params,
+                        **measure(lambda: encode_probe(read_probe(_upload(probe_data), box)), repeat)})
+    return results
+
+
+def bench_matching(gallery_sizes, repeat, rng):
+    from django.test.utils import override_settings
+
+    from .descriptors import get_descriptor
+    from .gallery import FaceGallery
+    from .views import compare_faces
+
+    dimension = _descriptor_dimension(get_descriptor())
+    results = []
+
+    a, b = rng.random(dimension), rng.random(dimension)
+    results.append({'name': 'compare_faces', 'params': {'dimension': dimension},
+                    **measure(lambda: compare_faces(a, b), repeat * 10)})
+
+    # Synthetic galleries live in this process only; never map or publish the workers' shared file
+    with override_settings(FACE_GALLERY_FILE=None, FACE_ANN_INDEX_FILE=None):
+        for size in gallery_sizes:
+            encodings = synthetic_gallery(size, dimension, rng)
+            gallery = FaceGallery()
+            gallery._matrix = np.ascontiguousarray(encodings / np.linalg.norm(encodings, axis=1, keepdims=True))
+            gallery._pks = np.arange(size, dtype=np.int64)
+            gallery._courses = np.arange(size, dtype=np.int64) % max(1, size // COURSE_SIZE)
+            gallery._model_version = get_descriptor().version
+            gallery._loaded = True
+            probe = encodings[size // 2] + rng.normal(0, 0.01, dimension).astype(np.float32)
+            params = {'gallery_size': size, 'dimension': dimension}
+
+            results.append({'name': 'gallery_search', 'params': params,
+                            **measure(lambda: gallery.search(probe, top_k=1), repeat)})
+            probes = encodings[:32]
+            results.append({'name': 'gallery_search_batch32', 'params': params,
+                            **measure(lambda: gallery.search_batch(probes, top_k=1), repeat)})
+            course = int(gallery._courses[size // 2])
+            results.append({'name': 'gallery_search_course',
+                            'params': {**params, 'course_size': gallery.partition_size(course)},
+                            **measure(lambda: gallery.search(probe, top_k=1, course=course), repeat)})
+            results += bench_ann(gallery, encodings, repeat, rng, params)
+            if size <= 10000:
+                # The pre-gallery baseline: one compare_faces call per enrolled student
+                results.append({'name': 'python_loop_scan', 'params': params,
+                                **measure(lambda: [compare_faces(row, probe) for row in encodings],
+                                          max(3, repeat // 5), warmup=1)})
+    return results
+
+
+def bench_ann(gallery, encodings, repeat, rng, params, probe_counts=(1, 4, 8, 16), n_queries=200):
+    """
+    IVF search latency and recall@1 against the exact scan, per probe count.
+    Queries are enrolled encodings plus noise, so every query has a true match.
+    """
+    from .ann import IVFIndex
+
+    matrix, pks = gallery._matrix, gallery._pks
+    queries = encodings[rng.choice(len(encodings), min(n_queries, len(encodings)), replace=False)]
+    queries = queries + rng.normal(0, 0.1, queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    truth = [matches[0][0] for matches in gallery._exact_search(queries, matrix, pks, 1)]
+
+    started = perf_counter()
+    index = IVFIndex.train(matrix, pks, gallery.model_version)
+    results = [{'name': 'ivf_train', 'params': {**params, 'lists': index.n_lists},
+                'repeat': 1, 'mean_ms': round((perf_counter() - started) * 1000, 4)}]
+    for n_probes in probe_counts:
+        if n_probes > index.n_lists:
+            break
+        found = index.search_batch(queries, matrix, pks, top_k=1, n_probes=n_probes)
+        recall = sum(bool(matches) and matches[0][0] == pk for matches, pk in zip(found, truth)) / len(truth)
+        probe = queries[:1]
+        results.append({'name': 'gallery_search_ivf',
+                        'params': {**params, 'lists': index.n_lists, 'probes': n_probes},
+                        'recall_at_1': round(recall, 4),
+                        **measure(lambda: index.search_batch(probe, matrix, pks, top_k=1, n_probes=n_probes), repeat)})
+    return results
+
+
+def bench_endpoints(gallery_sizes, repeat, rng, attendance_rows=2000):
+    """Full HTTP paths against a throwaway database populated with synthetic students"""
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from django.test import Client
+
+    from .descriptors import get_descriptor
+    from .encodings import encode_face_encoding
+    from .models import Attendance, Course, Student
+
+    frames = sample_photos()
+    if not frames:
+        return []
+    # A private gallery: the process-wide one may publish to the workers' shared file
+    with isolated_face_gallery() as face_gallery:
+        frame = next(iter(frames.values()))
+        descriptor = get_descriptor()
+        dimension = _descriptor_dimension(descriptor)
+        client = Client()
+        course = Course.objects.create(name='Benchmark', code='BENCH')
+        results = []
+
+        # One real enrollment so every probe matches and takes the attendance write path
+        from .views import extract_face_encoding
+        probe_encoding, _, _ = extract_face_encoding(_upload(frame))
+        Student.objects.create(
+            student_id='PROBE', first_name='Probe', last_name='Student', email='probe@example.com',
+            course=course, face_encoding=encode_face_encoding(probe_encoding), face_encoding_model=descriptor.version,
+        )
+        enrolled = 1
+
+        for size in sorted(gallery_sizes):
+            encodings = synthetic_gallery(size - enrolled, dimension, rng)
+            Student.objects.bulk_create([
+                Student(
+                    student_id=f'B{enrolled + i:07d}', first_name='Bench', last_name=str(enrolled + i),
+                    email=f'bench{enrolled + i}@example.com', course=course,
+                    face_encoding=encode_face_encoding(encoding), face_encoding_model=descriptor.version,
+                )
+                for i, encoding in enumerate(encodings)
+            ], batch_size=1000)
+            enrolled = size
+            face_gallery.clear()
+            face_gallery.ensure_loaded()
+
+            def mark():
+                # Remove today's rows so every iteration takes the full write path
+                Attendance.objects.filter(date=timezone.now().date()).delete()
+                client.post('/api/attendance/mark_attendance/',
+                            {'image': SimpleUploadedFile('probe.jpg', frame, content_type='image/jpeg')})
+
+            for mode in ('production', 'verbose'):
+                with face_log_mode(mode):
+                    results.append({'name': 'mark_attendance_1_to_n',
+                                    'params': {'gallery_size': size, 'log_mode': mode},
+                                    **measure(mark, repeat)})
+
+        students = list(Student.objects.values_list('pk', flat=True)[:attendance_rows])
+        start = date(2024, 1, 1)
+        Attendance.objects.bulk_create([
+            Attendance(student_id=pk, date=start + timedelta(days=i % 365))
+            for i, pk in enumerate(students)
+        ], batch_size=1000)
+
+        for url in ('/api/students/', '/api/attendance/', '/api/attendance/stats/?start_date=2024-01-01&end_date=2024-12-31'):
+            results.append({'name': 'list_endpoint', 'params': {'url': url, 'students': enrolled},
+                            **measure(lambda: client.get(url), repeat)})
+        return results
+
+
+# SQLite before the production profile: rollback journal, full sync, Python's
+# default 5 s lock wait and a fresh connection for every request
+BASELINE_SQLITE_PRAGMAS = {'journal_mode': 'delete', 'synchronous': 'full', 'busy_timeout': 5000}
+
+
+def bench_concurrent_writes(threads=8, writes_per_thread=25):
+    """
+    The 9 a.m. burst: threads each look up a student and mark attendance, like
+    mark_attendance's write path. On SQLite this runs once with the baseline
+    profile and once with settings.SQLITE_PRAGMAS and persistent connections.
+    """
+    import threading
+
+    from django.db import connection
+    from django.test.utils import override_settings
+
+    from .marking import mark_present
+    from .models import Attendance, Course, Student
+
+    course = Course.objects.create(name='Burst', code='BURST')
+    Student.objects.bulk_create([
+        Student(student_id=f'W{i:05d}', first_name='Burst', last_name=str(i),
+                email=f'burst{i}@example.com', course=course)
+        for i in range(threads * writes_per_thread)
+    ])
+    pks = [student.pk for student in Student.objects.filter(course=course).order_by('pk')]
+
+    if connection.vendor == 'sqlite':
+        profiles = {'baseline': (BASELINE_SQLITE_PRAGMAS, False), 'tuned': (settings.SQLITE_PRAGMAS, True)}
+    else:
+        profiles = {connection.vendor: (None, True)}
+
+    results = []
+    for offset, (profile, (pragmas, reuse)) in enumerate(profiles.items()):
+        day = date(2030, 1, 1) + timedelta(days=offset)
+        errors = []
+
+        def worker(chunk):
+            try:
+                for pk in chunk:
+                    student = Student.objects.select_related('course').get(pk=pk)
+                    try:
+                        mark_present(student, 0.9, day)
+                    except Exception as e:
+                        errors.append(e)
+                    if not reuse:
+                        connection.close()
+            finally:
+                connection.close()
+
+        overrides = {'SQLITE_PRAGMAS': pragmas} if pragmas is not None else {}
+        with override_settings(**overrides):
+            # New connections pick up the profile's pragmas
+            connection.close()
+            connection.ensure_connection()
+            workers = [threading.Thread(target=worker, args=(pks[i::threads],)) for i in range(threads)]
+            started = perf_counter()
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+            elapsed = (perf_counter() - started) * 1000
+            connection.close()
+
+        writes = len(pks)
+        results.append({
+            'name': 'concurrent_attendance_writes',
+            'params': {'profile': profile, 'threads': threads},
+            'repeat': writes,
+            'mean_ms': round(elapsed / writes, 4),
+            'elapsed_ms': round(elapsed, 1),
+            'ops_per_s': round(writes / elapsed * 1000, 2),
+            'errors': len(errors),
+            'rows': Attendance.objects.filter(date=day, student__course=course).count(),
+        })
+    return results
+
+
+def _upload(data):
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    return SimpleUploadedFile('frame.jpg', data, content_type='image/jpeg')
+
+
+def _descriptor_dimension(descriptor):
+    patch = np.zeros((128, 128), dtype=np.uint8)
+    return int(descriptor.compute(patch).shape[0])
@@ -0,0 +1,117 @@
+"""
+Short-lived, in-process caches for the kiosk endpoints.
+
+Kiosks poll ``check_face`` every 500 ms and students double-tap "mark
+attendance", so the same work is often repeated within seconds:
+
+- ``frame_cache`` maps a frame's content hash to its detection result, so a
+  resent or unchanged frame skips decoding and the Haar cascade.
+- ``match_cache`` maps a frame's content hash to the student it matched in
+  ``mark_attendance``.
+- ``marked_today`` remembers (date, student pk) pairs that already have an
+  attendance row, so a duplicate ``mark_attendance`` call for a frame in
+  ``match_cache`` is answered before the frame is encoded. A call naming a
+  ``student_id`` is answered only after the face matches that student.
+
+Keys are exact content hashes: a changed frame is always processed again.
+Each cache is a bounded LRU whose entries also expire after a TTL, and each
+one counts hits, misses and evictions for ``/metrics``. The caches are per
+process. Attendance saves and deletes made in this process clear the
+``marked_today`` entries for the row's old and new (date, student) straight
+away (see signals.py). The TTL bounds how long another process can keep a
+stale entry.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+_MISSING = object()
+
+
+class TTLCache:
+    """Thread-safe LRU cache whose entries also expire ``ttl`` seconds after being set"""
+
+    def __init__(self, max_entries=256, ttl=5.0, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        now = self._clock()
+        with self._lock:
+            value, expires = self._entries.get(key, (_MISSING, None))
+            if value is not _MISSING and expires <= now:
+                del self._entries[key]
+                self.evictions += 1
+                value = _MISSING
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        if self.max_entries <= 0:
+            return
+        expires = self._clock() + self.ttl
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+frame_cache = TTLCache(
+    getattr(settings, 'FACE_FRAME_CACHE_SIZE', 256),
+    getattr(settings, 'FACE_FRAME_CACHE_TTL', 5.0),
+)
+match_cache = TTLCache(
+    getattr(settings, 'FACE_FRAME_CACHE_SIZE', 256),
+    getattr(settings, 'FACE_FRAME_CACHE_TTL', 5.0),
+)
+marked_today = TTLCache(
+    getattr(settings, 'FACE_MARKED_CACHE_SIZE', 10000),
+    getattr(settings, 'FACE_MARKED_CACHE_TTL', 300.0),
+)
+
+CACHES = {'frames': frame_cache, 'matches': match_cache, 'marked': marked_today}
+
+
+def frame_digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def clear_caches():
+    for cache in CACHES.values():
+        cache.clear()
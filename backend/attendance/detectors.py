@@ -0,0 +1,94 @@
+"""
+Haar cascade face detection shared by every request thread.
+
+``cv2.CascadeClassifier`` is not documented as thread-safe, so each thread
+gets its own classifier. It is loaded lazily on that thread's first
+detection, not at import. A semaphore caps how many ``detectMultiScale``
+calls run at once (``FACE_DETECTION_CONCURRENCY``), so a burst of kiosk
+requests queues up instead of oversubscribing the CPU.
+
+OpenCV also runs its own worker threads inside ``detectMultiScale``. Under
+a threaded web server they compete with the request threads, so the pool
+sets ``cv2.setNumThreads(FACE_OPENCV_THREADS)`` once, before the first
+detection. The default is 1: the parallelism comes from the request
+threads.
+"""
+import logging
+import os
+import threading
+
+import cv2
+from django.conf import settings
+
+from .facelog import current_request_log
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CASCADE = 'haarcascade_frontalface_default.xml'
+
+
+class CascadeDetectorPool:
+    """Per-thread cascade classifiers behind a concurrency limit"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._semaphore = None
+        self._configured = False
+
+    @property
+    def cascade_path(self):
+        return getattr(settings, 'FACE_CASCADE_PATH', None) or cv2.data.haarcascades + DEFAULT_CASCADE
+
+    @property
+    def concurrency(self):
+        return getattr(settings, 'FACE_DETECTION_CONCURRENCY', None) or os.cpu_count() or 1
+
+    def _configure(self):
+        with self._lock:
+            if self._configured:
+                return
+            threads = getattr(settings, 'FACE_OPENCV_THREADS', 1)
+            if threads is not None:
+                cv2.setNumThreads(threads)
+            self._semaphore = threading.BoundedSemaphore(self.concurrency)
+            self._configured = True
+            logger.info(f"Face detector pool: {self.concurrency} concurrent detections, OpenCV threads={cv2.getNumThreads()}")
+
+    def classifier(self):
+        cascade = getattr(self._local, 'cascade', None)
+        if cascade is None:
+            path = self.cascade_path
+            cascade = cv2.CascadeClassifier(path)
+            if cascade.empty():
+                raise RuntimeError(f"Could not load face cascade from {path}")
+            self._local.cascade = cascade
+        return cascade
+
+    def detect(self, gray, min_face_size=(30, 30)):
+        """Run the cascade on a grayscale image and return every (x, y, w, h) box"""
+        if not self._configured:
+            self._configure()
+        cascade = self.classifier()
+        with current_request_log().stage('detect_wait'):
+            self._semaphore.acquire()
+        try:
+            return cascade.detectMultiScale(
+                gray,
+                scaleFactor=1.1,
+                minNeighbors=5,
+                minSize=min_face_size,
+                flags=cv2.CASCADE_SCALE_IMAGE
+            )
+        finally:
+            self._semaphore.release()
+
+    def reset(self):
+        """Forget the configuration and this thread's classifier (after settings change)"""
+        with self._lock:
+            self._configured = False
+            self._semaphore = None
+        self._local = threading.local()
+
+
+detector_pool = CascadeDetectorPool()
@@ -0,0 +1,120 @@
+"""
+Storage format for ``Student.face_encoding``.
+
+Encodings used to be stored as a bare float64 ``tobytes()`` dump. The current
+format prefixes the payload with a small header so the dtype, length and
+compression can change without breaking rows that were written earlier:
+
+    magic     4s   b'FENC'
+    version   B    format version (currently 1)
+    dtype     B    1 = float16, 2 = float32, 3 = float64
+    flags     B    bit 0 set when the payload is lz4-compressed
+    reserved  B
+    length    I    number of elements
+
+Blobs without the magic prefix are treated as legacy raw float64.
+"""
+import logging
+import struct
+
+import numpy as np
+from django.conf import settings
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # lz4 is optional; compression is simply unavailable
+    lz4_frame = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'FENC'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sBBBBI')
+FLAG_LZ4 = 0x01
+
+DTYPE_CODES = {
+    'float16': 1,
+    'float32': 2,
+    'float64': 3,
+}
+CODE_DTYPES = {code: np.dtype(name) for name, code in DTYPE_CODES.items()}
+
+
+def default_dtype():
+    return getattr(settings, 'FACE_ENCODING_DTYPE', 'float32')
+
+
+def default_compression():
+    return getattr(settings, 'FACE_ENCODING_COMPRESSION', False)
+
+
+def is_legacy_encoding(blob):
+    """True when the blob is a raw float64 dump written before the header format"""
+    return bytes(blob[:len(MAGIC)]) != MAGIC
+
+
+def encode_face_encoding(encoding, dtype=None, compress=None):
+    """Serialize a 1-D face encoding into the versioned storage format"""
+    dtype = dtype or default_dtype()
+    compress = default_compression() if compress is None else compress
+    if dtype not in DTYPE_CODES:
+        raise ValueError(f"Unsupported face encoding dtype: {dtype}")
+
+    vector = np.ascontiguousarray(np.asarray(encoding).ravel(), dtype=dtype)
+    payload = vector.tobytes()
+    flags = 0
+    if compress:
+        if lz4_frame is None:
+            logger.warning("lz4 is not installed; storing face encoding uncompressed")
+        else:
+            payload = lz4_frame.compress(payload)
+            flags |= FLAG_LZ4
+
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, DTYPE_CODES[dtype], flags, 0, vector.shape[0])
+    return header + payload
+
+
+def decode_face_encoding(blob):
+    """Deserialize a stored face encoding (legacy or versioned) into a float32 vector"""
+    if blob is None:
+        return None
+    blob = bytes(blob)
+    if is_legacy_encoding(blob):
+        return np.frombuffer(blob, dtype=np.float64).astype(np.float32)
+
+    magic, version, dtype_code, flags, _, length = HEADER.unpack_from(blob)
+    if version > FORMAT_VERSION:
+        raise ValueError(f"Face encoding format version {version} is newer than supported ({FORMAT_VERSION})")
+    if dtype_code not in CODE_DTYPES:
+        raise ValueError(f"Unknown face encoding dtype code: {dtype_code}")
+
+    payload = blob[HEADER.size:]
+    if flags & FLAG_LZ4:
+        if lz4_frame is None:
+            raise ValueError("Face encoding is lz4-compressed but lz4 is not installed")
+        payload = lz4_frame.decompress(payload)
+
+    vector = np.frombuffer(payload, dtype=CODE_DTYPES[dtype_code])
+    if vector.shape[0] != length:
+        raise ValueError(f"Face encoding length mismatch: header says {length}, payload has {vector.shape[0]}")
+    return vector.astype(np.float32)
+
+
+def upgrade_face_encoding(student):
+    """
+    Rewrite a legacy float64 encoding in the compact format.
+
+    Uses a queryset ``update`` so the row's ``updated_at`` and the save signals
+    are left alone; the decoded values are unchanged apart from precision.
+    """
+    from .models import Student
+
+    if not student.face_encoding or not is_legacy_encoding(student.face_encoding):
+        return False
+    legacy = bytes(student.face_encoding)
+    compact = encode_face_encoding(decode_face_encoding(legacy))
+    # Only overwrite the row if nobody re-enrolled the face in the meantime
+    Student.objects.filter(pk=student.pk, face_encoding=legacy).update(face_encoding=compact)
+    student.face_encoding = compact
+    logger.info(f"Upgraded face encoding for student {student.student_id} to compact format")
+    return True
@@ -0,0 +1,206 @@
+"""
+Bulk student enrollment from a roster CSV and a directory of photos.
+
+The roster is read as a stream and handled in chunks: each chunk's photos are
+encoded in parallel across a joblib process pool, then its students are
+written with ``bulk_create``/``bulk_update``. Memory stays bounded by the
+chunk size no matter how long the roster is.
+
+Expected CSV columns: ``student_id``, ``first_name``, ``last_name``,
+``email``, ``course`` (course code, optional) and ``photo`` (file name
+relative to the photo directory, optional). Rows whose photo resolves outside
+the photo directory (``../``, absolute paths, symlinks) are rejected.
+
+Model imports are kept inside functions: ``encode_photo`` runs in freshly
+spawned worker processes that import this module before Django is set up.
+"""
+import csv
+import logging
+import os
+from pathlib import Path
+
+from joblib import Parallel, delayed
+
+logger = logging.getLogger(__name__)
+
+REQUIRED_COLUMNS = ('student_id', 'first_name', 'last_name', 'email')
+
+
+def _ensure_django():
+    """Set up Django inside a joblib worker process"""
+    from django.apps import apps
+    if not apps.ready:
+        import django
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+        django.setup()
+
+
+def encode_photo(path, descriptor_name=None):
+    """Worker: detect and encode the face in one photo; returns (encoding, confidence, error)"""
+    _ensure_django()
+    from .descriptors import get_descriptor
+    from .views import MIN_ENROLLMENT_CONFIDENCE, extract_face_encoding
+
+    if not os.path.isfile(path):
+        return None, None, 'Photo not found'
+    encoding, confidence, _ = extract_face_encoding(path, descriptor=get_descriptor(descriptor_name))
+    if encoding is None:
+        return None, None, 'No face detected'
+    if confidence < MIN_ENROLLMENT_CONFIDENCE:
+        return None, confidence, 'Face detection confidence too low'
+    return encoding, confidence, None
+
+
+def iter_chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class RosterImporter:
+    """Streams roster rows into Student records; see the module docstring"""
+
+    def __init__(self, photo_dir, n_jobs=-1, chunk_size=200, update_existing=False, progress=None):
+        self.photo_dir = Path(photo_dir) if photo_dir else None
+        self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
+        self.update_existing = update_existing
+        self.progress = progress
+        self.report = {'processed': 0, 'created': 0, 'updated': 0, 'encoded': 0, 'failed': []}
+
+    def fail(self, line, row, error):
+        self.report['failed'].append({'line': line, 'student_id': row.get('student_id', ''), 'error': error})
+
+    def run(self, csv_file):
+        from .descriptors import get_descriptor
+        from .gallery import face_gallery
+        from .models import Course
+
+        reader = csv.DictReader(csv_file)
+        missing = [column for column in REQUIRED_COLUMNS if column not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f"Roster is missing columns: {', '.join(missing)}")
+
+        self.courses = Course.objects.in_bulk(field_name='code')
+        self.descriptor = get_descriptor()
+        # Line 1 is the header
+        rows = ((line, row) for line, row in enumerate(reader, start=2))
+
+        with Parallel(n_jobs=self.n_jobs) as parallel:
+            for chunk in iter_chunks(rows, self.chunk_size):
+                self.import_chunk(chunk, parallel)
+                self.report['processed'] += len(chunk)
+                if self.progress:
+                    self.progress(self.report)
+
+        # bulk writes bypass the save signals the gallery listens to
+        face_gallery.clear()
+        return self.report
+
+    def import_chunk(self, chunk, parallel):
+        from django.db import transaction
+        from django.utils import timezone
+        from .models import Student
+        from .rollups import record_course_changes
+
+        valid = []
+        photo_paths = []
+        for line, row in chunk:
+            row = {key: (value or '').strip() for key, value in row.items() if key}
+            if not all(row.get(column) for column in REQUIRED_COLUMNS):
+                self.fail(line, row, 'Missing required field')
+                continue
+            course_code = row.get('course')
+            if course_code and course_code not in self.courses:
+                self.fail(line, row, f'Unknown course {course_code}')
+                continue
+            try:
+                photo_paths.append(self.photo_path(row))
+            except ValueError as e:
+                self.fail(line, row, str(e))
+                continue
+            valid.append((line, row))
+
+        # Encode the chunk's photos across the process pool
+        jobs = [(i, path) for i, path in enumerate(photo_paths) if path]
+        encoded = parallel(delayed(encode_photo)(str(path), self.descriptor.name) for _, path in jobs)
+        encodings = {i: result for (i, _), result in zip(jobs, encoded)}
+
+        existing = Student.objects.in_bulk([row['student_id'] for _, row in valid], field_name='student_id')
+        to_create, to_update = [], []
+        previous_courses = {}
+        for i, (line, row) in enumerate(valid):
+            student = existing.get(row['student_id'])
+            if student is not None and not self.update_existing:
+                self.fail(line, row, 'Student already exists')
+                continue
+            if student is None:
+                student = Student(student_id=row['student_id'])
+                to_create.append((line, row, student))
+            else:
+                to_update.append((line, row, student))
+                previous_courses[student.pk] = student.course_id
+
+            # bulk_update skips auto_now; other workers' galleries refresh from updated_at
+            student.updated_at = timezone.now()
+            student.first_name = row['first_name']
+            student.last_name = row['last_name']
+            student.email = row['email']
+            if row.get('course'):
+                student.course = self.courses[row['course']]
+
+            if i in encodings:
+                encoding, _, error = encodings[i]
+                if error:
+                    self.fail(line, row, f'Photo {row["photo"]}: {error}')
+                else:
+                    student.photo = self.store_photo(photo_paths[i])
+                    student.set_face_encoding(encoding, model_version=self.descriptor.version)
+                    self.report['encoded'] += 1
+
+        fields = ['first_name', 'last_name', 'email', 'course', 'photo', 'face_encoding', 'face_encoding_model',
+                  'updated_at']
+        try:
+            with transaction.atomic():
+                Student.objects.bulk_create([student for _, _, student in to_create])
+                Student.objects.bulk_update([student for _, _, student in to_update], fields)
+                # bulk_update sends no signals; keep the attendance rollup on the students' new courses
+                record_course_changes({
+                    student.pk: (previous_courses[student.pk], student.course_id) for _, _, student in to_update
+                })
+            self.report['created'] += len(to_create)
+            self.report['updated'] += len(to_update)
+        except Exception as e:
+            # A duplicate email or similar broke the bulk write; retry row by row to pin it down
+            logger.warning(f"Bulk write failed ({e}); retrying chunk row by row")
+            for key, items in (('created', to_create), ('updated', to_update)):
+                for line, row, student in items:
+                    try:
+                        with transaction.atomic():
+                            student.save()
+                        self.report[key] += 1
+                    except Exception as row_error:
+                        self.fail(line, row, str(row_error))
+
+    def photo_path(self, row):
+        """The row's photo inside photo_dir; raises ValueError for a path that escapes it"""
+        if not row.get('photo') or self.photo_dir is None:
+            return None
+        root = self.photo_dir.resolve()
+        path = (root / row['photo']).resolve()
+        if not path.is_relative_to(root):
+            raise ValueError(f'Photo {row["photo"]} is outside the photo directory')
+        return path
+
+    def store_photo(self, path):
+        """Copy the photo into media storage and return its stored name"""
+        from django.core.files import File
+        from django.core.files.storage import default_storage
+
+        with open(path, 'rb') as f:
+            return default_storage.save(f'student_photos/{path.name}', File(f))
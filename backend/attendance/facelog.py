@@ -0,0 +1,126 @@
+"""
+Structured, per-request logging for the face pipeline.
+
+Instead of logging every step (and formatting numpy arrays) at INFO, the face
+endpoints collect what happened into one ``FaceRequestLog`` and emit a single
+summary record when the request finishes: outcome, candidates scanned, best
+similarity and per-stage timings in milliseconds. The record is available as
+``record.face_request`` for structured handlers.
+
+Step-by-step detail is still logged at DEBUG with lazy ``%s`` arguments, so
+nothing is formatted unless ``FACE_LOG_MODE = 'verbose'`` turns DEBUG on for
+the ``attendance`` loggers (see settings.LOGGING).
+
+The same timings feed the latency summaries in metrics.py and, when
+``FACE_SERVER_TIMING`` is on, a ``Server-Timing`` response header.
+"""
+import functools
+import logging
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+from django.conf import settings
+
+logger = logging.getLogger('attendance.face_requests')
+
+_local = threading.local()
+
+
+class _KeyValues:
+    """Renders a dict as ``key=value`` pairs, only when the record is formatted"""
+
+    def __init__(self, fields):
+        self.fields = fields
+
+    def __str__(self):
+        parts = []
+        for key, value in self.fields.items():
+            if isinstance(value, float):
+                value = f'{value:.4f}'
+            elif isinstance(value, dict):
+                value = ','.join(f'{k}:{v:.2f}' for k, v in value.items())
+            parts.append(f'{key}={value}')
+        return ' '.join(parts)
+
+
+class FaceRequestLog:
+    """Collects fields and stage timings for one face-pipeline request"""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.fields = {}
+        self.timings = {}
+        self._started = perf_counter()
+
+    def set(self, **fields):
+        self.fields.update(fields)
+
+    @contextmanager
+    def stage(self, name):
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (perf_counter() - started) * 1000
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed
+
+    def emit(self):
+        record = {'endpoint': self.endpoint, **self.fields}
+        record['total_ms'] = (perf_counter() - self._started) * 1000
+        record['stages_ms'] = self.timings
+        logger.info('face_request %s', _KeyValues(record), extra={'face_request': record})
+        return record
+
+
+class _NullRequestLog:
+    """Stand-in used outside a request (management commands, workers, tests)"""
+
+    def set(self, **fields):
+        pass
+
+    @contextmanager
+    def stage(self, name):
+        yield
+
+
+_null_log = _NullRequestLog()
+
+
+def current_request_log():
+    return getattr(_local, 'current', None) or _null_log
+
+
+def server_timing_header(record):
+    """Format stage timings for the ``Server-Timing`` response header"""
+    entries = [f'{stage};dur={elapsed:.1f}' for stage, elapsed in record['stages_ms'].items()]
+    entries.append(f"total;dur={record['total_ms']:.1f}")
+    return ', '.join(entries)
+
+
+def face_request_logged(endpoint):
+    """
+    View-method decorator: collect a FaceRequestLog, emit it when the response
+    is ready and feed its timings to the /metrics registry.
+    """
+    def decorator(view_method):
+        @functools.wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            from .metrics import metrics_enabled, registry
+
+            request_log = FaceRequestLog(endpoint)
+            _local.current = request_log
+            try:
+                response = view_method(self, request, *args, **kwargs)
+                request_log.set(status=response.status_code)
+            finally:
+                _local.current = None
+                record = request_log.emit()
+                if metrics_enabled():
+                    registry.observe_request(record)
+
+            if getattr(settings, 'FACE_SERVER_TIMING', False):
+                response['Server-Timing'] = server_timing_header(record)
+            return response
+        return wrapper
+    return decorator
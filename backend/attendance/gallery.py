@@ -0,0 +1,576 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max
+
+from . import gallery_file
+from .ann import IVFIndex
+from .descriptors import FALSE_MATCH_RATE, calibrate_threshold, get_descriptor, match_threshold
+from .encodings import decode_face_encoding
+
+logger = logging.getLogger(__name__)
+
+# Course array value for students without a course
+NO_COURSE = -1
+# Deferred students re-read from the database per query
+FLUSH_CHUNK = 500
+
+
+def normalize_encoding(encoding):
+    """Return a unit-length float32 copy of a face encoding (or None for zero vectors)"""
+    vector = np.asarray(encoding, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vector)
+    if not np.isfinite(norm) or norm == 0:
+        return None
+    return vector / norm
+
+
+class _Deferred(threading.local):
+    """Per-thread students whose gallery update waits for ``FaceGallery.flush``"""
+
+    def __init__(self):
+        self.depth = 0
+        self.dirty = set()
+
+
+class FaceGallery:
+    """
+    Process-wide index of enrolled face encodings.
+
+    Encodings are kept as a contiguous, pre-normalized float32 matrix with a
+    parallel array of Student primary keys, so a 1:N lookup is a single
+    matrix-vector product instead of a Python loop over every student.
+    Updates replace the arrays rather than mutating them, so searches can run
+    on a snapshot without holding the lock.
+
+    Signals only update the gallery of the process that made the write. So
+    without a shared file, the gallery compares a cheap database stamp (count,
+    newest ``updated_at`` and highest pk of the indexed students) at most every
+    ``FACE_GALLERY_REFRESH_INTERVAL`` seconds. Edits made by other workers or
+    management commands are then applied row by row. A count that no longer
+    adds up (a delete) triggers a full reload.
+
+    With ``FACE_GALLERY_FILE`` set, the arrays are memory-mapped from a file
+    shared by all worker processes (see gallery_file.py). Updates republish
+    the file, and other workers remap it when they see it change. Rewriting
+    the file costs O(N), so updates made inside a transaction are deferred
+    until it commits. Updates inside ``batched()`` are deferred until the
+    block ends. Either way, ``flush`` re-reads the affected students and
+    applies them with one copy of the arrays and one publish.
+
+    A third parallel array holds each student's course, so a search can be
+    scoped to one course's partition: a kiosk outside a lecture hall only
+    compares the probe with that course's students.
+
+    With ``FACE_ANN_ENABLED``, galleries of at least ``FACE_ANN_MIN_SIZE``
+    students are searched through an IVF index (see ann.py) instead of the
+    full product.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._matrix = None
+        self._pks = np.empty(0, dtype=np.int64)
+        self._courses = np.empty(0, dtype=np.int64)
+        self._model_version = None
+        self._loaded = False
+        self._file_identity = None
+        self._ann = None
+        self._ann_lock = threading.Lock()
+        self._partitions = None
+        # Database stamp of the indexed rows, the rows skipped when loading, and the last check
+        self._db_stamp = None
+        self._unindexed = 0
+        self._checked_at = 0.0
+        self._deferred = _Deferred()
+
+    @property
+    def shared_path(self):
+        return getattr(settings, 'FACE_GALLERY_FILE', None)
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    @property
+    def size(self):
+        self.ensure_loaded()
+        return len(self._pks)
+
+    @property
+    def model_version(self):
+        """Descriptor version of the indexed encodings; other versions are never indexed"""
+        return self._model_version
+
+    @property
+    def dimension(self):
+        matrix = self._matrix
+        return None if matrix is None else matrix.shape[1]
+
+    def ensure_loaded(self):
+        if not self._loaded:
+            self.load()
+        elif self.shared_path:
+            if gallery_file.file_identity(self.shared_path) != self._file_identity:
+                # Another worker published a new generation (or dropped the file)
+                self.load()
+        elif self._db_stamp is not None:
+            interval = getattr(settings, 'FACE_GALLERY_REFRESH_INTERVAL', 2.0)
+            if interval is not None and time.monotonic() - self._checked_at >= interval:
+                self.refresh()
+
+    def _indexed_rows(self, model_version):
+        from .models import Student
+        return Student.objects.exclude(face_encoding__isnull=True).filter(face_encoding_model=model_version)
+
+    def _stamp(self, model_version):
+        stamp = self._indexed_rows(model_version).aggregate(count=Count('pk'), changed=Max('updated_at'), last=Max('pk'))
+        return stamp['count'], stamp['changed'], stamp['last']
+
+    def refresh(self):
+        """Apply student rows written by other processes since the last check"""
+        previous = self._db_stamp
+        self._checked_at = time.monotonic()
+        stamp = self._stamp(self._model_version)
+        if stamp == previous:
+            return
+        if previous[1] is not None:
+            changed = (
+                self._indexed_rows(self._model_version)
+                .filter(updated_at__gte=previous[1])
+                .values_list('pk', 'face_encoding', 'course_id')
+            )
+            self._apply_changes(*self._decode_rows(changed.iterator(chunk_size=FLUSH_CHUNK)))
+        with self._lock:
+            consistent = stamp[0] == len(self._pks) + self._unindexed
+            if consistent:
+                self._db_stamp = stamp
+        if not consistent:
+            # Rows were deleted or lost their encoding
+            self.load()
+
+    def load(self):
+        """(Re)build the index from every student that has a face encoding"""
+        model_version = get_descriptor().version
+        path = self.shared_path
+        if path:
+            shared = gallery_file.read_gallery(path)
+            if shared is not None and shared.model_version == model_version:
+                with self._lock:
+                    self._adopt(shared)
+                logger.debug("Face gallery mapped generation %d from %s", shared.generation, path)
+                return
+
+        # Stamped before reading, so writes made during the load are applied by the next refresh
+        stamp = None if path else self._stamp(model_version)
+        self._checked_at = time.monotonic()
+        rows = self._indexed_rows(model_version).values_list('pk', 'face_encoding', 'course_id')
+        pks = []
+        courses = []
+        vectors = []
+        dimension = None
+        skipped = 0
+        for pk, blob, course_id in rows.iterator(chunk_size=500):
+            vector = normalize_encoding(decode_face_encoding(blob))
+            if vector is None:
+                skipped += 1
+                continue
+            if dimension is None:
+                dimension = vector.shape[0]
+            elif vector.shape[0] != dimension:
+                logger.warning(f"Skipping student {pk}: encoding has {vector.shape[0]} dims, expected {dimension}")
+                skipped += 1
+                continue
+            pks.append(pk)
+            courses.append(NO_COURSE if course_id is None else course_id)
+            vectors.append(vector)
+
+        with self._lock, self._publishing():
+            self._matrix = np.ascontiguousarray(np.vstack(vectors)) if vectors else None
+            self._pks = np.asarray(pks, dtype=np.int64)
+            self._courses = np.asarray(courses, dtype=np.int64)
+            self._model_version = model_version
+            self._loaded = True
+            self._ann = None
+            self._unindexed = skipped
+            self._db_stamp = stamp
+        logger.info(f"Face gallery loaded with {len(pks)} {model_version} encodings")
+        self._warn_other_versions(model_version)
+
+    def _warn_other_versions(self, model_version):
+        """Log students whose encodings came from another descriptor, e.g. after FACE_DESCRIPTOR changed"""
+        from .models import Student
+        other = Student.objects.exclude(face_encoding__isnull=True).exclude(face_encoding_model=model_version).count()
+        if other:
+            logger.warning(
+                f"{other} students have face encodings from another descriptor and cannot be matched; "
+                f"run 'python manage.py reencode_faces' to re-encode them with {model_version}"
+            )
+
+    def clear(self):
+        """Drop the index; it is rebuilt from the database on next use"""
+        with self._lock:
+            self._matrix = None
+            self._pks = np.empty(0, dtype=np.int64)
+            self._courses = np.empty(0, dtype=np.int64)
+            self._loaded = False
+            self._file_identity = None
+            self._ann = None
+            self._db_stamp = None
+            # Everything is re-read from the database anyway
+            self._deferred.dirty = set()
+            path = self.shared_path
+            if path:
+                # Bulk writes bypassed the signals, so every worker must rebuild
+                with gallery_file.write_lock(path):
+                    gallery_file.remove_gallery(path)
+
+    def _adopt(self, shared):
+        self._matrix = shared.matrix
+        self._pks = shared.pks
+        self._courses = shared.courses
+        self._model_version = shared.model_version
+        self._file_identity = shared.identity
+        self._loaded = True
+
+    @contextmanager
+    def _publishing(self):
+        """
+        Wrap an update of the arrays (with the lock held). In shared mode, start
+        from the newest published file and write the result back as the next
+        generation; a no-op update leaves the file alone.
+        """
+        path = self.shared_path
+        if not path:
+            yield
+            return
+        with gallery_file.write_lock(path):
+            shared = gallery_file.read_gallery(path)
+            generation = shared.generation if shared is not None else 0
+            if (self._loaded and shared is not None and shared.identity != self._file_identity
+                    and shared.model_version == self._model_version):
+                self._adopt(shared)
+            matrix, pks, courses = self._matrix, self._pks, self._courses
+            yield
+            if (shared is not None and self._matrix is matrix and self._pks is pks
+                    and self._courses is courses):
+                return
+            gallery_file.write_gallery(path, self._matrix, self._pks, self._courses, self._model_version,
+                                       generation + 1)
+            self._adopt(gallery_file.read_gallery(path))
+
+    def upsert(self, pk, encoding, model_version, course_id=None):
+        """Add or replace the encoding (and course) stored for a student"""
+        if not self._loaded:
+            # Nothing to patch yet; the next load reads the row from the database
+            return
+        if self._defer(pk):
+            return
+        if model_version != self._model_version:
+            self.remove(pk)
+            return
+        vector = normalize_encoding(encoding)
+        if vector is None:
+            self.remove(pk)
+            return
+        self._apply_changes([(pk, vector, course_id)], ())
+
+    def remove(self, pk):
+        """Remove a student from the index if present"""
+        if not self._loaded or self._defer(pk):
+            return
+        with self._lock, self._publishing():
+            self._remove_locked(pk)
+
+    def move(self, pk, course_id):
+        """Record a student's new course without touching their encoding"""
+        if not self._loaded or self._defer(pk):
+            return
+        course = NO_COURSE if course_id is None else course_id
+        with self._lock, self._publishing():
+            rows = np.flatnonzero(self._pks == pk)
+            if rows.size and (self._courses[rows] != course).any():
+                courses = self._courses.copy()
+                courses[rows] = course
+                self._courses = courses
+
+    def _defer(self, pk):
+        """Note ``pk`` for ``flush`` instead of updating now: inside ``batched`` or a shared-file transaction"""
+        deferred = self._deferred
+        if deferred.depth:
+            deferred.dirty.add(pk)
+            return True
+        if self.shared_path and transaction.get_connection().in_atomic_block:
+            deferred.dirty.add(pk)
+            # Registered per write: a rolled-back transaction drops its callbacks
+            transaction.on_commit(self.flush)
+            return True
+        return False
+
+    @contextmanager
+    def batched(self):
+        """
+        Defer the gallery updates of this thread's student writes to the end
+        of the block, e.g. in a bulk command, and apply them with one ``flush``
+        (after the commit when a shared file is published from a transaction).
+        """
+        deferred = self._deferred
+        deferred.depth += 1
+        try:
+            yield
+        finally:
+            deferred.depth -= 1
+            if not deferred.depth:
+                if self.shared_path and transaction.get_connection().in_atomic_block:
+                    transaction.on_commit(self.flush)
+                else:
+                    self.flush()
+
+    def flush(self):
+        """Apply the deferred students from their current database rows in one pass"""
+        deferred = self._deferred
+        dirty, deferred.dirty = deferred.dirty, set()
+        if not dirty or not self._loaded:
+            return
+        pending = list(dirty)
+        rows = []
+        for start in range(0, len(pending), FLUSH_CHUNK):
+            rows.extend(
+                self._indexed_rows(self._model_version)
+                .filter(pk__in=pending[start:start + FLUSH_CHUNK])
+                .values_list('pk', 'face_encoding', 'course_id')
+            )
+        upserts, removed = self._decode_rows(rows)
+        # Deleted students, and ones without an encoding of this version, leave the gallery
+        removed.extend(dirty.difference(pk for pk, _, _ in upserts))
+        self._apply_changes(upserts, removed)
+
+    @staticmethod
+    def _decode_rows(rows):
+        """Split (pk, encoding blob, course_id) rows into upserts and pks to remove"""
+        upserts = []
+        removed = []
+        for pk, blob, course_id in rows:
+            vector = normalize_encoding(decode_face_encoding(blob))
+            if vector is None:
+                removed.append(pk)
+            else:
+                upserts.append((pk, vector, course_id))
+        return upserts, removed
+
+    def _apply_changes(self, upserts, removed):
+        """
+        Upsert (pk, normalized vector, course_id) rows and drop ``removed`` pks
+        with a single copy of the arrays and, in shared mode, a single publish.
+        """
+        if not upserts and not removed:
+            return
+        with self._lock, self._publishing():
+            matrix, pks, courses = self._matrix, self._pks, self._courses
+            dimension = matrix.shape[1] if matrix is not None else upserts[0][1].shape[0] if upserts else None
+            removed = set(removed)
+            updates = {}
+            for pk, vector, course_id in upserts:
+                if vector.shape[0] != dimension:
+                    logger.warning(f"Not indexing student {pk}: encoding has {vector.shape[0]} dims, expected {dimension}")
+                    removed.add(pk)
+                    continue
+                removed.discard(pk)
+                updates[pk] = (vector, NO_COURSE if course_id is None else course_id)
+
+            if removed and pks.size:
+                keep = ~np.isin(pks, np.fromiter(removed, dtype=np.int64, count=len(removed)))
+                if not keep.all():
+                    pks, courses = pks[keep], courses[keep]
+                    matrix = np.ascontiguousarray(matrix[keep]) if pks.size else None
+            indexed = [(pk, vector) for pk, (vector, _) in updates.items()]
+            if updates:
+                # Existing students keep their row; new ones are appended in one block
+                existing = np.flatnonzero(np.isin(pks, np.fromiter(updates, dtype=np.int64, count=len(updates))))
+                if existing.size:
+                    matrix, courses = matrix.copy(), courses.copy()
+                    for row in existing:
+                        matrix[row], courses[row] = updates.pop(int(pks[row]))
+                if updates:
+                    added = np.stack([vector for vector, _ in updates.values()])
+                    matrix = added if matrix is None else np.vstack([matrix, added])
+                    pks = np.concatenate([pks, np.fromiter(updates, dtype=np.int64, count=len(updates))])
+                    courses = np.concatenate([courses, np.asarray([course for _, course in updates.values()],
+                                                                  dtype=np.int64)])
+            self._matrix, self._pks, self._courses = matrix, pks, courses
+
+            if self._ann is not None and indexed:
+                self._ann.add([pk for pk, _ in indexed], np.stack([vector for _, vector in indexed]))
+
+    def _remove_locked(self, pk):
+        keep = self._pks != pk
+        if keep.all():
+            return
+        self._pks = self._pks[keep]
+        self._courses = self._courses[keep]
+        self._matrix = np.ascontiguousarray(self._matrix[keep]) if self._pks.size else None
+
+    def search(self, encoding, top_k=1, course=None):
+        """
+        Return up to ``top_k`` (student_pk, cosine_similarity) pairs for the
+        probe encoding, best match first. ``course`` limits the candidates to
+        that course's students.
+        """
+        return self.search_batch([encoding], top_k=top_k, course=course)[0]
+
+    def search_batch(self, encodings, top_k=1, course=None):
+        """
+        Match several probe encodings at once with a single matrix product.
+
+        Returns one ``search``-style result list per probe, in input order.
+        """
+        self.ensure_loaded()
+        with self._lock:
+            # The three arrays are replaced one by one; read them as one snapshot
+            matrix, pks, courses = self._matrix, self._pks, self._courses
+        results = [[] for _ in encodings]
+        if matrix is None or not pks.size:
+            return results
+        if course is not None:
+            matrix, pks = self.partition(matrix, pks, courses, course)
+            if not pks.size:
+                return results
+
+        rows = []
+        probes = []
+        for row, encoding in enumerate(encodings):
+            probe = normalize_encoding(encoding)
+            if probe is None:
+                continue
+            if probe.shape[0] != matrix.shape[1]:
+                logger.warning(f"Probe encoding has {probe.shape[0]} dims, gallery has {matrix.shape[1]}")
+                continue
+            rows.append(row)
+            probes.append(probe)
+        if not probes:
+            return results
+
+        probes = np.vstack(probes)
+        # Course partitions are small enough to scan exactly
+        index = self.ann_index(matrix, pks) if course is None else None
+        if index is None:
+            found = self._exact_search(probes, matrix, pks, top_k)
+        else:
+            found = self._approximate_search(index, probes, matrix, pks, top_k)
+        for row, matches in zip(rows, found):
+            results[row] = matches
+        return results
+
+    def partition_size(self, course):
+        """Number of indexed students in a course"""
+        self.ensure_loaded()
+        return int(np.count_nonzero(self._courses == course))
+
+    def partition(self, matrix, pks, courses, course):
+        """
+        Contiguous (matrix, pks) of one course's students, cached for the
+        current snapshot of the gallery arrays.
+        """
+        cached = self._partitions
+        if cached is None or cached[0] is not matrix or cached[1] is not courses:
+            cached = self._partitions = (matrix, courses, {})
+        partition = cached[2].get(course)
+        if partition is None:
+            rows = np.flatnonzero(courses == course)
+            partition = cached[2][course] = (np.ascontiguousarray(matrix[rows]), pks[rows])
+        return partition
+
+    def _exact_search(self, probes, matrix, pks, top_k):
+        # (n_probes, n_students) similarity matrix
+        similarities = probes @ matrix.T
+        n_students = similarities.shape[1]
+        top_k = min(top_k, n_students)
+        if top_k < n_students:
+            candidates = np.argpartition(-similarities, top_k - 1, axis=1)[:, :top_k]
+        else:
+            candidates = np.broadcast_to(np.arange(n_students), similarities.shape)
+
+        found = []
+        for scores, candidate in zip(similarities, candidates):
+            # Stable sort keeps enrollment order for ties, like the old sequential scan
+            order = candidate[np.argsort(-scores[candidate], kind='stable')]
+            found.append([(int(pks[i]), float(scores[i])) for i in order])
+        return found
+
+    def _approximate_search(self, index, probes, matrix, pks, top_k):
+        found = index.search_batch(probes, matrix, pks, top_k, n_probes=getattr(settings, 'FACE_ANN_PROBES', 8))
+        # A probe whose cells held no good match may still be enrolled: fall back to the full scan
+        exact_below = getattr(settings, 'FACE_ANN_EXACT_BELOW', None)
+        if exact_below == 'match':
+            exact_below = match_threshold(self._model_version)
+        wanted = min(top_k, len(pks))
+        retry = [
+            i for i, matches in enumerate(found)
+            if len(matches) < wanted or (exact_below is not None and matches[0][1] < exact_below)
+        ]
+        if retry:
+            for i, matches in zip(retry, self._exact_search(probes[retry], matrix, pks, top_k)):
+                found[i] = matches
+        return found
+
+    def ann_index(self, matrix, pks):
+        """
+        The IVF index for a gallery snapshot, loaded or trained on first use;
+        None while ANN search is disabled or the gallery is too small.
+        """
+        if (matrix is None or not getattr(settings, 'FACE_ANN_ENABLED', False)
+                or len(pks) < getattr(settings, 'FACE_ANN_MIN_SIZE', 20000)):
+            return None
+        index = self._ann
+        if index is not None and index.fits(matrix, self._model_version):
+            return index
+        with self._ann_lock:
+            index = self._ann
+            if index is None or not index.fits(matrix, self._model_version):
+                path = getattr(settings, 'FACE_ANN_INDEX_FILE', None)
+                index = IVFIndex.load(path) if path else None
+                if index is None or not index.fits(matrix, self._model_version):
+                    index = self._train_ann(matrix, pks)
+                self._ann = index
+            return index
+
+    def calibrate_threshold(self, false_match_rate=FALSE_MATCH_RATE):
+        """
+        Match threshold that at most ``false_match_rate`` of the pairs of
+        enrolled students exceed; None with fewer than two students.
+        """
+        self.ensure_loaded()
+        matrix = self._matrix
+        if matrix is None or matrix.shape[0] < 2:
+            return None
+        return calibrate_threshold(matrix, false_match_rate)
+
+    def build_ann_index(self):
+        """Retrain the IVF index on the whole gallery (and save it); None for an empty gallery"""
+        self.ensure_loaded()
+        matrix, pks = self._matrix, self._pks
+        if matrix is None:
+            return None
+        with self._ann_lock:
+            self._ann = self._train_ann(matrix, pks)
+            return self._ann
+
+    def _train_ann(self, matrix, pks):
+        started = time.perf_counter()
+        index = IVFIndex.train(matrix, pks, self._model_version, n_lists=getattr(settings, 'FACE_ANN_LISTS', None))
+        logger.info(
+            f"Trained face ANN index: {index.n_lists} lists over {len(pks)} encodings "
+            f"in {time.perf_counter() - started:.1f}s"
+        )
+        path = getattr(settings, 'FACE_ANN_INDEX_FILE', None)
+        if path:
+            index.save(path)
+        return index
+
+
+face_gallery = FaceGallery()
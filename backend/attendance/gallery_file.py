@@ -0,0 +1,140 @@
+"""
+Memory-mapped gallery file shared by every worker process.
+
+When ``FACE_GALLERY_FILE`` is set, the face gallery is published to a
+read-only binary file. Each worker maps it with ``np.memmap`` instead of
+decoding every encoding from SQLite, so the page cache holds a single copy
+no matter how many workers run:
+
+    header    64 bytes
+        magic          4s   b'FGAL'
+        version        H    format version (currently 2)
+        reserved       H
+        dimension      I    encoding length
+        count          Q    number of students
+        generation     Q    bumped on every write
+        model_version  36s  descriptor version, NUL padded
+    pks       count x int64
+    courses   count x int64  course pk per row, -1 for no course
+    matrix    count x dimension float32, rows normalized to unit length
+
+Files are never modified in place. A writer takes an exclusive lock, writes
+a temporary file next to the target and ``os.replace``s it over the old one,
+so readers only ever see a complete file. Readers notice the replacement
+from the path's inode and remap.
+"""
+import logging
+import os
+import struct
+import tempfile
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process development servers only
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'FGAL'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('<4sHHIQQ36s')
+
+
+@dataclass
+class SharedGallery:
+    matrix: np.ndarray  # None when the file holds no students
+    pks: np.ndarray
+    courses: np.ndarray
+    model_version: str
+    generation: int
+    identity: tuple
+
+
+def file_identity(path):
+    """Cheap fingerprint of the file currently at ``path`` (None if missing)"""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+@contextmanager
+def write_lock(path):
+    """Serialize writers across processes with an advisory lock file"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(f'{path}.lock', 'a') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def read_gallery(path):
+    """Map the gallery file read-only; returns None if it is missing or unreadable"""
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    with f:
+        stat = os.fstat(f.fileno())
+        identity = (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        header = f.read(HEADER.size)
+        if len(header) != HEADER.size:
+            logger.warning(f"Ignoring truncated face gallery file {path}")
+            return None
+        magic, version, _, dimension, count, generation, model_version = HEADER.unpack(header)
+        expected_size = HEADER.size + count * 16 + count * dimension * 4
+        if magic != MAGIC or version != FORMAT_VERSION or stat.st_size != expected_size:
+            logger.warning(f"Ignoring unreadable face gallery file {path}")
+            return None
+
+        model_version = model_version.rstrip(b'\0').decode('ascii')
+        if not count:
+            empty = np.empty(0, dtype=np.int64)
+            return SharedGallery(None, empty, empty, model_version, generation, identity)
+        # np.memmap keeps its own mapping, so the file object can be closed
+        pks = np.memmap(f, dtype=np.int64, mode='r', offset=HEADER.size, shape=(count,))
+        courses = np.memmap(f, dtype=np.int64, mode='r', offset=HEADER.size + count * 8, shape=(count,))
+        matrix = np.memmap(f, dtype=np.float32, mode='r', offset=HEADER.size + count * 16,
+                           shape=(count, dimension))
+        return SharedGallery(matrix, pks, courses, model_version, generation, identity)
+
+
+def write_gallery(path, matrix, pks, courses, model_version, generation):
+    """Atomically replace the gallery file; call inside ``write_lock``"""
+    count = len(pks)
+    dimension = matrix.shape[1] if matrix is not None else 0
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, 0, dimension, count, generation,
+                         model_version.encode('ascii'))
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.gallery-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header)
+            f.write(np.ascontiguousarray(pks, dtype=np.int64).tobytes())
+            f.write(np.ascontiguousarray(courses, dtype=np.int64).tobytes())
+            if count:
+                f.write(np.ascontiguousarray(matrix, dtype=np.float32).tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def remove_gallery(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,190 @@
+"""
+Background face encoding for ``upload_photo``.
+
+In async mode the request only stores the photo in an ``EnrollmentJob`` row
+and returns 202. The row is handed to a small process-local thread pool once
+the transaction commits, so no external broker is needed. A worker claims
+the job with a conditional UPDATE that stamps ``started_at``. That way a job
+resubmitted by another process, or by ``process_enrollment_jobs`` after a
+restart, still runs only once. The worker then encodes the photo and saves it
+on the student, and the save signals add the new encoding to the face gallery.
+
+Jobs left ``running`` past ``ENROLLMENT_JOB_TIMEOUT`` are requeued, since
+their worker most likely died. A worker that was only slow finds its claim
+gone: it records nothing and leaves the job to the run that reclaimed it. The
+result and the student's encoding are saved in one transaction, and only
+while ``status`` and ``started_at`` still match the claim.
+
+Web server processes start their pool when the app loads (see
+``AttendanceConfig.ready``). Starting it requeues abandoned jobs and resubmits
+every queued one, so jobs survive a restart without anyone running
+``process_enrollment_jobs``. Management commands, migrations and scripts
+don't start it.
+
+Set ``ENROLLMENT_JOB_WORKERS = 0`` to run jobs inline, when the request's
+transaction commits.
+"""
+import logging
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# Present in processes started by these web servers
+SERVER_MODULES = ('gunicorn', 'uwsgi', 'mod_wsgi', 'waitress', 'daphne', 'uvicorn', 'hypercorn')
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor, _executor_pid
+    with _executor_lock:
+        # A forked server worker (e.g. gunicorn --preload) inherits the pool but not its threads
+        if _executor is None or _executor_pid != os.getpid():
+            _executor_pid = os.getpid()
+            _executor = ThreadPoolExecutor(
+                max_workers=getattr(settings, 'ENROLLMENT_JOB_WORKERS', 2),
+                thread_name_prefix='enrollment',
+            )
+            # Runs on the pool so the request that started it doesn't wait on the query
+            _executor.submit(_reclaim_in_thread, _executor)
+    return _executor
+
+
+def serves_requests(argv=None):
+    """True in a web server process, including runserver's serving child; False for other commands and scripts"""
+    argv = sys.argv if argv is None else argv
+    if argv and Path(argv[0]).name in ('manage.py', 'django-admin', '__main__.py'):
+        # The autoreloader re-runs runserver in a child process that does the serving
+        return argv[1:2] == ['runserver'] and (os.environ.get('RUN_MAIN') == 'true' or '--noreload' in argv)
+    return any(name in sys.modules for name in SERVER_MODULES)
+
+
+def start():
+    """Start the pool, and with it the reclaim of waiting jobs, in a web server process"""
+    if getattr(settings, 'ENROLLMENT_JOB_WORKERS', 2) > 0 and serves_requests():
+        get_executor()
+
+
+def submit(job):
+    """Queue a job to run once the current transaction commits"""
+    if getattr(settings, 'ENROLLMENT_JOB_WORKERS', 2) <= 0:
+        transaction.on_commit(lambda: run_job(job.pk))
+    else:
+        transaction.on_commit(lambda: get_executor().submit(_run_in_thread, job.pk))
+
+
+def _run_in_thread(job_id):
+    close_old_connections()
+    try:
+        run_job(job_id)
+    finally:
+        close_old_connections()
+
+
+def _reclaim_in_thread(executor):
+    close_old_connections()
+    try:
+        for job_id in reclaim_jobs():
+            executor.submit(_run_in_thread, job_id)
+    except Exception as e:
+        logger.error(f"Reclaiming enrollment jobs failed: {str(e)}", exc_info=True)
+    finally:
+        close_old_connections()
+
+
+def _claimed(job_id, claimed_at):
+    """The job's row, as long as the claim made at ``claimed_at`` still holds"""
+    from .models import EnrollmentJob
+    return EnrollmentJob.objects.filter(pk=job_id, status='running', started_at=claimed_at)
+
+
+def _finish(job, claimed_at, student=None):
+    """Record the result and save the student's encoding; False if the job was requeued meanwhile"""
+    job.status = 'failed' if job.error else 'succeeded'
+    with transaction.atomic():
+        finished = _claimed(job.pk, claimed_at).update(
+            status=job.status, stage='', confidence=job.confidence, error=job.error, finished_at=timezone.now()
+        )
+        if finished and student is not None:
+            # Only the encoding: a concurrent edit of the student's name or course must survive
+            student.save(update_fields=['photo', 'face_encoding', 'face_encoding_model', 'updated_at'])
+    return bool(finished)
+
+
+def run_job(job_id):
+    """Claim and process one job; returns False if another worker claimed it first or reclaimed it"""
+    from .models import EnrollmentJob
+    from .views import MIN_ENROLLMENT_CONFIDENCE, extract_face_encoding
+
+    claimed_at = timezone.now()
+    claimed = EnrollmentJob.objects.filter(pk=job_id, status='queued').update(
+        status='running', stage='encoding', started_at=claimed_at
+    )
+    if not claimed:
+        return False
+
+    job = EnrollmentJob.objects.select_related('student').get(pk=job_id)
+    student = None
+    try:
+        with job.photo.open('rb') as photo:
+            face_encoding, confidence, _ = extract_face_encoding(photo)
+        job.confidence = confidence
+        if face_encoding is None:
+            job.error = 'No face detected in the image'
+        elif confidence < MIN_ENROLLMENT_CONFIDENCE:
+            job.error = 'Face detection confidence too low'
+        else:
+            _claimed(job_id, claimed_at).update(stage='saving')
+            student = job.student
+            student.photo.name = job.photo.name
+            student.set_face_encoding(face_encoding)
+    except Exception as e:
+        logger.error(f"Enrollment job {job_id} failed: {str(e)}", exc_info=True)
+        job.error = str(e)
+
+    try:
+        finished = _finish(job, claimed_at, student)
+    except Exception as e:
+        logger.error(f"Enrollment job {job_id} failed: {str(e)}", exc_info=True)
+        job.error = str(e)
+        finished = _finish(job, claimed_at)
+    if not finished:
+        logger.warning(f"Enrollment job {job_id} was requeued while it ran; leaving it to the new run")
+        return False
+    logger.info(f"Enrollment job {job_id} for {job.student.student_id} {job.status}")
+    return True
+
+
+def requeue_stale_jobs():
+    """
+    Put jobs that were running when their process died back in the queue.
+    A job counts as stale once it has run longer than ENROLLMENT_JOB_TIMEOUT;
+    if its worker is in fact alive, that worker's result is discarded.
+    """
+    from .models import EnrollmentJob
+
+    cutoff = timezone.now() - timedelta(seconds=getattr(settings, 'ENROLLMENT_JOB_TIMEOUT', 600))
+    return EnrollmentJob.objects.filter(status='running', started_at__lt=cutoff).update(
+        status='queued', stage='', started_at=None
+    )
+
+
+def reclaim_jobs():
+    """Requeue stale jobs and return the ids of every queued job, oldest first"""
+    from .models import EnrollmentJob
+
+    requeued = requeue_stale_jobs()
+    if requeued:
+        logger.warning(f"Requeued {requeued} abandoned enrollment jobs")
+    return list(EnrollmentJob.objects.filter(status='queued').order_by('created_at').values_list('pk', flat=True))
@@ -0,0 +1,87 @@
+import json
+import os
+import tempfile
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from attendance import benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Benchmark detection, encoding, matching and the face endpoints; writes JSON results'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--gallery-sizes', default='100,1000,10000',
+                            help='Comma-separated synthetic gallery sizes (up to 100000)')
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--write-threads', type=int, default=8,
+                            help='Threads for the concurrent attendance write case')
+        parser.add_argument('--skip-endpoints', action='store_true',
+                            help='Skip the HTTP cases that need a throwaway database')
+        parser.add_argument('--output', help='Write JSON results to this file instead of stdout')
+        parser.add_argument('--compare', help='Previous JSON results to print mean deltas against')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = sorted({int(size) for size in options['gallery_sizes'].split(',') if size.strip()})
+        except ValueError:
+            raise CommandError('--gallery-sizes must be a comma-separated list of integers')
+        if not sizes or min(sizes) < 1:
+            raise CommandError('--gallery-sizes must be positive')
+        repeat = options['repeat']
+        rng = np.random.default_rng(benchmarks.SEED)
+
+        results = []
+        results += benchmarks.bench_image_pipeline(benchmarks.sample_photos(), repeat)
+        results += benchmarks.bench_matching(sizes, repeat, rng)
+        if not options['skip_endpoints']:
+            results += self.run_endpoint_benchmarks(sizes, repeat, rng, options['write_threads'])
+
+        report = {'environment': benchmarks.environment(), 'results': results}
+        payload = json.dumps(report, indent=2, default=str)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(payload + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Wrote {len(results)} results to {options['output']}"))
+        else:
+            self.stdout.write(payload)
+
+        if options['compare']:
+            self.print_comparison(options['compare'], results)
+
+    def run_endpoint_benchmarks(self, sizes, repeat, rng, write_threads):
+        # Endpoints run against a throwaway test database, never the configured one
+        if connection.vendor == 'sqlite':
+            # File-backed, so journaling and lock contention behave like production
+            test_settings = connection.settings_dict.setdefault('TEST', {})
+            test_settings['NAME'] = os.path.join(tempfile.mkdtemp(), 'benchmark.sqlite3')
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            results = benchmarks.bench_endpoints(sizes, max(3, repeat // 2), rng)
+            return results + benchmarks.bench_concurrent_writes(threads=write_threads)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+    def print_comparison(self, path, results):
+        with open(path) as f:
+            previous = json.load(f)
+
+        def key(result):
+            return result['name'], json.dumps(result['params'], sort_keys=True)
+
+        baseline = {key(result): result for result in previous['results']}
+        self.stdout.write(f"Compared with {previous['environment'].get('commit') or path}:")
+        for result in results:
+            old = baseline.get(key(result))
+            if not old or not old['mean_ms']:
+                continue
+            change = (result['mean_ms'] - old['mean_ms']) / old['mean_ms'] * 100
+            self.stdout.write(
+                f"  {result['name']:<26} {json.dumps(result['params'], sort_keys=True):<60} "
+                f"{old['mean_ms']:>10.3f} -> {result['mean_ms']:>10.3f} ms ({change:+.1f}%)"
+            )
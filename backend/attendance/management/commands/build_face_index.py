@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from attendance.gallery import face_gallery
+
+
+class Command(BaseCommand):
+    help = 'Train the approximate face search index on the current gallery and save it to FACE_ANN_INDEX_FILE'
+
+    def handle(self, *args, **options):
+        path = getattr(settings, 'FACE_ANN_INDEX_FILE', None)
+        if not path:
+            raise CommandError('Set FACE_ANN_INDEX_FILE so the workers can load the trained index')
+
+        index = face_gallery.build_ann_index()
+        if index is None:
+            raise CommandError('No enrolled face encodings to index')
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {index.trained_size} encodings in {index.n_lists} lists; saved to {path}'
+        ))
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from attendance.descriptors import FALSE_MATCH_RATE, match_threshold
+from attendance.gallery import face_gallery
+
+
+class Command(BaseCommand):
+    help = 'Suggest a face match threshold from the similarity between different enrolled students'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--false-match-rate', type=float, default=FALSE_MATCH_RATE,
+            help=f'Share of pairs of different students allowed to match (default {FALSE_MATCH_RATE})',
+        )
+
+    def handle(self, *args, **options):
+        rate = options['false_match_rate']
+        if not 0 < rate < 1:
+            raise CommandError('--false-match-rate must be between 0 and 1')
+
+        threshold = face_gallery.calibrate_threshold(rate)
+        if threshold is None:
+            raise CommandError('Calibration needs at least two enrolled face encodings')
+        version = face_gallery.model_version
+        self.stdout.write(f'Current {version} match threshold: {match_threshold(version):.3f}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Calibrated on {face_gallery.size} students: '
+            f"FACE_MATCH_THRESHOLDS = {{'{version}': {threshold:.3f}}}"
+        ))
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from attendance.encodings import (
+    DTYPE_CODES, decode_face_encoding, default_compression, default_dtype,
+    encode_face_encoding, is_legacy_encoding,
+)
+from attendance.models import Student
+
+
+class Command(BaseCommand):
+    help = 'Rewrite stored face encodings in the compact versioned format'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dtype', choices=sorted(DTYPE_CODES), default=None,
+                            help='Storage dtype (defaults to settings.FACE_ENCODING_DTYPE)')
+        parser.add_argument('--compress', action='store_true', default=None,
+                            help='lz4-compress the encodings')
+        parser.add_argument('--all', action='store_true',
+                            help='Re-encode every row, not only legacy float64 blobs')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        dtype = options['dtype'] or default_dtype()
+        compress = default_compression() if options['compress'] is None else options['compress']
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size must be positive')
+
+        rows = Student.objects.exclude(face_encoding__isnull=True).values_list('pk', 'face_encoding')
+        scanned = converted = bytes_before = bytes_after = 0
+        batch = []
+
+        for pk, blob in rows.iterator(chunk_size=batch_size):
+            scanned += 1
+            if not options['all'] and not is_legacy_encoding(blob):
+                continue
+            compact = encode_face_encoding(decode_face_encoding(blob), dtype=dtype, compress=compress)
+            bytes_before += len(blob)
+            bytes_after += len(compact)
+            converted += 1
+            batch.append(Student(pk=pk, face_encoding=compact))
+            if len(batch) >= batch_size:
+                self._flush(batch, options['dry_run'])
+                batch = []
+
+        self._flush(batch, options['dry_run'])
+
+        prefix = '[dry run] ' if options['dry_run'] else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}Converted {converted} of {scanned} encodings '
+            f'({bytes_before} -> {bytes_after} bytes)'
+        ))
+
+    def _flush(self, batch, dry_run):
+        if batch and not dry_run:
+            # bulk_update skips save signals; the gallery sees identical vectors anyway
+            Student.objects.bulk_update(batch, ['face_encoding'])
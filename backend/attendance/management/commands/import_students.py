@@ -0,0 +1,46 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from attendance.enrollment import RosterImporter
+
+
+class Command(BaseCommand):
+    help = 'Bulk-enroll students from a roster CSV and a directory of photos'
+
+    def add_arguments(self, parser):
+        parser.add_argument('roster', help='CSV with student_id, first_name, last_name, email, course, photo columns')
+        parser.add_argument('--photos', help='Directory the roster photo column is relative to')
+        parser.add_argument('--jobs', type=int, default=-1, help='Worker processes for face encoding (-1 = all cores)')
+        parser.add_argument('--chunk-size', type=int, default=200)
+        parser.add_argument('--update', action='store_true', help='Update students that already exist')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        def progress(report):
+            self.stdout.write(
+                f"{report['processed']} rows: {report['created']} created, {report['updated']} updated, "
+                f"{report['encoded']} encoded, {len(report['failed'])} failed"
+            )
+
+        importer = RosterImporter(
+            options['photos'],
+            n_jobs=options['jobs'],
+            chunk_size=options['chunk_size'],
+            update_existing=options['update'],
+            progress=progress,
+        )
+        try:
+            with open(options['roster'], newline='', encoding='utf-8-sig') as roster:
+                report = importer.run(roster)
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        for failure in report['failed']:
+            self.stdout.write(self.style.WARNING(
+                f"line {failure['line']} ({failure['student_id'] or '?'}): {failure['error']}"
+            ))
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {report['processed']} rows: {report['created']} created, "
+            f"{report['updated']} updated, {report['encoded']} faces encoded, {len(report['failed'])} failed"
+        ))
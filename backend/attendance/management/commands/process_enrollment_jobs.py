@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from attendance.gallery import face_gallery
+from attendance.jobs import requeue_stale_jobs, run_job
+from attendance.models import EnrollmentJob
+
+
+class Command(BaseCommand):
+    help = 'Run queued background enrollment jobs, e.g. ones left behind by a restart'
+
+    def handle(self, *args, **options):
+        requeued = requeue_stale_jobs()
+        if requeued:
+            self.stdout.write(f'Requeued {requeued} abandoned jobs')
+
+        job_ids = list(
+            EnrollmentJob.objects.filter(status='queued').order_by('created_at').values_list('pk', flat=True)
+        )
+        # One gallery update (and shared-file publish) for the whole run instead of one per student
+        with face_gallery.batched():
+            processed = sum(1 for job_id in job_ids if run_job(job_id))
+        failed = EnrollmentJob.objects.filter(pk__in=job_ids, status='failed').count()
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} enrollment jobs ({failed} failed)'))
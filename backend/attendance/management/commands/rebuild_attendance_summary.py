@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from attendance.rollups import rebuild_summaries
+
+
+class Command(BaseCommand):
+    help = 'Recompute DailyAttendanceSummary rows from the Attendance table'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start', help='First date to rebuild (YYYY-MM-DD); defaults to the beginning')
+        parser.add_argument('--end', help='Last date to rebuild (YYYY-MM-DD); defaults to the end')
+
+    def handle(self, *args, **options):
+        dates = {}
+        for option in ('start', 'end'):
+            value = options[option]
+            try:
+                dates[option] = parse_date(value) if value else None
+            except ValueError:
+                dates[option] = None
+            if value and dates[option] is None:
+                raise CommandError(f'--{option} must be a valid YYYY-MM-DD date')
+
+        count = rebuild_summaries(dates['start'], dates['end'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} daily attendance summaries'))
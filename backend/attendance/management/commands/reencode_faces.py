@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from attendance.descriptors import DESCRIPTORS, PCADescriptor, get_descriptor, reset_descriptors
+from attendance.encodings import encode_face_encoding
+from attendance.gallery import face_gallery
+from attendance.models import Student
+from attendance.views import extract_face_patch
+
+
+class Command(BaseCommand):
+    help = 'Re-encode every enrolled student from their stored photo with the current face descriptor'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--descriptor', choices=sorted(DESCRIPTORS), default=None,
+                            help='Descriptor to use (defaults to settings.FACE_DESCRIPTOR)')
+        parser.add_argument('--fit-pca', action='store_true',
+                            help='Fit the PCA basis on the enrolled photos before encoding')
+        parser.add_argument('--components', type=int, default=256,
+                            help='Number of PCA components to keep when fitting')
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size must be positive')
+        if options['fit_pca'] and options['descriptor'] not in (None, PCADescriptor.name):
+            raise CommandError('--fit-pca only applies to the pca descriptor')
+
+        students = Student.objects.exclude(photo='').exclude(photo__isnull=True).only('pk', 'student_id', 'photo')
+        patches = []
+        failures = []
+        for student in students.iterator(chunk_size=options['batch_size']):
+            try:
+                face_gray, _, _ = extract_face_patch(student.photo.path)
+            except Exception as e:
+                face_gray = None
+                self.stderr.write(f'{student.student_id}: {e}')
+            if face_gray is None:
+                failures.append(student.student_id)
+                continue
+            patches.append((student.pk, face_gray))
+
+        if not patches:
+            raise CommandError('No usable student photos found')
+
+        if options['fit_pca']:
+            PCADescriptor.fit([patch for _, patch in patches], n_components=options['components'])
+            reset_descriptors()
+        descriptor = get_descriptor(options['descriptor'] or (PCADescriptor.name if options['fit_pca'] else None))
+
+        batch = []
+        for pk, face_gray in patches:
+            encoding = descriptor.compute(face_gray)
+            # bulk_update skips auto_now; bump updated_at so other workers pick the change up
+            batch.append(Student(pk=pk, face_encoding=encode_face_encoding(encoding),
+                                 face_encoding_model=descriptor.version, updated_at=timezone.now()))
+            if len(batch) >= options['batch_size']:
+                Student.objects.bulk_update(batch, ['face_encoding', 'face_encoding_model', 'updated_at'])
+                batch = []
+        if batch:
+            Student.objects.bulk_update(batch, ['face_encoding', 'face_encoding_model', 'updated_at'])
+
+        face_gallery.clear()
+        if descriptor.name != get_descriptor().name:
+            self.stdout.write(self.style.WARNING(
+                f'settings.FACE_DESCRIPTOR is not {descriptor.name!r}; set it or mark_attendance will ignore these encodings'
+            ))
+        for student_id in failures:
+            self.stdout.write(self.style.WARNING(f'No face found for {student_id}; encoding left unchanged'))
+        self.stdout.write(self.style.SUCCESS(
+            f'Re-encoded {len(patches)} students with {descriptor.version} '
+            f'({encoding.shape[0]} dims). Running servers pick the new encodings up by themselves; '
+            'restart only the ones whose FACE_DESCRIPTOR setting changed.'
+        ))
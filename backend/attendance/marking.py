@@ -0,0 +1,140 @@
+"""
+Attendance writes for the face endpoints.
+
+``get_or_create`` is a SELECT followed by an INSERT. When many kiosks mark
+at the start of class, two requests can both miss on the SELECT, and one of
+them then fails with an IntegrityError. On SQLite it may fail with
+"database is locked" instead. ``insert_attendance`` issues a single
+
+    INSERT ... ON CONFLICT (student_id, date) DO NOTHING RETURNING id, student_id
+
+so the unique constraint decides who wins, and the RETURNING rows say which
+students were actually marked. Backends without ``RETURNING`` (MySQL,
+SQLite < 3.35) fall back to ``get_or_create`` per row. Lock contention is
+retried with jittered exponential backoff.
+
+The INSERT sends no signals, so the daily rollup is updated here in the
+same transaction.
+"""
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.utils import timezone
+
+from .models import Attendance
+from .rollups import record_created
+
+logger = logging.getLogger(__name__)
+
+INSERT_FIELDS = ('student', 'date', 'time_in', 'status', 'confidence_score', 'created_at')
+
+
+def _is_lock_error(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+def with_retry(write):
+    """Call ``write()``, retrying SQLite lock contention with jittered exponential backoff"""
+    retries = getattr(settings, 'ATTENDANCE_WRITE_RETRIES', 5)
+    backoff = getattr(settings, 'ATTENDANCE_WRITE_BACKOFF', 0.05)
+    for attempt in range(retries + 1):
+        try:
+            return write()
+        except OperationalError as e:
+            if not _is_lock_error(e) or attempt == retries:
+                raise
+            delay = backoff * (2 ** attempt) * (0.5 + random.random())
+            logger.warning(f"Attendance write hit a locked database; retrying in {delay * 1000:.0f} ms")
+            time.sleep(delay)
+
+
+def _supports_insert_returning():
+    return connection.vendor in ('sqlite', 'postgresql') and connection.features.can_return_rows_from_bulk_insert
+
+
+def _insert_ignore_returning(attendances):
+    """One INSERT ... ON CONFLICT DO NOTHING; returns the pk of each inserted row by student pk"""
+    opts = Attendance._meta
+    qn = connection.ops.quote_name
+    fields = [opts.get_field(name) for name in INSERT_FIELDS]
+    row_sql = '(' + ', '.join(['%s'] * len(fields)) + ')'
+    params = []
+    for attendance in attendances:
+        params.extend(field.get_db_prep_save(getattr(attendance, field.attname), connection) for field in fields)
+
+    student_column = qn(opts.get_field('student').column)
+    sql = (
+        f"INSERT INTO {qn(opts.db_table)} ({', '.join(qn(field.column) for field in fields)}) "
+        f"VALUES {', '.join([row_sql] * len(attendances))} "
+        f"ON CONFLICT ({student_column}, {qn(opts.get_field('date').column)}) DO NOTHING "
+        f"RETURNING {qn(opts.pk.column)}, {student_column}"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return {student_pk: pk for pk, student_pk in cursor.fetchall()}
+
+
+def _get_or_create_each(attendances):
+    inserted = {}
+    for attendance in attendances:
+        try:
+            with transaction.atomic():
+                row, created = Attendance.objects.get_or_create(
+                    student_id=attendance.student_id,
+                    date=attendance.date,
+                    defaults={'status': attendance.status, 'confidence_score': attendance.confidence_score},
+                )
+        except IntegrityError:
+            # Lost the race to a concurrent insert
+            continue
+        if created:
+            inserted[attendance.student_id] = row.pk
+    return inserted
+
+
+def insert_attendance(entries, day, status='present'):
+    """
+    Insert one attendance row per ``(student, confidence)`` pair unless the
+    student already has one for ``day``. Returns the newly created
+    Attendance objects keyed by student pk; students missing from the result
+    were already marked.
+    """
+    now = timezone.now()
+    attendances = {
+        student.pk: Attendance(
+            student=student, date=day, time_in=now, status=status,
+            confidence_score=confidence, created_at=now,
+        )
+        for student, confidence in entries
+    }
+    if not attendances:
+        return {}
+
+    def write():
+        with transaction.atomic():
+            if not _supports_insert_returning():
+                # get_or_create saves through the ORM, so the signals keep the rollup
+                return _get_or_create_each(list(attendances.values()))
+            inserted = _insert_ignore_returning(list(attendances.values()))
+            created = [attendances[student_pk] for student_pk in inserted]
+            record_created(created, {pk: attendance.student.course_id for pk, attendance in attendances.items()})
+            return inserted
+
+    inserted = with_retry(write)
+    created = {}
+    for student_pk, pk in inserted.items():
+        attendance = attendances[student_pk]
+        attendance.pk = pk
+        attendance._state.adding = False
+        created[student_pk] = attendance
+    return created
+
+
+def mark_present(student, confidence, day):
+    """Mark one student present for ``day``; returns (attendance, created)"""
+    created = insert_attendance([(student, confidence)], day)
+    return created.get(student.pk), bool(created)
@@ -0,0 +1,133 @@
+"""
+In-process latency metrics for the face pipeline.
+
+Every finished face request (see facelog.py) feeds its total time and
+per-stage timings into a ``LatencySummary`` per (endpoint, stage). A summary
+keeps a count, a sum and a bounded window of recent samples for p50/p95/p99.
+``render_prometheus`` exposes them in the Prometheus text format on
+``/metrics``.
+
+Recording a sample is one lock, one deque append and two additions. There is
+no per-request allocation beyond the sample itself, so the overhead is
+negligible next to image decoding.
+"""
+import threading
+from collections import deque
+
+import numpy as np
+from django.conf import settings
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def metrics_enabled():
+    return getattr(settings, 'FACE_METRICS_ENABLED', True)
+
+
+class LatencySummary:
+    """Count, sum and a sliding window of samples for quantile estimates"""
+
+    def __init__(self, window=1024):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def observe(self, value):
+        with self._lock:
+            self._samples.append(value)
+            self.count += 1
+            self.total += value
+
+    def snapshot(self):
+        with self._lock:
+            samples = np.fromiter(self._samples, dtype=np.float64, count=len(self._samples))
+            count, total = self.count, self.total
+        quantiles = {q: (float(np.quantile(samples, q)) if samples.size else float('nan')) for q in QUANTILES}
+        return count, total, quantiles
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._requests = {}
+
+    def _summary(self, key):
+        summary = self._latency.get(key)
+        if summary is None:
+            with self._lock:
+                summary = self._latency.setdefault(key, LatencySummary())
+        return summary
+
+    def observe_request(self, record):
+        """Record one face request summary (the dict built by FaceRequestLog)"""
+        endpoint = record['endpoint']
+        self._summary((endpoint, 'total')).observe(record['total_ms'])
+        for stage, elapsed in record['stages_ms'].items():
+            self._summary((endpoint, stage)).observe(elapsed)
+        key = (endpoint, str(record.get('status', 'error')))
+        with self._lock:
+            self._requests[key] = self._requests.get(key, 0) + 1
+
+    def reset(self):
+        with self._lock:
+            self._latency.clear()
+            self._requests.clear()
+
+    def render_prometheus(self):
+        from .caches import CACHES
+        from .gallery import face_gallery
+
+        # Requests for a new endpoint or stage add keys while a scrape renders
+        with self._lock:
+            latency = sorted(self._latency.items())
+            requests = sorted(self._requests.items())
+
+        lines = [
+            '# HELP face_pipeline_latency_ms Face pipeline latency per endpoint and stage, in milliseconds.',
+            '# TYPE face_pipeline_latency_ms summary',
+        ]
+        for (endpoint, stage), summary in latency:
+            count, total, quantiles = summary.snapshot()
+            labels = f'endpoint="{endpoint}",stage="{stage}"'
+            for q, value in quantiles.items():
+                lines.append(f'face_pipeline_latency_ms{{{labels},quantile="{q}"}} {value:.3f}')
+            lines.append(f'face_pipeline_latency_ms_sum{{{labels}}} {total:.3f}')
+            lines.append(f'face_pipeline_latency_ms_count{{{labels}}} {count}')
+
+        lines += [
+            '# HELP face_pipeline_requests_total Face pipeline requests by endpoint and HTTP status.',
+            '# TYPE face_pipeline_requests_total counter',
+        ]
+        for (endpoint, status), count in requests:
+            lines.append(f'face_pipeline_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}')
+
+        lines += [
+            '# HELP face_gallery_size Encodings currently indexed in this process.',
+            '# TYPE face_gallery_size gauge',
+            f'face_gallery_size {face_gallery.size if face_gallery.loaded else 0}',
+        ]
+
+        cache_stats = {name: cache.stats() for name, cache in CACHES.items()}
+        lines += [
+            '# HELP face_cache_lookups_total Frame and attendance cache lookups by result.',
+            '# TYPE face_cache_lookups_total counter',
+        ]
+        for name, stats in cache_stats.items():
+            lines.append(f'face_cache_lookups_total{{cache="{name}",result="hit"}} {stats["hits"]}')
+            lines.append(f'face_cache_lookups_total{{cache="{name}",result="miss"}} {stats["misses"]}')
+        lines += [
+            '# HELP face_cache_evictions_total Cache entries dropped for size or age.',
+            '# TYPE face_cache_evictions_total counter',
+        ]
+        lines += [f'face_cache_evictions_total{{cache="{name}"}} {stats["evictions"]}' for name, stats in cache_stats.items()]
+        lines += [
+            '# HELP face_cache_entries Entries currently held per cache.',
+            '# TYPE face_cache_entries gauge',
+        ]
+        lines += [f'face_cache_entries{{cache="{name}"}} {stats["entries"]}' for name, stats in cache_stats.items()]
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
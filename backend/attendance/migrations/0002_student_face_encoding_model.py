@@ -0,0 +1,25 @@
+# Generated by Django 5.0.1 on 2026-10-17 06:20
+
+from django.db import migrations, models
+
+
+def tag_existing_encodings(apps, schema_editor):
+    # Everything enrolled before descriptors existed is a raw pixel vector
+    Student = apps.get_model('attendance', 'Student')
+    Student.objects.exclude(face_encoding__isnull=True).update(face_encoding_model='raw-v1')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='student',
+            name='face_encoding_model',
+            field=models.CharField(blank=True, default='', max_length=50),
+        ),
+        migrations.RunPython(tag_existing_encodings, migrations.RunPython.noop),
+    ]
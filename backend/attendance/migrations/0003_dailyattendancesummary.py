@@ -0,0 +1,45 @@
+# Generated by Django 5.0.1 on 2026-10-17 06:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def build_initial_summaries(apps, schema_editor):
+    Attendance = apps.get_model('attendance', 'Attendance')
+    DailyAttendanceSummary = apps.get_model('attendance', 'DailyAttendanceSummary')
+    rows = {}
+    for row in Attendance.objects.values('date', 'student__course', 'status').annotate(n=Count('id')).order_by():
+        key = (row['date'], row['student__course'])
+        summary = rows.setdefault(key, DailyAttendanceSummary(date=key[0], course_id=key[1]))
+        if row['status'] in ('present', 'late', 'absent'):
+            setattr(summary, row['status'], row['n'])
+    DailyAttendanceSummary.objects.bulk_create(rows.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0002_student_face_encoding_model'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyAttendanceSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('present', models.PositiveIntegerField(default=0)),
+                ('late', models.PositiveIntegerField(default=0)),
+                ('absent', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('course', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='attendance.course')),
+            ],
+            options={
+                'verbose_name_plural': 'daily attendance summaries',
+                'ordering': ['-date'],
+                'unique_together': {('date', 'course')},
+            },
+        ),
+        migrations.RunPython(build_initial_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.1 on 2026-10-17 06:34
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0003_dailyattendancesummary'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EnrollmentJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('photo', models.ImageField(upload_to='student_photos/')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='queued', max_length=20)),
+                ('stage', models.CharField(blank=True, default='', max_length=20)),
+                ('confidence', models.FloatField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='enrollment_jobs', to='attendance.student')),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.0.1 on 2026-10-17 06:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0004_enrollmentjob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['date', 'time_in', 'id'], name='attendance_day_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['date', 'status'], name='attendance_day_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='attendance',
+            index=models.Index(fields=['student', 'date', 'status'], name='attendance_student_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='dailyattendancesummary',
+            index=models.Index(fields=['course', 'date'], name='summary_course_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['course', 'student_id'], name='student_course_idx'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.0.1 on 2026-10-17 07:04
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def rebuild_duplicate_no_course_days(apps, schema_editor):
+    # Every increment hit all of a day's duplicate rows, so recount those days from Attendance
+    Attendance = apps.get_model('attendance', 'Attendance')
+    DailyAttendanceSummary = apps.get_model('attendance', 'DailyAttendanceSummary')
+    no_course = DailyAttendanceSummary.objects.filter(course__isnull=True)
+    days = list(
+        no_course.values('date').annotate(n=Count('id')).filter(n__gt=1).values_list('date', flat=True).order_by()
+    )
+    if not days:
+        return
+    no_course.filter(date__in=days).delete()
+    rows = {}
+    records = Attendance.objects.filter(date__in=days, student__course__isnull=True)
+    for row in records.values('date', 'status').annotate(n=Count('id')).order_by():
+        summary = rows.setdefault(row['date'], DailyAttendanceSummary(date=row['date']))
+        if row['status'] in ('present', 'late', 'absent'):
+            setattr(summary, row['status'], row['n'])
+    DailyAttendanceSummary.objects.bulk_create(rows.values(), batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('attendance', '0005_query_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(rebuild_duplicate_no_course_days, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='dailyattendancesummary',
+            constraint=models.UniqueConstraint(condition=models.Q(('course__isnull', True)), fields=('date',), name='summary_no_course_day_uniq'),
+        ),
+    ]
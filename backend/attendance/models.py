@@ -1,6 +1,9 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth.models import User
 from django.utils import timezone
+from .encodings import decode_face_encoding, encode_face_encoding
 
 class Course(models.Model):
     name = models.CharField(max_length=100)
@@ -20,30 +23,123 @@ class Student(models.Model):
     course = models.ForeignKey(Course, on_delete=models.SET_NULL, null=True)
     photo = models.ImageField(upload_to='student_photos/', null=True, blank=True)
     face_encoding = models.BinaryField(null=True, blank=True)
+    face_encoding_model = models.CharField(max_length=50, blank=True, default='')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return f"{self.student_id} - {self.first_name} {self.last_name}"
 
+    def get_face_encoding(self):
+        """Decoded face encoding as a float32 vector, or None if not enrolled"""
+        if not self.face_encoding:
+            return None
+        return decode_face_encoding(self.face_encoding)
+
+    def set_face_encoding(self, encoding, model_version=None):
+        """Store a face encoding in the compact versioned format, tagged with the descriptor that produced it"""
+        if encoding is None:
+            self.face_encoding = None
+            self.face_encoding_model = ''
+            return
+        if model_version is None:
+            from .descriptors import get_descriptor
+            model_version = get_descriptor().version
+        self.face_encoding = encode_face_encoding(encoding)
+        self.face_encoding_model = model_version
+
     class Meta:
         ordering = ['student_id']
+        indexes = [
+            # Course rosters in student_id order without a sort
+            models.Index(fields=['course', 'student_id'], name='student_course_idx'),
+        ]
 
 class Attendance(models.Model):
-    student = models.ForeignKey(Student, on_delete=models.CASCADE)
-    date = models.DateField(default=timezone.now)
-    time_in = models.DateTimeField(auto_now_add=True)
-    status = models.CharField(max_length=20, choices=[
+    STATUS_CHOICES = [
         ('present', 'Present'),
         ('late', 'Late'),
         ('absent', 'Absent')
-    ], default='present')
+    ]
+
+    student = models.ForeignKey(Student, on_delete=models.CASCADE)
+    date = models.DateField(default=timezone.now)
+    time_in = models.DateTimeField(auto_now_add=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='present')
     confidence_score = models.FloatField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         unique_together = ['student', 'date']
         ordering = ['-date', '-time_in']
+        indexes = [
+            # List, keyset pagination and export order by (date, time_in, id)
+            models.Index(fields=['date', 'time_in', 'id'], name='attendance_day_time_idx'),
+            # Admin and report filters on one day's statuses
+            models.Index(fields=['date', 'status'], name='attendance_day_status_idx'),
+            # Covers per-student counts over a date range (stats, course-day lookups)
+            models.Index(fields=['student', 'date', 'status'], name='attendance_student_day_idx'),
+        ]
 
     def __str__(self):
         return f"{self.student} - {self.date} ({self.status})"
+
+class DailyAttendanceSummary(models.Model):
+    """
+    Per-day, per-course attendance counts, maintained incrementally from
+    Attendance writes (see rollups.py) so reports don't scan every row.
+    """
+    date = models.DateField()
+    # SET_NULL like Student.course, so a deleted course's counts move to "no course"
+    course = models.ForeignKey(Course, on_delete=models.SET_NULL, null=True, blank=True)
+    present = models.PositiveIntegerField(default=0)
+    late = models.PositiveIntegerField(default=0)
+    absent = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['date', 'course']
+        ordering = ['-date']
+        indexes = [
+            # One course's days in date order
+            models.Index(fields=['course', 'date'], name='summary_course_day_idx'),
+        ]
+        constraints = [
+            # NULLs never collide in unique_together, so the no-course bucket needs its own
+            models.UniqueConstraint(
+                fields=['date'], condition=models.Q(course__isnull=True), name='summary_no_course_day_uniq',
+            ),
+        ]
+        verbose_name_plural = 'daily attendance summaries'
+
+    def __str__(self):
+        return f"{self.date} {self.course or 'No course'}: {self.present}/{self.late}/{self.absent}"
+
+class EnrollmentJob(models.Model):
+    """
+    A photo waiting to be encoded in the background (see jobs.py). Stored in
+    the database so queued work and results survive a restart.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('succeeded', 'Succeeded'),
+        ('failed', 'Failed')
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='enrollment_jobs')
+    photo = models.ImageField(upload_to='student_photos/')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    stage = models.CharField(max_length=20, blank=True, default='')
+    confidence = models.FloatField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.student} - {self.status}"
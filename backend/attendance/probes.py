@@ -0,0 +1,89 @@
+"""
+Compact probe payloads for the face endpoints.
+
+A kiosk that already detects faces on the device can send ``check_face`` and
+``mark_attendance`` the face alone instead of the whole webcam frame:
+
+    face        the face region as a small grayscale JPEG or PNG, or a raw
+                128x128 uint8 buffer (16384 bytes, row-major)
+    face_box    "x,y,w,h" of the face in the client's frame
+    frame_size  "width,height" of that frame (optional, for the confidence)
+
+The region should be the detected box padded by 10% on each side, like the
+server-side crop. The server checks only the payload's size and dimensions.
+It then equalizes the region straight into the encoding stage: there is no
+full-frame decode, no cascade, and no Pillow check of a multi-megabyte upload.
+"""
+from dataclasses import dataclass
+
+import cv2
+import numpy as np
+
+from .descriptors import FACE_SIZE
+
+RAW_PROBE_BYTES = FACE_SIZE * FACE_SIZE
+MAX_PROBE_BYTES = 64 * 1024
+MIN_PROBE_SIDE = 32
+MAX_PROBE_SIDE = 512
+IMAGE_SIGNATURES = (b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n')
+
+
+@dataclass
+class FaceProbe:
+    region: np.ndarray  # uint8 grayscale face region
+    box: tuple  # (x, y, w, h) in the client's frame
+    frame_size: tuple = None  # (width, height), if the client sent it
+    data: bytes = b''
+
+    @property
+    def confidence(self):
+        """The server's detection confidence (face area ratio) when the frame size is known"""
+        if self.frame_size is None:
+            return None
+        _, _, w, h = self.box
+        return min(1.0, (w * h) / (self.frame_size[0] * self.frame_size[1]) * 10)
+
+
+def _parse_ints(value, count, name):
+    try:
+        numbers = tuple(int(part) for part in str(value).split(','))
+    except ValueError:
+        numbers = ()
+    if len(numbers) != count or any(n < 0 for n in numbers):
+        raise ValueError(f"{name} must be {count} comma-separated non-negative integers")
+    return numbers
+
+
+def decode_region(data):
+    """Face region from probe bytes: an encoded grayscale image or a raw FACE_SIZE square buffer"""
+    if data.startswith(IMAGE_SIGNATURES):
+        region = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_GRAYSCALE)
+        if region is not None:
+            if not (MIN_PROBE_SIDE <= min(region.shape) and max(region.shape) <= MAX_PROBE_SIDE):
+                raise ValueError(f"face sides must be between {MIN_PROBE_SIDE} and {MAX_PROBE_SIDE} pixels")
+            return region
+    if len(data) == RAW_PROBE_BYTES:
+        return np.frombuffer(data, np.uint8).reshape(FACE_SIZE, FACE_SIZE)
+    raise ValueError(
+        f"face must be a grayscale JPEG/PNG or a raw {FACE_SIZE}x{FACE_SIZE} uint8 buffer ({RAW_PROBE_BYTES} bytes)"
+    )
+
+
+def read_probe(upload, face_box, frame_size=None):
+    """Validate an uploaded probe; raises ValueError with a client-facing message"""
+    if upload.size > MAX_PROBE_BYTES:
+        raise ValueError(f"face must be at most {MAX_PROBE_BYTES // 1024}KB")
+    if not face_box:
+        raise ValueError("face_box is required with face")
+    box = _parse_ints(face_box, 4, 'face_box')
+    if not box[2] or not box[3]:
+        raise ValueError("face_box width and height must be positive")
+    size = None
+    if frame_size:
+        size = _parse_ints(frame_size, 2, 'frame_size')
+        if not size[0] or not size[1]:
+            raise ValueError("frame_size must be positive")
+
+    upload.seek(0)
+    data = upload.read()
+    return FaceProbe(decode_region(data), box, size, data)
@@ -0,0 +1,118 @@
+"""
+Incremental maintenance of DailyAttendanceSummary.
+
+Every Attendance write turns into +1/-1 deltas on (date, course, status).
+They are applied with F() expressions so concurrent kiosks never overwrite
+each other's counts. Single-row saves and deletes are handled by the
+signals in signals.py. Bulk writes, which send no signals, call
+``record_created`` themselves. ``rebuild_summaries`` recomputes a date range
+from scratch.
+
+A row counts towards its student's current course, like in
+``rebuild_summaries``. When a student changes course, ``record_course_changes``
+moves their rows to the new course's buckets. When a course is deleted,
+``merge_into_no_course`` folds its buckets into the no-course ones. Without
+these moves, a later delete would decrement the wrong bucket. Decrements
+are clamped at zero, so a count that drifted (e.g. after a queryset
+``update`` of courses) never violates the positive-count constraint.
+"""
+import logging
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+
+from .models import Attendance, DailyAttendanceSummary
+
+logger = logging.getLogger(__name__)
+
+STATUS_FIELDS = [name for name, _ in Attendance.STATUS_CHOICES]
+
+
+def apply_deltas(deltas):
+    """Apply a Counter of {(date, course_id, status): delta} to the summary table"""
+    for (day, course_id, status), delta in deltas.items():
+        if not delta or status not in STATUS_FIELDS:
+            continue
+        rows = DailyAttendanceSummary.objects.filter(date=day, course_id=course_id)
+        change = F(status) + delta if delta > 0 else Greatest(F(status) + delta, 0)
+        if rows.update(**{status: change}):
+            continue
+        try:
+            with transaction.atomic():
+                DailyAttendanceSummary.objects.create(date=day, course_id=course_id, **{status: max(delta, 0)})
+        except IntegrityError:
+            # Another writer created the row first
+            rows.update(**{status: change})
+
+
+def record_created(attendances, course_ids):
+    """Count freshly inserted rows; ``course_ids`` maps student pk to course pk"""
+    deltas = Counter(
+        (attendance.date, course_ids.get(attendance.student_id), attendance.status)
+        for attendance in attendances
+    )
+    apply_deltas(deltas)
+
+
+def record_change(previous, current):
+    """Move one row's contribution from ``previous`` to ``current`` (date, course_id, status) keys"""
+    deltas = Counter()
+    if previous is not None:
+        deltas[previous] -= 1
+    if current is not None:
+        deltas[current] += 1
+    apply_deltas(deltas)
+
+
+def record_course_changes(moves):
+    """Move students' rows between courses; ``moves`` maps student pk to (previous, current) course pks"""
+    moves = {pk: courses for pk, courses in moves.items() if courses[0] != courses[1]}
+    if not moves:
+        return
+    deltas = Counter()
+    rows = (
+        Attendance.objects.filter(student_id__in=moves)
+        .values('student_id', 'date', 'status').annotate(n=Count('id')).order_by()
+    )
+    for row in rows:
+        previous, current = moves[row['student_id']]
+        deltas[(row['date'], previous, row['status'])] -= row['n']
+        deltas[(row['date'], current, row['status'])] += row['n']
+    apply_deltas(deltas)
+
+
+def merge_into_no_course(course_id):
+    """Fold a course's summaries into the no-course buckets before the course is deleted"""
+    summaries = DailyAttendanceSummary.objects.filter(course_id=course_id)
+    deltas = Counter()
+    for row in summaries.values('date', *STATUS_FIELDS):
+        for status in STATUS_FIELDS:
+            deltas[(row['date'], None, status)] += row[status]
+    summaries.delete()
+    apply_deltas(deltas)
+
+
+def rebuild_summaries(start_date=None, end_date=None):
+    """Recompute the summaries for a date range (inclusive) from the Attendance table"""
+    records = Attendance.objects.all()
+    summaries = DailyAttendanceSummary.objects.all()
+    if start_date:
+        records = records.filter(date__gte=start_date)
+        summaries = summaries.filter(date__gte=start_date)
+    if end_date:
+        records = records.filter(date__lte=end_date)
+        summaries = summaries.filter(date__lte=end_date)
+
+    rows = {}
+    for row in records.values('date', 'student__course', 'status').annotate(n=Count('id')).order_by():
+        key = (row['date'], row['student__course'])
+        summary = rows.setdefault(key, DailyAttendanceSummary(date=key[0], course_id=key[1]))
+        setattr(summary, row['status'], row['n'])
+
+    with transaction.atomic():
+        summaries.delete()
+        DailyAttendanceSummary.objects.bulk_create(rows.values(), batch_size=500)
+    logger.info(f"Rebuilt {len(rows)} daily attendance summaries")
+    return len(rows)
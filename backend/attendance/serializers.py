@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import Course, Student, Attendance
+from .models import Course, Student, Attendance, EnrollmentJob
+from .probes import read_probe
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
@@ -41,12 +42,56 @@ class AttendanceSerializer(serializers.ModelSerializer):
         read_only_fields = ('time_in', 'created_at')
 
 class FaceRecognitionSerializer(serializers.Serializer):
-    image = serializers.ImageField(required=True, allow_empty_file=False)
+    image = serializers.ImageField(required=False, allow_empty_file=False)
+    # Compact alternative to image: a client-cropped face and its box (see probes.py)
+    face = serializers.FileField(required=False, allow_empty_file=False)
+    face_box = serializers.CharField(required=False)
+    frame_size = serializers.CharField(required=False)
     student_id = serializers.CharField(required=False, allow_blank=True)
+    # Match only this course's students; fallback retries the whole gallery
+    course = serializers.PrimaryKeyRelatedField(queryset=Course.objects.all(), required=False, allow_null=True)
+    fallback = serializers.BooleanField(required=False, allow_null=True, default=None)
 
     def validate_image(self, value):
         if not value:
             raise serializers.ValidationError("No image file was submitted.")
         if value.size > 5 * 1024 * 1024:  # 5MB limit
             raise serializers.ValidationError("Image file size must be less than 5MB.")
-        return value 
\ No newline at end of file
+        return value
+
+    def validate(self, data):
+        if data.get('face') is None:
+            if data.get('image') is None:
+                raise serializers.ValidationError({'image': 'No image file was submitted.'})
+            return data
+        if data.get('image') is not None:
+            raise serializers.ValidationError('Send either image or face, not both.')
+        try:
+            data['probe'] = read_probe(data['face'], data.get('face_box'), data.get('frame_size'))
+        except ValueError as e:
+            raise serializers.ValidationError({'face': str(e)})
+        return data
+
+class BatchFaceRecognitionSerializer(serializers.Serializer):
+    images = serializers.ListField(
+        child=serializers.ImageField(allow_empty_file=False),
+        allow_empty=False,
+        max_length=20
+    )
+    course = serializers.PrimaryKeyRelatedField(queryset=Course.objects.all(), required=False, allow_null=True)
+    fallback = serializers.BooleanField(required=False, allow_null=True, default=None)
+
+    def validate_images(self, value):
+        for image in value:
+            if image.size > 5 * 1024 * 1024:  # 5MB limit
+                raise serializers.ValidationError("Each image file must be less than 5MB.")
+        return value
+
+class EnrollmentJobSerializer(serializers.ModelSerializer):
+    student = serializers.SlugRelatedField(slug_field='student_id', read_only=True)
+
+    class Meta:
+        model = EnrollmentJob
+        fields = ('id', 'student', 'status', 'stage', 'confidence', 'error',
+                  'created_at', 'started_at', 'finished_at')
+        read_only_fields = fields
@@ -0,0 +1,146 @@
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .caches import marked_today
+from .gallery import face_gallery
+from .models import Attendance, Course, Student
+from .rollups import merge_into_no_course, record_change, record_course_changes
+
+
+@receiver(post_save, sender=Student)
+def sync_gallery_on_save(sender, instance, **kwargs):
+    """Keep the in-memory face gallery in step with the student's stored encoding"""
+    if 'face_encoding' in instance.get_deferred_fields():
+        # Loaded without the encoding (list/detail querysets), so only the course can have changed
+        face_gallery.move(instance.pk, instance.course_id)
+        return
+    if instance.face_encoding:
+        face_gallery.upsert(instance.pk, instance.get_face_encoding(), instance.face_encoding_model,
+                            instance.course_id)
+    else:
+        face_gallery.remove(instance.pk)
+
+
+@receiver(post_delete, sender=Student)
+def sync_gallery_on_delete(sender, instance, **kwargs):
+    face_gallery.remove(instance.pk)
+
+
+# Marks a save whose previous course was not looked up (new student, course not saved)
+_COURSE_UNCHANGED = object()
+
+
+@receiver(pre_save, sender=Student)
+def remember_previous_course(sender, instance, raw=False, update_fields=None, **kwargs):
+    instance._previous_course = _COURSE_UNCHANGED
+    if raw or instance.pk is None or (update_fields is not None and 'course' not in update_fields):
+        return
+    instance._previous_course = (
+        Student.objects.filter(pk=instance.pk).values_list('course_id', flat=True).first()
+    )
+
+
+@receiver(post_save, sender=Student)
+def move_rollup_on_course_change(sender, instance, created=False, **kwargs):
+    """A student's attendance counts towards their current course (see rollups.py)"""
+    previous = getattr(instance, '_previous_course', _COURSE_UNCHANGED)
+    if not created and previous is not _COURSE_UNCHANGED and previous != instance.course_id:
+        record_course_changes({instance.pk: (previous, instance.course_id)})
+
+
+@receiver(pre_delete, sender=Course)
+def merge_rollup_on_course_delete(sender, instance, **kwargs):
+    # Students of the course are set to no course, so their counts move with them
+    merge_into_no_course(instance.pk)
+
+
+def _rollup_key(attendance):
+    """(date, course_id, status) bucket the attendance row counts towards"""
+    if Attendance.student.is_cached(attendance):
+        course_id = attendance.student.course_id
+    else:
+        course_id = Student.objects.filter(pk=attendance.student_id).values_list('course_id', flat=True).first()
+    # date may still hold the datetime from the field default
+    day = Attendance._meta.get_field('date').to_python(attendance.date)
+    return day, course_id, attendance.status
+
+
+@receiver(pre_save, sender=Attendance)
+def remember_previous_rollup_key(sender, instance, **kwargs):
+    instance._rollup_previous = None
+    instance._marked_previous = None
+    if instance.pk is not None:
+        previous = (
+            Attendance.objects.filter(pk=instance.pk)
+            .values_list('date', 'student__course', 'status', 'student')
+            .first()
+        )
+        if previous is not None:
+            instance._rollup_previous = previous[:3]
+            instance._marked_previous = (previous[0], previous[3])
+
+
+@receiver(post_save, sender=Attendance)
+def update_rollup_on_save(sender, instance, raw=False, **kwargs):
+    """Keep DailyAttendanceSummary counts in step with single-row writes"""
+    if raw:
+        return
+    previous = getattr(instance, '_rollup_previous', None)
+    current = _rollup_key(instance)
+    if previous != current:
+        record_change(previous, current)
+    # An edit can move the row to another student or day; neither key's cached answer holds
+    marked = getattr(instance, '_marked_previous', None)
+    if marked is not None:
+        marked_today.discard(marked)
+    marked_today.discard((current[0], instance.student_id))
+
+
+@receiver(post_delete, sender=Attendance)
+def update_rollup_on_delete(sender, instance, **kwargs):
+    key = _rollup_key(instance)
+    record_change(key, None)
+    # The student can be marked again for that day
+    marked_today.discard((key[0], instance.student_id))
+
+
+# PRAGMA takes no bound parameters, so SQLITE_PRAGMAS is limited to these
+# names, each with its accepted keywords or int for a numeric value
+SQLITE_PRAGMA_VALUES = {
+    'journal_mode': {'delete', 'truncate', 'persist', 'memory', 'wal', 'off'},
+    'synchronous': {'off', 'normal', 'full', 'extra'},
+    'busy_timeout': int,
+    'cache_size': int,
+    'mmap_size': int,
+    'temp_store': {'default', 'file', 'memory'},
+}
+
+
+def sqlite_pragma_statements(pragmas):
+    """PRAGMA statements for a SQLITE_PRAGMAS dict; raises ImproperlyConfigured for anything off the allowlist"""
+    statements = []
+    for pragma, value in pragmas.items():
+        allowed = SQLITE_PRAGMA_VALUES.get(pragma)
+        if allowed is None:
+            raise ImproperlyConfigured(f"Unsupported SQLite pragma: {pragma}")
+        if allowed is int:
+            valid = isinstance(value, int) and not isinstance(value, bool)
+        else:
+            valid = isinstance(value, str) and value.lower() in allowed
+        if not valid:
+            raise ImproperlyConfigured(f"Invalid value for SQLite pragma {pragma}: {value!r}")
+        statements.append(f'PRAGMA {pragma} = {value}')
+    return statements
+
+
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """Tune each new SQLite connection with settings.SQLITE_PRAGMAS"""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for statement in sqlite_pragma_statements(getattr(settings, 'SQLITE_PRAGMAS', {})):
+            cursor.execute(statement)
@@ -0,0 +1,121 @@
+"""
+WebSocket face detection stream.
+
+Kiosk pages can keep a single WebSocket open and push binary JPEG frames
+instead of POSTing one multipart request to ``check_face`` every 500 ms.
+Each frame is answered with the same JSON shape ``check_face`` returns, plus
+the frame sequence number and how many frames were dropped.
+
+Only the newest frame is kept per connection: while detection is running,
+newer frames overwrite the pending one, so a slow detector never builds up a
+queue of stale frames. Detection runs in a bounded, process-wide thread pool.
+
+This is a plain ASGI application mounted in ``backend/asgi.py``; it needs an
+ASGI server such as uvicorn or daphne (``runserver`` only speaks HTTP).
+"""
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+MAX_FRAME_BYTES = 5 * 1024 * 1024  # Same limit as FaceRecognitionSerializer
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'FACE_STREAM_WORKERS', 4),
+            thread_name_prefix='face-stream',
+        )
+    return _executor
+
+
+def detect_frame(data):
+    """Run the detection fast path on one frame and build the JSON payload"""
+    from .views import detect_face
+
+    confidence, face_position = detect_face(data)
+    if not face_position:
+        return {'face_detected': False, 'message': 'No face detected'}
+    x, y, w, h = face_position
+    return {
+        'face_detected': True,
+        'confidence': confidence,
+        'face_position': {'x': x, 'y': y, 'width': w, 'height': h},
+    }
+
+
+class FrameSession:
+    """Per-connection state: the newest unprocessed frame and drop counters"""
+
+    def __init__(self, send):
+        self.send = send
+        self.pending = None
+        self.sequence = 0
+        self.dropped = 0
+        self.frame_ready = asyncio.Event()
+
+    def offer(self, data):
+        if self.pending is not None:
+            self.dropped += 1
+        self.sequence += 1
+        self.pending = (self.sequence, data)
+        self.frame_ready.set()
+
+    async def send_json(self, payload):
+        await self.send({'type': 'websocket.send', 'text': json.dumps(payload)})
+
+    async def process_frames(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self.frame_ready.wait()
+            self.frame_ready.clear()
+            sequence, data = self.pending
+            self.pending = None
+            try:
+                payload = await loop.run_in_executor(get_executor(), detect_frame, data)
+            except Exception as e:
+                logger.error(f"Error in streamed face detection: {str(e)}")
+                payload = {'error': str(e)}
+            payload.update({'frame': sequence, 'dropped': self.dropped})
+            await self.send_json(payload)
+
+
+async def face_detection_stream(scope, receive, send):
+    """ASGI WebSocket handler for continuous face detection"""
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    await send({'type': 'websocket.accept'})
+
+    session = FrameSession(send)
+    worker = asyncio.create_task(session.process_frames())
+    try:
+        while True:
+            message = await receive()
+            if message['type'] == 'websocket.disconnect':
+                break
+            if message['type'] != 'websocket.receive':
+                continue
+            data = message.get('bytes')
+            if not data:
+                await session.send_json({'error': 'Frames must be sent as binary JPEG messages'})
+                continue
+            if len(data) > MAX_FRAME_BYTES:
+                await session.send_json({'error': 'Image file size must be less than 5MB.'})
+                continue
+            session.offer(data)
+    finally:
+        worker.cancel()
+        try:
+            await worker
+        except asyncio.CancelledError:
+            pass
+        logger.info(f"Face stream closed after {session.sequence} frames ({session.dropped} dropped)")
@@ -1,3 +1,1111 @@
+import asyncio
+import io
+import json
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from pathlib import Path
+from unittest import mock, skipUnless
+
+import cv2
+import numpy as np
+from PIL import Image
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError, connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import gallery_file, jobs, marking, views
+from .ann import IVFIndex
+from .benchmarks import BASELINE_SQLITE_PRAGMAS, isolated_face_gallery
+from .caches import TTLCache, clear_caches, frame_cache, marked_today
+from .descriptors import PCADescriptor, calibrate_threshold, get_descriptor, match_threshold
+from .detectors import detector_pool
+from .enrollment import RosterImporter
+from .encodings import decode_face_encoding, encode_face_encoding, is_legacy_encoding, upgrade_face_encoding
+from .gallery import FaceGallery, face_gallery
+from .marking import mark_present
+from .metrics import registry
+from .models import Attendance, Course, DailyAttendanceSummary, EnrollmentJob, Student
+from .rollups import rebuild_summaries
+from .signals import sqlite_pragma_statements
+from .streaming import face_detection_stream
+from .views import DecodedImage, decode_grayscale, detect_face, extract_face_encoding
+
+SAMPLE_PHOTO = Path(settings.MEDIA_ROOT) / 'student_photos' / 'capture.jpg'
+
+
+def make_student(index, encoding=None, course=None):
+    return Student.objects.create(
+        student_id=f'S{index:04d}',
+        first_name='Test',
+        last_name=f'Student {index}',
+        email=f'student{index}@example.com',
+        course=course,
+        face_encoding=None if encoding is None else np.asarray(encoding, dtype=np.float64).tobytes(),
+        face_encoding_model='' if encoding is None else get_descriptor().version,
+    )
+
+
+class FaceGalleryTests(TestCase):
+    def setUp(self):
+        face_gallery.clear()
+        self.course = Course.objects.create(name='Physics', code='PHY101')
+        rng = np.random.default_rng(0)
+        self.encodings = rng.random((5, 64))
+        self.students = [make_student(i, enc, self.course) for i, enc in enumerate(self.encodings)]
+
+    def tearDown(self):
+        face_gallery.clear()
+
+    def test_search_returns_best_match_first(self):
+        results = face_gallery.search(self.encodings[3], top_k=2)
+        self.assertEqual(results[0][0], self.students[3].pk)
+        self.assertAlmostEqual(results[0][1], 1.0, places=5)
+        self.assertEqual(len(results), 2)
+
+    def test_signals_keep_index_in_sync(self):
+        self.assertEqual(face_gallery.size, 5)
+        newcomer = make_student(99, np.ones(64), self.course)
+        self.assertEqual(face_gallery.size, 6)
+        self.assertEqual(face_gallery.search(np.ones(64))[0][0], newcomer.pk)
+
+        self.students[0].delete()
+        self.assertEqual(face_gallery.size, 5)
+
+        newcomer.face_encoding = None
+        newcomer.save()
+        self.assertEqual(face_gallery.size, 4)
+
+    def test_dimension_mismatch_returns_no_candidates(self):
+        self.assertEqual(face_gallery.search(np.ones(32)), [])
+
+    def test_other_descriptor_versions_are_not_indexed(self):
+        stale = make_student(50, self.encodings[0], self.course)
+        Student.objects.filter(pk=stale.pk).update(face_encoding_model='hog-v1')
+        face_gallery.clear()
+        with self.assertLogs('attendance.gallery', 'WARNING') as logs:
+            self.assertEqual(face_gallery.size, 5)
+        self.assertIn("1 students have face encodings from another descriptor", logs.output[0])
+        self.assertNotIn(stale.pk, [pk for pk, _ in face_gallery.search(self.encodings[0], top_k=10)])
+
+    def test_workers_share_memory_mapped_file(self):
+        with tempfile.TemporaryDirectory() as tmp, self.settings(FACE_GALLERY_FILE=f'{tmp}/gallery.bin'):
+            face_gallery.clear()
+            self.assertEqual(face_gallery.size, 5)
+            other_worker = FaceGallery()
+            self.assertEqual(other_worker.size, 5)
+            self.assertIsInstance(other_worker._matrix, np.memmap)
+
+            # An update published by one process is picked up by the other once it commits
+            with self.captureOnCommitCallbacks(execute=True):
+                newcomer = make_student(99, np.ones(64), self.course)
+            self.assertEqual(other_worker.search(np.ones(64))[0][0], newcomer.pk)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.students[0].delete()
+            self.assertEqual(other_worker.size, 5)
+            face_gallery.clear()
+        face_gallery.clear()
+
+    def test_shared_file_is_published_once_per_transaction(self):
+        rng = np.random.default_rng(1)
+        with tempfile.TemporaryDirectory() as tmp, self.settings(FACE_GALLERY_FILE=f'{tmp}/gallery.bin'):
+            face_gallery.clear()
+            self.assertEqual(face_gallery.size, 5)
+            with mock.patch.object(gallery_file, 'write_gallery', wraps=gallery_file.write_gallery) as write:
+                with self.captureOnCommitCallbacks(execute=True):
+                    newcomers = [make_student(100 + i, rng.normal(size=64), self.course) for i in range(3)]
+                    self.students[0].delete()
+                    self.assertEqual(FaceGallery().size, 5)
+            self.assertEqual(write.call_count, 1)
+            other_worker = FaceGallery()
+            self.assertEqual(other_worker.size, 7)
+            self.assertEqual(other_worker.search(newcomers[2].get_face_encoding())[0][0], newcomers[2].pk)
+            face_gallery.clear()
+        face_gallery.clear()
+
+    def test_batched_updates_apply_on_exit(self):
+        with self.settings(FACE_GALLERY_REFRESH_INTERVAL=None):
+            self.assertEqual(face_gallery.size, 5)
+            with face_gallery.batched():
+                newcomer = make_student(99, np.ones(64), self.course)
+                self.students[0].delete()
+                self.students[1].face_encoding = None
+                self.students[1].save()
+                self.assertEqual(face_gallery.size, 5)
+            self.assertEqual(face_gallery.size, 4)
+            found = [pk for pk, _ in face_gallery.search(np.ones(64), top_k=10)]
+        self.assertEqual(found[0], newcomer.pk)
+        self.assertNotIn(self.students[0].pk, found)
+        self.assertNotIn(self.students[1].pk, found)
+
+    def test_workers_refresh_from_database_stamp(self):
+        with self.settings(FACE_GALLERY_REFRESH_INTERVAL=0):
+            other_worker = FaceGallery()
+            self.assertEqual(other_worker.size, 5)
+
+            # Writes from this process never reach the other worker's signals
+            newcomer = make_student(99, np.ones(64), self.course)
+            self.assertEqual(other_worker.search(np.ones(64))[0][0], newcomer.pk)
+            self.students[0].delete()
+            self.assertEqual(other_worker.size, 5)
+            self.assertNotIn(self.students[0].pk, [pk for pk, _ in other_worker.search(self.encodings[0], top_k=10)])
+
+        with self.settings(FACE_GALLERY_REFRESH_INTERVAL=None):
+            make_student(100, np.ones(64), self.course)
+            self.assertEqual(other_worker.size, 5)
+
+
+class BenchmarkIsolationTests(TestCase):
+    def tearDown(self):
+        face_gallery.clear()
+
+    def test_isolated_gallery_leaves_shared_files_alone(self):
+        with tempfile.TemporaryDirectory() as tmp, \
+                self.settings(FACE_GALLERY_FILE=f'{tmp}/gallery.bin', FACE_ANN_INDEX_FILE=f'{tmp}/ann.npz'):
+            make_student(1, np.ones(64))
+            face_gallery.clear()
+            self.assertEqual(face_gallery.size, 1)
+            published = gallery_file.file_identity(f'{tmp}/gallery.bin')
+
+            with isolated_face_gallery() as gallery, self.captureOnCommitCallbacks(execute=True):
+                self.assertIsNot(views.face_gallery, face_gallery)
+                make_student(2, -np.ones(64))
+                gallery.clear()
+                self.assertEqual(gallery.size, 2)
+                self.assertNotEqual(settings.FACE_GALLERY_FILE, f'{tmp}/gallery.bin')
+
+            self.assertIs(views.face_gallery, face_gallery)
+            self.assertEqual(gallery_file.file_identity(f'{tmp}/gallery.bin'), published)
+            self.assertFalse(Path(f'{tmp}/ann.npz').exists())
+
+
+class ApproximateSearchTests(TestCase):
+    def setUp(self):
+        face_gallery.clear()
+        rng = np.random.default_rng(0)
+        # 12 well-separated identities with a few enrollments each
+        centers = rng.random((12, 64)) * 4
+        self.encodings = np.repeat(centers, 10, axis=0) + rng.normal(0, 0.05, (120, 64))
+        self.students = [make_student(i, enc) for i, enc in enumerate(self.encodings)]
+
+    def tearDown(self):
+        face_gallery.clear()
+
+    def ann_settings(self, **overrides):
+        return self.settings(**{'FACE_ANN_ENABLED': True, 'FACE_ANN_MIN_SIZE': 100, 'FACE_ANN_LISTS': 12,
+                                'FACE_ANN_PROBES': 2, 'FACE_ANN_INDEX_FILE': None, **overrides})
+
+    def test_ivf_index_agrees_with_exact_search(self):
+        probes = self.encodings[::7] + np.random.default_rng(1).normal(0, 0.01, (18, 64))
+        exact = face_gallery.search_batch(probes, top_k=3)
+        with self.ann_settings():
+            approximate = face_gallery.search_batch(probes, top_k=3)
+            self.assertIsNotNone(face_gallery._ann)
+        self.assertEqual([[pk for pk, _ in row] for row in approximate], [[pk for pk, _ in row] for row in exact])
+        self.assertAlmostEqual(approximate[0][0][1], exact[0][0][1], places=5)
+
+    def test_enrollment_is_inserted_without_retraining(self):
+        with self.ann_settings():
+            face_gallery.search(self.encodings[0])
+            index = face_gallery._ann
+            newcomer = make_student(500, self.encodings[30] + 0.5)
+            self.assertIn(newcomer.pk, index._pks)
+            self.assertEqual(face_gallery.search(self.encodings[30] + 0.5)[0][0], newcomer.pk)
+            self.assertIs(face_gallery._ann, index)
+
+    def test_low_scoring_probes_fall_back_to_exact_scan(self):
+        probe = -self.encodings[5]
+        with self.ann_settings(FACE_ANN_PROBES=1, FACE_ANN_EXACT_BELOW=None):
+            face_gallery.search(probe)
+            with mock.patch.object(face_gallery, '_exact_search', wraps=face_gallery._exact_search) as exact:
+                face_gallery.search(self.encodings[5])
+                self.assertFalse(exact.called)
+        with self.ann_settings(FACE_ANN_PROBES=1, FACE_ANN_EXACT_BELOW=0.99):
+            with mock.patch.object(face_gallery, '_exact_search', wraps=face_gallery._exact_search) as exact:
+                face_gallery.search(probe)
+                self.assertTrue(exact.called)
+
+    def test_index_persists_to_disk(self):
+        with tempfile.TemporaryDirectory() as tmp, self.ann_settings(FACE_ANN_INDEX_FILE=f'{tmp}/faces.npz'):
+            trained = face_gallery.build_ann_index()
+            restored = IVFIndex.load(f'{tmp}/faces.npz')
+            np.testing.assert_array_equal(restored.centroids, trained.centroids)
+            np.testing.assert_array_equal(restored._cells, trained._cells)
+
+            # A restarted worker loads the saved index instead of retraining
+            face_gallery.clear()
+            with mock.patch.object(IVFIndex, 'train') as train:
+                self.assertEqual(face_gallery.search(self.encodings[40])[0][0], self.students[40].pk)
+                self.assertFalse(train.called)
+
+            Path(f'{tmp}/faces.npz').write_bytes(b'not an index')
+            self.assertIsNone(IVFIndex.load(f'{tmp}/faces.npz'))
+
+
+class FaceEncodingFormatTests(TestCase):
+    def test_round_trip_and_legacy_upgrade(self):
+        vector = np.linspace(0, 1, 256)
+        for dtype in ('float16', 'float32'):
+            for compress in (False, True):
+                blob = encode_face_encoding(vector, dtype=dtype, compress=compress)
+                self.assertFalse(is_legacy_encoding(blob))
+                np.testing.assert_allclose(decode_face_encoding(blob), vector, atol=1e-3)
+
+        student = make_student(1, vector)
+        self.assertTrue(is_legacy_encoding(student.face_encoding))
+        self.assertTrue(upgrade_face_encoding(student))
+        student.refresh_from_db()
+        self.assertFalse(is_legacy_encoding(student.face_encoding))
+        self.assertLess(len(student.face_encoding), vector.nbytes)
+        np.testing.assert_allclose(student.get_face_encoding(), vector, atol=1e-6)
+
+
+class CheckFaceTests(TestCase):
+    def setUp(self):
+        clear_caches()
+
+    def test_detect_only_path_returns_full_resolution_box(self):
+        with open(SAMPLE_PHOTO, 'rb') as f:
+            upload = SimpleUploadedFile('frame.jpg', f.read(), content_type='image/jpeg')
+        response = self.client.post('/api/attendance/check_face/', {'image': upload})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['face_detected'])
+        box = response.data['face_position']
+        height, width = cv2.imread(str(SAMPLE_PHOTO)).shape[:2]
+        self.assertLessEqual(box['x'] + box['width'], width)
+        self.assertLessEqual(box['y'] + box['height'], height)
+
+    def test_emits_one_summary_record_per_request(self):
+        upload = SimpleUploadedFile('frame.jpg', SAMPLE_PHOTO.read_bytes(), content_type='image/jpeg')
+        with self.assertLogs('attendance', 'DEBUG') as logs:
+            self.client.post('/api/attendance/check_face/', {'image': upload})
+        summaries = [r for r in logs.records if hasattr(r, 'face_request')]
+        self.assertEqual(len(summaries), 1)
+        self.assertEqual(summaries[0].face_request['endpoint'], 'check_face')
+        self.assertIn('detect', summaries[0].face_request['stages_ms'])
+
+    def test_exif_rotated_upload_maps_boxes_to_upright_frame(self):
+        # A portrait phone photo: stored sideways with orientation 6, large enough for a reduced decode
+        upright = cv2.resize(cv2.imread(str(SAMPLE_PHOTO), cv2.IMREAD_GRAYSCALE), (1400, 1048))
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        rotated = io.BytesIO()
+        Image.fromarray(cv2.rotate(upright, cv2.ROTATE_90_COUNTERCLOCKWISE)).save(rotated, 'JPEG', exif=exif)
+        plain = cv2.imencode('.jpg', upright)[1].tobytes()
+
+        gray, scale = decode_grayscale(rotated.getvalue(), max_side=700)
+        self.assertEqual(gray.shape, (524, 700))
+        self.assertAlmostEqual(scale, 2.0)
+        _, expected = detect_face(plain, max_side=700)
+        _, box = detect_face(rotated.getvalue(), max_side=700)
+        np.testing.assert_allclose(box, expected, atol=expected[2] * 0.1)
+        _, _, position = extract_face_encoding(rotated.getvalue())
+        np.testing.assert_allclose(position, expected, atol=expected[2] * 0.1)
+
+
+class FaceProbePayloadTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        face_gallery.clear()
+        encoding, _, _ = extract_face_encoding(str(SAMPLE_PHOTO))
+        self.student = make_student(1, encoding)
+        self.encoding = encoding
+
+        # What a kiosk with on-device detection would send: the padded face region
+        decoded = DecodedImage(str(SAMPLE_PHOTO))
+        x, y, w, h = max(decoded.detect(), key=lambda face: face[2] * face[3])
+        pad = int(0.1 * w)
+        region = decoded.gray[max(0, y - pad):y + h + pad, max(0, x - pad):x + w + pad]
+        self.region = cv2.resize(region, (128, 128))
+        self.box = ','.join(str(v) for v in decoded.to_source((x, y, w, h)))
+
+    def tearDown(self):
+        clear_caches()
+        face_gallery.clear()
+
+    def post(self, endpoint, face, **data):
+        with self.assertLogs('attendance.face_requests', 'INFO') as logs:
+            response = self.client.post(f'/api/attendance/{endpoint}/', {
+                'face': SimpleUploadedFile('face.bin', face), 'face_box': self.box, **data
+            })
+        return response, logs.records[-1].face_request
+
+    def test_raw_probe_marks_attendance_without_decode_or_detection(self):
+        response, record = self.post('mark_attendance', self.region.tobytes())
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(record['student'], self.student.student_id)
+        self.assertNotIn('decode', record['stages_ms'])
+        self.assertNotIn('detect', record['stages_ms'])
+
+    def test_jpeg_probe_and_check_face(self):
+        jpeg = cv2.imencode('.jpg', self.region)[1].tobytes()
+        response, _ = self.post('check_face', jpeg, frame_size='640,480')
+        self.assertTrue(response.data['face_detected'])
+        self.assertEqual(response.data['face_position']['x'], int(self.box.split(',')[0]))
+        self.assertIsNotNone(response.data['confidence'])
+
+        response, record = self.post('mark_attendance', jpeg)
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertGreater(record['best_similarity'], 0.9)
+
+    def test_invalid_probes_are_rejected(self):
+        for face, data in [
+            (b'\0' * 1000, {}),
+            (self.region.tobytes(), {'face_box': '1,2,3'}),
+            (cv2.imencode('.png', np.zeros((8, 8), np.uint8))[1].tobytes(), {}),
+        ]:
+            response = self.client.post('/api/attendance/mark_attendance/', {
+                'face': SimpleUploadedFile('face.bin', face), 'face_box': self.box, **data
+            })
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('face', response.data['details'])
+
+    def test_non_face_patch_does_not_match(self):
+        # A corner of the frame away from the face; HOG still scores it about 0.82
+        gray = cv2.imread(str(SAMPLE_PHOTO), cv2.IMREAD_GRAYSCALE)
+        background = cv2.resize(gray[-120:, :120], (128, 128)).tobytes()
+        response, record = self.post('mark_attendance', background)
+        self.assertEqual(response.status_code, 400, response.data)
+        self.assertEqual(record['result'], 'no_match')
+        self.assertGreater(record['best_similarity'], 0.7)
+        self.assertFalse(Attendance.objects.exists())
+
+        response, _ = self.post('mark_attendance', background, student_id=self.student.student_id)
+        self.assertEqual(response.status_code, 400, response.data)
+        self.assertFalse(Attendance.objects.exists())
+
+
+class MatchThresholdTests(TestCase):
+    def test_thresholds_are_per_descriptor_version(self):
+        self.assertEqual(match_threshold('hog-v1'), get_descriptor('hog').match_threshold)
+        self.assertEqual(match_threshold('raw-v1'), get_descriptor('raw').match_threshold)
+        with self.settings(FACE_MATCH_THRESHOLDS={'hog-v1': 0.5}):
+            self.assertEqual(match_threshold('hog-v1'), 0.5)
+
+    def test_calibrated_threshold_rejects_impostor_pairs(self):
+        rng = np.random.default_rng(0)
+        impostors = np.abs(rng.normal(size=(200, 64)))
+        threshold = calibrate_threshold(impostors, false_match_rate=0.01)
+        unit = impostors / np.linalg.norm(impostors, axis=1, keepdims=True)
+        scores = (unit @ unit.T)[np.triu_indices(200, k=1)]
+        self.assertLessEqual((scores > threshold).mean(), 0.01)
+        self.assertGreater(threshold, 0.7)
+
+    def test_pca_model_stores_its_threshold(self):
+        rng = np.random.default_rng(0)
+        patches = rng.integers(0, 256, (40, 128, 128), dtype=np.uint8)
+        with tempfile.TemporaryDirectory() as tmp:
+            descriptor = PCADescriptor.fit(patches, n_components=16, path=Path(tmp) / 'pca.npz')
+            reloaded = PCADescriptor(Path(tmp) / 'pca.npz')
+        self.assertIsNotNone(descriptor.match_threshold)
+        self.assertEqual(reloaded.match_threshold, descriptor.match_threshold)
+
+
+class DetectorPoolTests(TestCase):
+    def tearDown(self):
+        detector_pool.reset()
+
+    def test_threads_get_own_classifier_and_respect_limit(self):
+        gray = cv2.imread(str(SAMPLE_PHOTO), cv2.IMREAD_GRAYSCALE)
+        with self.settings(FACE_DETECTION_CONCURRENCY=2):
+            detector_pool.reset()
+            with ThreadPoolExecutor(4) as executor:
+                results = list(executor.map(lambda _: (detector_pool.classifier(), detector_pool.detect(gray)), range(8)))
+            self.assertEqual(detector_pool.concurrency, 2)
+
+        boxes = {tuple(map(tuple, faces)) for _, faces in results}
+        self.assertEqual(len(boxes), 1)
+        self.assertGreater(len({id(classifier) for classifier, _ in results}), 1)
+        self.assertEqual(cv2.getNumThreads(), 1)
+
+
+class LargeUploadDecodingTests(TestCase):
+    def test_large_photo_matches_original_encoding(self):
+        image = cv2.imread(str(SAMPLE_PHOTO))
+        large = cv2.resize(image, (4000, 3000), interpolation=cv2.INTER_CUBIC)
+        upload = SimpleUploadedFile('large.jpg', cv2.imencode('.jpg', large)[1].tobytes(), content_type='image/jpeg')
+
+        encoding, _, (x, y, w, h) = extract_face_encoding(upload)
+        original, _, _ = extract_face_encoding(str(SAMPLE_PHOTO))
+        similarity = encoding @ original / (np.linalg.norm(encoding) * np.linalg.norm(original))
+        self.assertGreater(similarity, 0.9)
+        self.assertLessEqual(x + w, 4000)
+        self.assertLessEqual(y + h, 3000)
+        self.assertGreater(w, 500)
+
+
+class FaceDetectionStreamTests(TestCase):
+    def test_stream_answers_binary_frames(self):
+        with open(SAMPLE_PHOTO, 'rb') as f:
+            frame = f.read()
+        incoming = [
+            {'type': 'websocket.connect'},
+            {'type': 'websocket.receive', 'bytes': frame},
+        ]
+        sent = []
+
+        async def run():
+            replied = asyncio.Event()
+
+            async def receive():
+                if incoming:
+                    return incoming.pop(0)
+                await asyncio.wait_for(replied.wait(), timeout=10)
+                return {'type': 'websocket.disconnect'}
+
+            async def send(message):
+                sent.append(message)
+                if message['type'] == 'websocket.send':
+                    replied.set()
+
+            await face_detection_stream({'type': 'websocket', 'path': '/ws/face-detection/'}, receive, send)
+
+        asyncio.run(run())
+        self.assertEqual(sent[0]['type'], 'websocket.accept')
+        payload = json.loads(sent[1]['text'])
+        self.assertTrue(payload['face_detected'])
+        self.assertEqual(payload['frame'], 1)
+
+
+class FaceCacheTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        face_gallery.clear()
+        encoding, _, _ = extract_face_encoding(str(SAMPLE_PHOTO))
+        self.student = make_student(1, encoding)
+
+    def tearDown(self):
+        clear_caches()
+        face_gallery.clear()
+
+    def mark(self):
+        upload = SimpleUploadedFile('frame.jpg', SAMPLE_PHOTO.read_bytes(), content_type='image/jpeg')
+        with self.assertLogs('attendance.face_requests', 'INFO') as logs:
+            response = self.client.post('/api/attendance/mark_attendance/', {'image': upload})
+        return response, logs.records[-1].face_request
+
+    def test_lru_and_ttl_eviction(self):
+        now = [0.0]
+        cache = TTLCache(max_entries=2, ttl=10, clock=lambda: now[0])
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        now[0] = 11
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(cache.stats(), {'entries': 1, 'hits': 1, 'misses': 2, 'evictions': 2})
+
+    def test_repeated_frame_skips_detection(self):
+        data = SAMPLE_PHOTO.read_bytes()
+        for _ in range(2):
+            self.client.post('/api/attendance/check_face/', {'image': SimpleUploadedFile('f.jpg', data)})
+        self.assertEqual(frame_cache.stats()['hits'], 1)
+
+    def test_duplicate_mark_short_circuits_before_encoding(self):
+        response, record = self.mark()
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('encode', record['stages_ms'])
+
+        response, record = self.mark()
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(record['cache'], 'hit')
+        self.assertNotIn('encode', record['stages_ms'])
+
+        # Deleting the row lets the student be marked again
+        Attendance.objects.filter(student=self.student).delete()
+        self.assertIsNone(marked_today.get((timezone.now().date(), self.student.pk)))
+        response, _ = self.mark()
+        self.assertEqual(response.status_code, 201)
+
+    def test_student_id_mark_verifies_the_face_before_the_cache(self):
+        today = timezone.now().date()
+        marked_today.set((today, self.student.pk), True)
+        blank = io.BytesIO()
+        Image.new('RGB', (200, 200), 'white').save(blank, 'JPEG')
+        for data, error in ((blank.getvalue(), 'No face detected'), (SAMPLE_PHOTO.read_bytes(), 'already marked')):
+            upload = SimpleUploadedFile('frame.jpg', data, content_type='image/jpeg')
+            with self.assertLogs('attendance.face_requests', 'INFO') as logs:
+                response = self.client.post('/api/attendance/mark_attendance/',
+                                            {'image': upload, 'student_id': self.student.student_id})
+            self.assertEqual(response.status_code, 400)
+            self.assertIn(error, response.data['error'])
+        self.assertEqual(logs.records[-1].face_request['cache'], 'hit')
+        self.assertIn('match', logs.records[-1].face_request['stages_ms'])
+
+    def test_editing_a_row_clears_both_cached_keys(self):
+        other = make_student(2)
+        today = timezone.now().date()
+        attendance = Attendance.objects.create(student=self.student, date=today, status='present')
+        marked_today.set((today, self.student.pk), True)
+        marked_today.set((today, other.pk), True)
+
+        attendance.student = other
+        attendance.save()
+        self.assertIsNone(marked_today.get((today, self.student.pk)))
+        self.assertIsNone(marked_today.get((today, other.pk)))
+
+
+class CourseScopedMatchingTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        face_gallery.clear()
+        self.physics = Course.objects.create(name='Physics', code='PHY101')
+        self.maths = Course.objects.create(name='Maths', code='MAT101')
+        encoding, _, _ = extract_face_encoding(str(SAMPLE_PHOTO))
+        self.student = make_student(1, encoding, self.physics)
+        self.other = make_student(2, np.random.default_rng(0).normal(size=len(encoding)), self.maths)
+
+    def tearDown(self):
+        clear_caches()
+        face_gallery.clear()
+
+    def test_search_covers_only_the_course_partition(self):
+        probe = self.student.get_face_encoding()
+        self.assertEqual(face_gallery.search(probe, top_k=5, course=self.maths.pk)[0][0], self.other.pk)
+        self.assertEqual(len(face_gallery.search(probe, top_k=5)), 2)
+        self.assertEqual(face_gallery.partition_size(self.physics.pk), 1)
+
+        # A course change made without reloading the encoding still moves the student
+        moved = Student.objects.defer('face_encoding').get(pk=self.other.pk)
+        moved.course = self.physics
+        moved.save()
+        self.assertEqual(face_gallery.partition_size(self.physics.pk), 2)
+        self.assertEqual(face_gallery.search(probe, course=self.maths.pk), [])
+
+    def test_mark_attendance_scoped_to_course_with_fallback(self):
+        def mark(**data):
+            upload = SimpleUploadedFile('frame.jpg', SAMPLE_PHOTO.read_bytes(), content_type='image/jpeg')
+            with self.assertLogs('attendance.face_requests', 'INFO') as logs:
+                response = self.client.post('/api/attendance/mark_attendance/', {'image': upload, **data})
+            return response, logs.records[-1].face_request
+
+        response, record = mark(course=self.maths.pk)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual((record['course'], record['candidates']), (self.maths.pk, 1))
+        response = self.client.post('/api/attendance/mark_attendance_batch/', {
+            'images': [SimpleUploadedFile('frame.jpg', SAMPLE_PHOTO.read_bytes())], 'course': self.maths.pk,
+        })
+        self.assertEqual(response.data['results'][0]['result'], 'unmatched')
+
+        response, _ = mark(course=self.maths.pk, fallback='true')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Attendance.objects.filter(student=self.student).exists())
+        self.assertEqual(self.client.post('/api/attendance/mark_attendance/', {
+            'image': SimpleUploadedFile('frame.jpg', SAMPLE_PHOTO.read_bytes()), 'course': 9999,
+        }).status_code, 400)
+
+
+class BatchAttendanceTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        face_gallery.clear()
+        self.photos = [SAMPLE_PHOTO, SAMPLE_PHOTO.with_name('capture_ez9eJJL.jpg')]
+        self.students = []
+        for index, photo in enumerate(self.photos):
+            encoding, _, _ = extract_face_encoding(str(photo))
+            student = make_student(index)
+            student.set_face_encoding(encoding)
+            student.save()
+            self.students.append(student)
+
+    def tearDown(self):
+        face_gallery.clear()
+
+    def post_photos(self):
+        uploads = [SimpleUploadedFile(p.name, p.read_bytes(), content_type='image/jpeg') for p in self.photos]
+        return self.client.post('/api/attendance/mark_attendance_batch/', {'images': uploads})
+
+    def test_marks_every_matched_face_once(self):
+        response = self.post_photos()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['marked'], 2)
+        self.assertEqual(Attendance.objects.count(), 2)
+
+        response = self.post_photos()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual({face['result'] for face in response.data['results']}, {'already_marked'})
+        self.assertEqual(Attendance.objects.count(), 2)
+
+
+class AttendanceWriteTests(TestCase):
+    def setUp(self):
+        self.course = Course.objects.create(name='Physics', code='PHY101')
+        self.student = make_student(1, course=self.course)
+        self.day = date(2024, 9, 2)
+
+    def test_insert_or_ignore_reports_created_rows(self):
+        attendance, created = mark_present(self.student, 0.9, self.day)
+        self.assertTrue(created)
+        self.assertEqual(Attendance.objects.get(pk=attendance.pk).confidence_score, 0.9)
+
+        attendance, created = mark_present(self.student, 0.8, self.day)
+        self.assertFalse(created)
+        self.assertIsNone(attendance)
+        self.assertEqual(Attendance.objects.count(), 1)
+        summary = DailyAttendanceSummary.objects.get(date=self.day, course=self.course)
+        self.assertEqual(summary.present, 1)
+
+    def test_locked_database_is_retried(self):
+        real_insert = marking._insert_ignore_returning
+        calls = []
+
+        def flaky_insert(attendances):
+            calls.append(attendances)
+            if len(calls) == 1:
+                raise OperationalError('database is locked')
+            return real_insert(attendances)
+
+        with self.settings(ATTENDANCE_WRITE_BACKOFF=0), \
+                mock.patch.object(marking, '_insert_ignore_returning', flaky_insert), \
+                self.assertLogs('attendance.marking', 'WARNING'):
+            _, created = mark_present(self.student, 0.9, self.day)
+        self.assertTrue(created)
+        self.assertEqual(len(calls), 2)
+
+
+class SQLiteTuningTests(TestCase):
+    def test_connection_pragmas_are_applied(self):
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], settings.SQLITE_PRAGMAS['busy_timeout'])
+            cursor.execute('PRAGMA synchronous')
+            self.assertEqual(cursor.fetchone()[0], 1)  # NORMAL
+
+    def test_pragmas_outside_the_allowlist_are_rejected(self):
+        self.assertEqual(len(sqlite_pragma_statements(BASELINE_SQLITE_PRAGMAS)), 3)
+        for pragmas in ({'foreign_keys': 'on'}, {'busy_timeout': '1; DROP TABLE attendance_student'},
+                        {'journal_mode': 'wal; DROP TABLE attendance_student'}, {'cache_size': True}):
+            with self.assertRaises(ImproperlyConfigured):
+                sqlite_pragma_statements(pragmas)
+
+
+class AsyncEnrollmentTests(TestCase):
+    def setUp(self):
+        face_gallery.clear()
+        self.student = make_student(1)
+
+    def tearDown(self):
+        face_gallery.clear()
+
+    def upload(self, path):
+        upload = SimpleUploadedFile(path.name, path.read_bytes(), content_type='image/jpeg')
+        return self.client.post('/api/students/upload_photo/',
+                                {'student_id': self.student.student_id, 'photo': upload, 'async': '1'})
+
+    def test_upload_returns_job_and_encodes_in_background(self):
+        with self.settings(MEDIA_ROOT=tempfile.mkdtemp(), ENROLLMENT_JOB_WORKERS=0):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.upload(SAMPLE_PHOTO)
+            self.assertEqual(response.status_code, 202)
+
+            job = self.client.get(response.data['status_url']).data
+            self.assertEqual(job['status'], 'succeeded')
+            self.assertEqual(job['student'], self.student.student_id)
+            self.student.refresh_from_db()
+            self.assertIsNotNone(self.student.get_face_encoding())
+            self.assertEqual(face_gallery.size, 1)
+
+    def test_failed_job_reports_error(self):
+        blank = Path(tempfile.mkdtemp()) / 'blank.jpg'
+        cv2.imwrite(str(blank), np.full((200, 200, 3), 255, dtype=np.uint8))
+        with self.settings(MEDIA_ROOT=tempfile.mkdtemp(), ENROLLMENT_JOB_WORKERS=0):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.upload(blank)
+        job = EnrollmentJob.objects.get(pk=response.data['job_id'])
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(job.error, 'No face detected in the image')
+        self.assertIsNone(Student.objects.get(pk=self.student.pk).face_encoding)
+
+    def test_stale_running_jobs_are_reclaimed(self):
+        stale = EnrollmentJob.objects.create(student=self.student, photo='student_photos/a.jpg', status='running',
+                                             started_at=timezone.now() - timedelta(hours=1))
+        live = EnrollmentJob.objects.create(student=self.student, photo='student_photos/b.jpg', status='running',
+                                            started_at=timezone.now())
+        queued = EnrollmentJob.objects.create(student=self.student, photo='student_photos/c.jpg')
+
+        with self.settings(ENROLLMENT_JOB_TIMEOUT=600):
+            self.assertEqual(jobs.reclaim_jobs(), [stale.pk, queued.pk])
+        self.assertEqual(EnrollmentJob.objects.get(pk=stale.pk).status, 'queued')
+        self.assertEqual(EnrollmentJob.objects.get(pk=live.pk).status, 'running')
+
+    def test_job_keeps_concurrent_student_edits(self):
+        def edit_during_encoding(photo):
+            Student.objects.filter(pk=self.student.pk).update(first_name='Edited')
+            return np.ones(64), 1.0, None
+
+        job = EnrollmentJob.objects.create(student=self.student, photo='student_photos/a.jpg')
+        with self.settings(MEDIA_ROOT=tempfile.mkdtemp()), \
+                mock.patch.object(EnrollmentJob.photo.field.storage, 'open', return_value=io.BytesIO()), \
+                mock.patch('attendance.views.extract_face_encoding', edit_during_encoding):
+            self.assertTrue(jobs.run_job(job.pk))
+
+        student = Student.objects.get(pk=self.student.pk)
+        self.assertEqual(student.first_name, 'Edited')
+        self.assertIsNotNone(student.get_face_encoding())
+        self.assertEqual(student.photo.name, 'student_photos/a.jpg')
+
+    def test_slow_job_requeued_mid_run_drops_its_result(self):
+        def requeue_during_encoding(photo):
+            with self.settings(ENROLLMENT_JOB_TIMEOUT=-1):
+                jobs.requeue_stale_jobs()
+            return np.ones(64), 1.0, None
+
+        job = EnrollmentJob.objects.create(student=self.student, photo='student_photos/a.jpg')
+        with mock.patch.object(EnrollmentJob.photo.field.storage, 'open', return_value=io.BytesIO()), \
+                mock.patch('attendance.views.extract_face_encoding', requeue_during_encoding), \
+                self.assertLogs('attendance.jobs', 'WARNING'):
+            self.assertFalse(jobs.run_job(job.pk))
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.stage, job.finished_at), ('queued', '', None))
+        self.assertIsNone(Student.objects.get(pk=self.student.pk).face_encoding)
+
+    def test_pool_starts_only_in_server_processes(self):
+        with mock.patch.dict('os.environ', {'RUN_MAIN': 'true'}):
+            self.assertTrue(jobs.serves_requests(['manage.py', 'runserver']))
+            self.assertFalse(jobs.serves_requests(['manage.py', 'migrate']))
+        with mock.patch.dict('os.environ', clear=True):
+            # The autoreloader's parent only watches files
+            self.assertFalse(jobs.serves_requests(['manage.py', 'runserver']))
+            self.assertTrue(jobs.serves_requests(['manage.py', 'runserver', '--noreload']))
+        with mock.patch.dict('sys.modules', {'gunicorn': mock.Mock()}):
+            self.assertTrue(jobs.serves_requests(['/usr/bin/gunicorn', 'backend.wsgi']))
+        self.assertFalse(jobs.serves_requests(['script.py']))
+
+
+class RosterImportTests(TestCase):
+    def tearDown(self):
+        face_gallery.clear()
+
+    def test_import_reports_created_and_failed_rows(self):
+        Course.objects.create(name='Physics', code='PHY101')
+        roster = io.StringIO(
+            'student_id,first_name,last_name,email,course,photo\n'
+            f'A1,Ada,Lovelace,ada@example.com,PHY101,{SAMPLE_PHOTO.name}\n'
+            'A2,Alan,Turing,alan@example.com,MISSING,\n'
+            'A3,Grace,Hopper,grace@example.com,,nope.jpg\n'
+        )
+        with self.settings(MEDIA_ROOT=tempfile.mkdtemp()):
+            report = RosterImporter(SAMPLE_PHOTO.parent, n_jobs=1, chunk_size=2).run(roster)
+
+        self.assertEqual(report['processed'], 3)
+        self.assertEqual(report['created'], 2)
+        self.assertEqual(report['encoded'], 1)
+        self.assertEqual([f['student_id'] for f in report['failed']], ['A2', 'A3'])
+        self.assertEqual(face_gallery.size, 1)
+
+    def test_photos_outside_the_photo_directory_are_rejected(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            photo_dir = Path(tmp) / 'photos'
+            photo_dir.mkdir()
+            (photo_dir / 'link.jpg').symlink_to(SAMPLE_PHOTO)
+            roster = io.StringIO(
+                'student_id,first_name,last_name,email,photo\n'
+                f'B1,Ada,Lovelace,ada@example.com,../../{SAMPLE_PHOTO.parent.name}/{SAMPLE_PHOTO.name}\n'
+                f'B2,Alan,Turing,alan@example.com,{SAMPLE_PHOTO}\n'
+                'B3,Grace,Hopper,grace@example.com,link.jpg\n'
+            )
+            with mock.patch('attendance.enrollment.encode_photo') as encode:
+                report = RosterImporter(photo_dir, n_jobs=1).run(roster)
+
+        encode.assert_not_called()
+        self.assertEqual(report['created'], 0)
+        self.assertEqual([f['student_id'] for f in report['failed']], ['B1', 'B2', 'B3'])
+        self.assertIn('outside the photo directory', report['failed'][0]['error'])
+
+
+class ListQueryCountTests(TestCase):
+    """Query counts must not grow with the number of rows on a page"""
+
+    @classmethod
+    def setUpTestData(cls):
+        course = Course.objects.create(name='Physics', code='PHY101')
+        for index in range(8):
+            user = User.objects.create(username=f'user{index}')
+            student = make_student(index, np.ones(16), course)
+            student.user = user
+            student.save()
+            Attendance.objects.create(student=student, date=date(2024, 1, 1 + index))
+
+    def test_student_list(self):
+        with self.assertNumQueries(2):  # count + page
+            response = self.client.get('/api/students/')
+        self.assertEqual(len(response.data['results']), 8)
+
+    def test_student_detail(self):
+        student = Student.objects.first()
+        with self.assertNumQueries(1):
+            self.client.get(f'/api/students/{student.pk}/')
+
+    def test_attendance_list(self):
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/attendance/')
+        self.assertEqual(response.data['results'][0]['student']['user']['username'], 'user7')
+
+    def test_attendance_list_filtered_by_course(self):
+        course = Course.objects.get()
+        with self.assertNumQueries(2):
+            self.client.get('/api/attendance/', {'course': course.pk, 'date': '2024-01-01'})
+
+    def test_attendance_detail(self):
+        attendance = Attendance.objects.first()
+        with self.assertNumQueries(1):
+            self.client.get(f'/api/attendance/{attendance.pk}/')
+
+
+class AttendanceStatsTests(TestCase):
+    def setUp(self):
+        self.physics = Course.objects.create(name='Physics', code='PHY101')
+        self.maths = Course.objects.create(name='Maths', code='MAT101')
+        self.alice = make_student(1, course=self.physics)
+        self.bob = make_student(2, course=self.physics)
+        self.carol = make_student(3, course=self.maths)
+        Attendance.objects.create(student=self.alice, date=date(2024, 3, 1), status='present')
+        Attendance.objects.create(student=self.bob, date=date(2024, 3, 1), status='late')
+        Attendance.objects.create(student=self.alice, date=date(2024, 3, 2), status='present')
+        Attendance.objects.create(student=self.bob, date=date(2024, 3, 2), status='absent')
+        Attendance.objects.create(student=self.carol, date=date(2024, 2, 1), status='present')
+
+    def get_stats(self, **params):
+        params = {'start_date': '2024-03-01', 'end_date': '2024-03-31', **params}
+        return self.client.get('/api/attendance/stats/', params)
+
+    def test_aggregates_range(self):
+        data = self.get_stats().data
+        self.assertEqual(data['totals']['attendance_records'], 4)
+        self.assertEqual(data['status_breakdown'], {'present': 2, 'late': 1, 'absent': 1})
+        self.assertEqual([(row['date'], row['count']) for row in data['daily']],
+                         [(date(2024, 3, 1), 2), (date(2024, 3, 2), 2)])
+        physics = next(row for row in data['courses'] if row['code'] == 'PHY101')
+        self.assertEqual((physics['attended'], physics['rate']), (3, 0.75))
+        rates = {row['student_id']: row['rate'] for row in data['students']}
+        # Maths held no class in March
+        self.assertEqual(rates, {'S0001': 1.0, 'S0002': 0.5, 'S0003': None})
+
+    def test_student_rate_counts_own_course_days(self):
+        Attendance.objects.create(student=self.carol, date=date(2024, 3, 5), status='present')
+        data = self.get_stats().data
+        self.assertEqual(data['totals']['class_days'], 3)
+        students = {row['student_id']: row for row in data['students']}
+        self.assertEqual((students['S0001']['class_days'], students['S0001']['rate']), (2, 1.0))
+        self.assertEqual((students['S0003']['class_days'], students['S0003']['rate']), (1, 1.0))
+
+    def test_course_filter_and_validation(self):
+        data = self.get_stats(course=self.maths.pk).data
+        self.assertEqual(data['totals']['attendance_records'], 0)
+        self.assertEqual([row['student_id'] for row in data['students']], ['S0003'])
+        self.assertEqual(self.get_stats(start_date='2024-04-01').status_code, 400)
+
+
+class AttendanceExportTests(TestCase):
+    def setUp(self):
+        self.course = Course.objects.create(name='Physics', code='PHY101')
+        self.students = [make_student(i, course=self.course) for i in range(5)]
+        for day in range(1, 4):
+            for student in self.students:
+                Attendance.objects.create(student=student, date=date(2024, 9, day), confidence_score=0.9)
+
+    def test_streams_filtered_csv_and_ndjson(self):
+        response = self.client.get('/api/attendance/export/', {'start_date': '2024-09-02', 'course': self.course.pk})
+        self.assertEqual(response.status_code, 200)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['id', 'date', 'time_in'])
+        self.assertEqual(len(lines), 1 + 10)
+
+        response = self.client.get('/api/attendance/export/', {'output': 'ndjson', 'date': '2024-09-01'})
+        records = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual({record['student_id'] for record in records}, {s.student_id for s in self.students})
+        self.assertEqual(records[0]['course'], 'PHY101')
+
+        self.assertEqual(self.client.get('/api/attendance/export/', {'output': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get('/api/attendance/export/', {'end_date': 'soon'}).status_code, 400)
+
+    def test_cursor_pages_are_stable_under_inserts(self):
+        seen = []
+        url, params = '/api/attendance/', {'pagination': 'cursor', 'page_size': 4}
+        while url:
+            data = self.client.get(url, params).json()
+            seen += [row['id'] for row in data['results']]
+            if len(seen) == 4:
+                # A kiosk marks someone new while the report is paging
+                Attendance.objects.create(student=make_student(9, course=self.course), date=date(2024, 9, 3))
+            url, params = data['next'], None
+        expected = list(Attendance.objects.filter(date__lte=date(2024, 9, 3)).order_by('-date', '-time_in', '-id')
+                        .values_list('id', flat=True))
+        self.assertEqual(len(seen), len(set(seen)))
+        self.assertEqual(len(seen), 15)
+        self.assertEqual(seen, [pk for pk in expected if pk in seen])
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN output is SQLite specific')
+class QueryPlanTests(TestCase):
+    """Each endpoint's SQL must reach its rows through an index, not a full table scan"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.course = Course.objects.create(name='Physics', code='PHY101')
+        cls.students = [make_student(i, course=cls.course) for i in range(4)]
+        for day in range(1, 4):
+            for student in cls.students:
+                Attendance.objects.create(student=student, date=date(2024, 9, day), status='present')
+
+    def plans(self, queries):
+        """(sql, plan lines) for every SELECT in ``queries``"""
+        plans = []
+        with connection.cursor() as cursor:
+            for query in queries:
+                sql = query['sql']
+                if not sql.startswith('SELECT'):
+                    continue
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                plans.append((sql, [row[-1] for row in cursor.fetchall()]))
+        return plans
+
+    def get_plans(self, path, params=None):
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(path, params)
+            self.assertEqual(response.status_code, 200)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return self.plans(ctx.captured_queries)
+
+    def assertNoFullScans(self, plans, scannable=()):
+        """
+        Fail on a SCAN that reads a whole table. Tables in ``scannable`` may be
+        walked through an index (unfiltered, ordered or counted queries).
+        """
+        for sql, lines in plans:
+            for line in lines:
+                if not line.startswith('SCAN '):
+                    continue
+                table = line.split()[1]
+                if 'INDEX' not in line or table not in scannable:
+                    self.fail(f'{line}\n  in {sql}')
+
+    def test_filtered_endpoints_search_indexes(self):
+        page = self.client.get('/api/attendance/', {'pagination': 'cursor', 'page_size': 2}).json()
+        for path, params in [
+            ('/api/attendance/', {'date': '2024-09-02'}),
+            ('/api/attendance/', {'student': self.students[0].pk}),
+            ('/api/attendance/', {'course': self.course.pk}),
+            ('/api/attendance/', {'course': self.course.pk, 'date': '2024-09-02'}),
+            (page['next'], None),
+            ('/api/attendance/export/', {'start_date': '2024-09-02', 'end_date': '2024-09-03'}),
+            ('/api/attendance/stats/', {'course': self.course.pk}),
+            ('/api/students/', {'course': self.course.pk}),
+        ]:
+            with self.subTest(path=path, params=params):
+                self.assertNoFullScans(self.get_plans(path, params))
+
+    def test_unfiltered_lists_walk_an_index_in_order(self):
+        for path in ['/api/attendance/', '/api/attendance/export/']:
+            plans = self.get_plans(path)
+            self.assertNoFullScans(plans, scannable=('attendance_attendance',))
+            self.assertFalse(any('TEMP B-TREE FOR ORDER BY' in line for _, lines in plans for line in lines), plans)
+        self.assertNoFullScans(self.get_plans('/api/attendance/stats/'),
+                               scannable=('attendance_course', 'attendance_student'))
+
+    def test_marking_lookups_search_indexes(self):
+        with CaptureQueriesContext(connection) as ctx:
+            Student.objects.filter(student_id='S0002').values_list('pk', flat=True).first()
+            Attendance.objects.filter(date=date(2024, 9, 2), status='late').count()
+            Attendance.objects.filter(student__course=self.course, date=date(2024, 9, 2)).exists()
+        self.assertNoFullScans(self.plans(ctx.captured_queries))
+
+
+class DailyAttendanceSummaryTests(TestCase):
+    def setUp(self):
+        self.course = Course.objects.create(name='Physics', code='PHY101')
+        self.student = make_student(1, course=self.course)
+
+    def counts(self, day):
+        summary = DailyAttendanceSummary.objects.get(date=day, course=self.course)
+        return summary.present, summary.late, summary.absent
+
+    def test_single_row_writes_update_rollup(self):
+        day = date(2024, 3, 1)
+        attendance = Attendance.objects.create(student=self.student, date=day)
+        self.assertEqual(self.counts(day), (1, 0, 0))
+
+        attendance.status = 'late'
+        attendance.save()
+        self.assertEqual(self.counts(day), (0, 1, 0))
+
+        attendance.delete()
+        self.assertEqual(self.counts(day), (0, 0, 0))
+
+    def test_rebuild_matches_incremental_counts(self):
+        for offset, status_name in enumerate(['present', 'late', 'absent']):
+            Attendance.objects.create(student=make_student(10 + offset, course=self.course),
+                                      date=date(2024, 3, 1), status=status_name)
+        incremental = self.counts(date(2024, 3, 1))
+        DailyAttendanceSummary.objects.all().delete()
+        self.assertEqual(rebuild_summaries(date(2024, 3, 1), date(2024, 3, 1)), 1)
+        self.assertEqual(self.counts(date(2024, 3, 1)), incremental)
+
+    def snapshot(self):
+        return sorted(DailyAttendanceSummary.objects.values_list('date', 'course', 'present', 'late', 'absent'))
+
+    def test_no_course_bucket_has_one_row_per_day(self):
+        day = date(2024, 3, 1)
+        for index in range(3):
+            Attendance.objects.create(student=make_student(20 + index), date=day)
+        self.assertEqual(list(DailyAttendanceSummary.objects.filter(course=None).values_list('present', flat=True)), [3])
+        incremental = self.snapshot()
+        rebuild_summaries(day, day)
+        self.assertEqual(self.snapshot(), incremental)
+
+    def test_course_change_moves_counts_before_delete(self):
+        day = date(2024, 3, 1)
+        attendance = Attendance.objects.create(student=self.student, date=day)
+        maths = Course.objects.create(name='Maths', code='MAT101')
+        self.student.course = maths
+        self.student.save()
+        self.assertEqual(self.counts(day), (0, 0, 0))
+        self.assertEqual(DailyAttendanceSummary.objects.get(date=day, course=maths).present, 1)
+
+        attendance.delete()
+        self.assertEqual(DailyAttendanceSummary.objects.get(date=day, course=maths).present, 0)
+
+    def test_deleted_course_merges_into_no_course_bucket(self):
+        day = date(2024, 3, 1)
+        Attendance.objects.create(student=make_student(30), date=day)
+        Attendance.objects.create(student=self.student, date=day, status='late')
+        self.course.delete()
+        self.assertEqual(self.snapshot(), [(day, None, 1, 1, 0)])
+        rebuild_summaries(day, day)
+        self.assertEqual(self.snapshot(), [(day, None, 1, 1, 0)])
+
+    def test_decrements_are_clamped_at_zero(self):
+        day = date(2024, 3, 1)
+        attendance = Attendance.objects.create(student=self.student, date=day)
+        # A queryset update sends no signals, so the rollup still has the old course
+        maths = Course.objects.create(name='Maths', code='MAT101')
+        Student.objects.filter(pk=self.student.pk).update(course=maths)
+        Attendance.objects.get(pk=attendance.pk).delete()
+        self.assertEqual(DailyAttendanceSummary.objects.get(date=day, course=maths).present, 0)
+        rebuild_summaries(day, day)
+        self.assertEqual(self.snapshot(), [])
+
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        clear_caches()
+        registry.reset()
+
+    def test_face_requests_feed_metrics_endpoint(self):
+        upload = SimpleUploadedFile('frame.jpg', SAMPLE_PHOTO.read_bytes(), content_type='image/jpeg')
+        with self.settings(FACE_SERVER_TIMING=True):
+            response = self.client.post('/api/attendance/check_face/', {'image': upload})
+        self.assertIn('detect;dur=', response['Server-Timing'])
 
-# Create your tests here.
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn('face_pipeline_latency_ms_count{endpoint="check_face",stage="detect"} 1', body)
+        self.assertIn('face_pipeline_requests_total{endpoint="check_face",status="200"} 1', body)
+        self.assertIn('face_gallery_size', body)
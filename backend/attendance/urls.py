@@ -6,6 +6,7 @@ router = DefaultRouter()
 router.register(r'courses', views.CourseViewSet)
 router.register(r'students', views.StudentViewSet)
 router.register(r'attendance', views.AttendanceViewSet)
+router.register(r'enrollment-jobs', views.EnrollmentJobViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
@@ -1,27 +1,70 @@
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import render
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
+from rest_framework.reverse import reverse
 from django.utils import timezone
-from django.db.models import Q
-from .models import Course, Student, Attendance
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+from django.utils.dateparse import parse_date
+from django.core.serializers.json import DjangoJSONEncoder
+from datetime import timedelta
+from .models import Course, Student, Attendance, DailyAttendanceSummary, EnrollmentJob
+from .gallery import face_gallery
+from .encodings import upgrade_face_encoding
+from .descriptors import FACE_SIZE, get_descriptor, match_threshold
+from .detectors import detector_pool
+from .enrollment import RosterImporter
+from .jobs import submit as submit_enrollment_job
+from .marking import insert_attendance, mark_present
+from .facelog import current_request_log, face_request_logged
+from .caches import frame_cache, frame_digest, marked_today, match_cache
+from .metrics import metrics_enabled, registry
+from .pagination import KeysetPagination
 from .serializers import (
     CourseSerializer, StudentSerializer, 
-    AttendanceSerializer, FaceRecognitionSerializer
+    AttendanceSerializer, FaceRecognitionSerializer,
+    BatchFaceRecognitionSerializer, EnrollmentJobSerializer
 )
 import numpy as np
 from PIL import Image
+import csv
 import io
+import json
+import math
+from pathlib import Path
+import tempfile
+import zipfile
 import cv2
 import logging
 from django.views.decorators.csrf import csrf_exempt
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+# Logging is configured in settings.LOGGING (see FACE_LOG_MODE)
 logger = logging.getLogger(__name__)
 
-# Initialize OpenCV face detector
-face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+# Minimum detection confidence for a photo to be enrolled
+MIN_ENROLLMENT_CONFIDENCE = 0.3
+# Statuses that count towards a student's attendance rate
+ATTENDED_STATUSES = ('present', 'late')
+
+# Longest side of the frame the detection fast path runs on
+DETECTION_MAX_SIDE = 640
+# Longest side of the frame the encoding paths detect on; faces are cropped
+# from a higher-resolution decode when they are too small at this size
+ENCODING_MAX_SIDE = 1280
+# Image headers (EXIF included) are parsed from this many leading bytes
+HEADER_PEEK_BYTES = 128 * 1024
+# EXIF orientation tag, and the orientations whose rotation swaps width and height
+EXIF_ORIENTATION = 0x0112
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+REDUCED_GRAYSCALE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_GRAYSCALE_8),
+    (4, cv2.IMREAD_REDUCED_GRAYSCALE_4),
+    (2, cv2.IMREAD_REDUCED_GRAYSCALE_2),
+)
 
 def preprocess_image(image):
     """Preprocess image for face detection"""
@@ -36,102 +79,337 @@ def preprocess_image(image):
     gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
     return image_rgb, gray
 
-def extract_face_encoding(image, min_face_size=(30, 30)):
+def read_image_buffer(image):
+    """
+    Image bytes for decoding: a path, raw bytes or an uploaded file.
+
+    In-memory uploads are returned as a view of their buffer instead of a
+    ``read()`` copy; uploads spooled to disk are read straight from the file.
+    """
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return image
+    if isinstance(image, (str, Path)):
+        return np.fromfile(image, dtype=np.uint8)
+    if hasattr(image, 'temporary_file_path'):
+        return np.fromfile(image.temporary_file_path(), dtype=np.uint8)
+    buffer = getattr(getattr(image, 'file', image), 'getbuffer', None)
+    if buffer is not None:
+        return buffer()
+    image.seek(0)
+    return image.read()
+
+def decode_grayscale(data, max_side=DETECTION_MAX_SIDE):
+    """
+    Decode image bytes straight to grayscale, no larger than ``max_side``.
+
+    Picks libjpeg's reduced-size decode (1/2, 1/4, 1/8) from the header
+    dimensions so big frames are never materialized at full resolution.
+    Returns the gray image and the factor mapping its coordinates back to
+    the source image, upright as imdecode rotates it by its EXIF orientation.
+    """
+    flag = cv2.IMREAD_GRAYSCALE
+    try:
+        with Image.open(io.BytesIO(memoryview(data)[:HEADER_PEEK_BYTES])) as header:
+            width, height = header.size
+            try:
+                orientation = header.getexif().get(EXIF_ORIENTATION)
+            except Exception:
+                orientation = None
+    except Exception:
+        width = height = None
+    else:
+        # header.size is the stored size; portrait phone photos are stored sideways
+        if orientation in TRANSPOSED_ORIENTATIONS:
+            width, height = height, width
+
+    if width and height:
+        longest = max(width, height)
+        for factor, reduced_flag in REDUCED_GRAYSCALE_FLAGS:
+            if longest / factor >= max_side:
+                flag = reduced_flag
+                break
+
+    gray = cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+    if gray is None:
+        raise ValueError("Could not decode image")
+    scale = (width / gray.shape[1]) if width else 1.0
+
+    longest = max(gray.shape[:2])
+    if longest > max_side:
+        ratio = max_side / longest
+        gray = cv2.resize(gray, (round(gray.shape[1] * ratio), round(gray.shape[0] * ratio)),
+                          interpolation=cv2.INTER_AREA)
+        scale /= ratio
+    return gray, scale
+
+def detect_face(image, min_face_size=(30, 30), max_side=DETECTION_MAX_SIDE):
+    """
+    Detection-only fast path for the polling endpoints.
+
+    Runs the cascade on a downscaled grayscale decode and skips the encoding
+    stage entirely. Returns (confidence, (x, y, w, h)) in source-image
+    coordinates, or (None, None) when no face is found. Results are cached
+    by frame content for a few seconds (see caches.py).
+    """
+    request_log = current_request_log()
+    data = read_image_buffer(image)
+    key = (frame_digest(data), tuple(min_face_size), max_side)
+    cached = frame_cache.get(key)
+    if cached is not None:
+        request_log.set(cache='hit')
+        return cached
+
+    with request_log.stage('decode'):
+        gray, scale = decode_grayscale(data, max_side)
+
+    min_size = (max(1, int(min_face_size[0] / scale)), max(1, int(min_face_size[1] / scale)))
+    with request_log.stage('detect'):
+        faces = detect_faces(gray, min_size)
+    if len(faces) == 0:
+        result = (None, None)
+    else:
+        x, y, w, h = max(faces, key=lambda face: face[2] * face[3])
+        # Area ratio is scale-invariant, so this matches extract_face_encoding's confidence
+        confidence = min(1.0, (w * h) / (gray.shape[0] * gray.shape[1]) * 10)
+        x, y, w, h = (int(round(v * scale)) for v in (x, y, w, h))
+        result = (float(confidence), (x, y, w, h))
+    frame_cache.set(key, result)
+    return result
+
+def detect_faces(gray, min_face_size=(30, 30)):
+    """Run the Haar cascade and return every (x, y, w, h) box found"""
+    # Pooled per-thread classifiers with a concurrency limit (see detectors.py)
+    return detector_pool.detect(gray, min_face_size)
+
+def crop_face_patch(image, face):
+    """Crop one detected face (from an RGB or grayscale image) into an equalized 128x128 grayscale patch plus its confidence"""
+    x, y, w, h = face
+    
+    # Extract face region with padding
+    padding = int(0.1 * w)  # 10% padding
+    x1 = max(0, x - padding)
+    y1 = max(0, y - padding)
+    x2 = min(image.shape[1], x + w + padding)
+    y2 = min(image.shape[0], y + h + padding)
+    
+    face_gray = normalize_face_patch(image[y1:y2, x1:x2])
+    
+    # Calculate confidence based on face size and position
+    confidence = min(1.0, (w * h) / (image.shape[0] * image.shape[1]) * 10)
+    return face_gray, confidence
+
+def normalize_face_patch(face_region):
+    """Turn a padded face region (RGB or grayscale) into the equalized 128x128 patch the descriptors expect"""
+    # Resize to a standard size
+    if face_region.shape[:2] != (FACE_SIZE, FACE_SIZE):
+        face_region = cv2.resize(face_region, (FACE_SIZE, FACE_SIZE))
+    
+    # Convert to grayscale
+    face_gray = cv2.cvtColor(face_region, cv2.COLOR_RGB2GRAY) if face_region.ndim == 3 else face_region
+    
+    # Apply histogram equalization for better contrast
+    face_gray = cv2.equalizeHist(face_gray)
+    
+    # Apply Gaussian blur to reduce noise
+    return cv2.GaussianBlur(face_gray, (5, 5), 0)
+
+class DecodedImage:
+    """
+    Bounded grayscale decode for the encoding paths.
+
+    Detection runs on ``gray`` (at most ENCODING_MAX_SIDE on its longest
+    side). A face that is smaller than the patch size at that resolution is
+    cropped from a second decode that is only as large as that face needs,
+    so a full-size color image is never materialized.
+    """
+
+    def __init__(self, image, max_side=ENCODING_MAX_SIDE):
+        self.data = read_image_buffer(image)
+        self.gray, self.scale = decode_grayscale(self.data, max_side)
+
+    def detect(self, min_face_size=(30, 30)):
+        """Face boxes in ``gray`` coordinates"""
+        min_size = (max(1, int(min_face_size[0] / self.scale)), max(1, int(min_face_size[1] / self.scale)))
+        return detect_faces(self.gray, min_size)
+
+    def crop(self, face):
+        """Patch and confidence for a box from ``detect``"""
+        x, y, w, h = face
+        padded = w * 1.2
+        if padded >= FACE_SIZE or self.scale <= 1:
+            return crop_face_patch(self.gray, face)
+
+        # Decode just enough resolution for a FACE_SIZE crop of this face
+        longest = max(self.gray.shape)
+        needed = min(longest * self.scale, longest * FACE_SIZE / padded)
+        detail, detail_scale = decode_grayscale(self.data, int(math.ceil(needed)))
+        ratio = self.scale / detail_scale
+        # Confidence is an area ratio, so it comes out the same at either resolution
+        return crop_face_patch(detail, tuple(int(round(v * ratio)) for v in face))
+
+    def to_source(self, face):
+        """Map a box from ``gray`` coordinates to the uploaded image"""
+        return tuple(int(round(v * self.scale)) for v in face)
+
+def extract_face_patch(image, min_face_size=(30, 30)):
+    """Detect the largest face and return it as an equalized 128x128 grayscale patch"""
+    request_log = current_request_log()
+    with request_log.stage('decode'):
+        decoded = DecodedImage(image)
+    with request_log.stage('detect'):
+        faces = decoded.detect(min_face_size)
+    
+    if len(faces) == 0:
+        logger.warning("No faces detected in image")
+        return None, None, None
+    
+    # Get the largest face (assuming it's the main subject)
+    face_sizes = [w * h for (x, y, w, h) in faces]
+    largest_face_idx = np.argmax(face_sizes)
+    face = faces[largest_face_idx]
+    with request_log.stage('crop'):
+        face_gray, confidence = decoded.crop(face)
+    
+    logger.debug("Detected %d faces.", len(faces))
+    return face_gray, confidence, decoded.to_source(face)
+
+def extract_all_face_encodings(image, min_face_size=(30, 30), descriptor=None):
+    """Encode every face in the image; returns a list of (encoding, confidence, (x, y, w, h))"""
+    request_log = current_request_log()
+    with request_log.stage('decode'):
+        decoded = DecodedImage(image)
+    with request_log.stage('detect'):
+        faces = decoded.detect(min_face_size)
+    descriptor = descriptor or get_descriptor()
+    
+    results = []
+    for face in faces:
+        with request_log.stage('crop'):
+            face_gray, confidence = decoded.crop(face)
+        with request_log.stage('encode'):
+            encoding = descriptor.compute(face_gray)
+        results.append((encoding, confidence, decoded.to_source(face)))
+    
+    logger.debug("Encoded %d faces with %s.", len(results), descriptor.version)
+    return results
+
+def extract_face_encoding(image, min_face_size=(30, 30), descriptor=None):
     """Extract face encoding with improved face detection"""
     try:
-        image_rgb, gray = preprocess_image(image)
-        
-        # Detect faces with improved parameters
-        faces = face_cascade.detectMultiScale(
-            gray,
-            scaleFactor=1.1,
-            minNeighbors=5,
-            minSize=min_face_size,
-            flags=cv2.CASCADE_SCALE_IMAGE
-        )
-        
-        if len(faces) == 0:
-            logger.warning("No faces detected in image")
+        face_gray, confidence, face_position = extract_face_patch(image, min_face_size)
+        if face_gray is None:
             return None, None, None
         
-        # Get the largest face (assuming it's the main subject)
-        face_sizes = [w * h for (x, y, w, h) in faces]
-        largest_face_idx = np.argmax(face_sizes)
-        x, y, w, h = faces[largest_face_idx]
-        
-        # Extract face region with padding
-        padding = int(0.1 * w)  # 10% padding
-        x1 = max(0, x - padding)
-        y1 = max(0, y - padding)
-        x2 = min(image_rgb.shape[1], x + w + padding)
-        y2 = min(image_rgb.shape[0], y + h + padding)
-        
-        face_region = image_rgb[y1:y2, x1:x2]
-        
-        # Resize to a standard size
-        face_region = cv2.resize(face_region, (128, 128))
-        
-        # Convert to grayscale
-        face_gray = cv2.cvtColor(face_region, cv2.COLOR_RGB2GRAY)
-        
-        # Apply histogram equalization for better contrast
-        face_gray = cv2.equalizeHist(face_gray)
+        # Turn the patch into a compact descriptor vector (HOG by default)
+        descriptor = descriptor or get_descriptor()
+        with current_request_log().stage('encode'):
+            face_encoding = descriptor.compute(face_gray)
         
-        # Apply Gaussian blur to reduce noise
-        face_gray = cv2.GaussianBlur(face_gray, (5, 5), 0)
+        # Only formatted when DEBUG is on (FACE_LOG_MODE = 'verbose')
+        logger.debug("Extracted %s face encoding snippet: %s...", descriptor.version, face_encoding[:10])
         
-        # Normalize
-        face_normalized = face_gray / 255.0
-        
-        # Calculate confidence based on face size and position
-        confidence = min(1.0, (w * h) / (image_rgb.shape[0] * image_rgb.shape[1]) * 10)
-        
-        # Create face encoding using HOG features
-        face_encoding = face_normalized.flatten()
-        
-        logger.info(f"Detected {len(faces)} faces.")
-        # Log a snippet of the face encoding
-        if face_encoding is not None:
-            logger.info(f"Extracted face encoding snippet: {face_encoding[:10]}...")
-        
-        return face_encoding, confidence, (x, y, w, h)
+        return face_encoding, confidence, face_position
         
     except Exception as e:
         logger.error(f"Error in face encoding: {str(e)}")
         return None, None, None
 
-def compare_faces(face1, face2, threshold=0.7):
-    """Compare faces with improved similarity calculation"""
-    try:
-        # Log snippets of the input face encodings
-        logger.info(f"Comparing face encodings - Face1 snippet: {face1[:10]}..., Face2 snippet: {face2[:10]}...")
+def encode_probe(probe, descriptor=None):
+    """extract_face_encoding for a client-cropped face (see probes.py): no decode or detection"""
+    with current_request_log().stage('crop'):
+        face_gray = normalize_face_patch(probe.region)
+    descriptor = descriptor or get_descriptor()
+    with current_request_log().stage('encode'):
+        face_encoding = descriptor.compute(face_gray)
+    return face_encoding, probe.confidence, probe.box
 
-        # Normalize the face encodings
-        face1_norm = face1 / np.linalg.norm(face1)
-        face2_norm = face2 / np.linalg.norm(face2)
+def match_scope(validated_data):
+    """(course pk or None, fallback) for a face matching request"""
+    course = validated_data.get('course')
+    fallback = validated_data.get('fallback')
+    if fallback is None:
+        fallback = getattr(settings, 'FACE_COURSE_FALLBACK', False)
+    return (course.pk if course else None), fallback
 
-        # Log normalized vector snippets
-        logger.info(f"Normalized Face1 snippet: {face1_norm[:10]}..., Normalized Face2 snippet: {face2_norm[:10]}...")
-        
-        # Calculate cosine similarity
-        similarity = np.dot(face1_norm, face2_norm)
 
-        # Log similarity
-        logger.info(f"Cosine similarity: {similarity}")
-        
-        # Calculate Euclidean distance
-        distance = np.linalg.norm(face1 - face2)
+def search_scoped(encodings, course=None, fallback=False):
+    """
+    Best gallery match per encoding, searching only ``course``'s partition when
+    given. With ``fallback``, encodings with no match above the match threshold
+    in the course are searched again across the whole gallery.
+    """
+    matches = face_gallery.search_batch(encodings, top_k=1, course=course)
+    if course is not None and fallback:
+        threshold = match_threshold()
+        retry = [i for i, found in enumerate(matches) if not (found and found[0][1] > threshold)]
+        if retry:
+            for i, found in zip(retry, face_gallery.search_batch([encodings[i] for i in retry], top_k=1)):
+                matches[i] = found
+    return matches
 
-        # Log distance
-        logger.info(f"Euclidean distance: {distance}")
-        
-        # Use only cosine similarity for match
+
+def compare_faces(face1, face2, threshold=None):
+    """Compare two face encodings by cosine similarity (threshold defaults to the current descriptor's)"""
+    if threshold is None:
+        threshold = match_threshold()
+    try:
+        norm1 = np.linalg.norm(face1)
+        norm2 = np.linalg.norm(face2)
+        similarity = float(np.dot(face1, face2) / (norm1 * norm2))
+        logger.debug("Cosine similarity: %s", similarity)
         return similarity > threshold, similarity
         
     except Exception as e:
         logger.error(f"Error in face comparison: {str(e)}", exc_info=True)
         return False, 0.0
 
+# (values_list field, exported column) for the attendance export
+EXPORT_COLUMNS = (
+    ('id', 'id'),
+    ('date', 'date'),
+    ('time_in', 'time_in'),
+    ('status', 'status'),
+    ('confidence_score', 'confidence_score'),
+    ('student__student_id', 'student_id'),
+    ('student__first_name', 'first_name'),
+    ('student__last_name', 'last_name'),
+    ('student__course__code', 'course'),
+)
+EXPORT_CHUNK_SIZE = 2000
+
+class _Echo:
+    """File-like object whose write() hands the line back to the generator"""
+    def write(self, value):
+        return value
+
+def render_csv(rows):
+    writer = csv.writer(_Echo())
+    yield writer.writerow([column for _, column in EXPORT_COLUMNS])
+    lines = []
+    for row in rows:
+        lines.append(writer.writerow([value.isoformat() if hasattr(value, 'isoformat') else value for value in row]))
+        if len(lines) >= EXPORT_CHUNK_SIZE:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+def render_ndjson(rows):
+    columns = [column for _, column in EXPORT_COLUMNS]
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder) + '\n')
+        if len(lines) >= EXPORT_CHUNK_SIZE:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', render_csv),
+    'ndjson': ('application/x-ndjson', render_ndjson),
+}
+
 class CourseViewSet(viewsets.ModelViewSet):
     queryset = Course.objects.all()
     serializer_class = CourseSerializer
@@ -146,6 +424,7 @@ class CourseViewSet(viewsets.ModelViewSet):
         return [permission() for permission in self.permission_classes]
 
     @action(detail=False, methods=['post'], authentication_classes=[], permission_classes=[])
+    @face_request_logged('check_face')
     def check_face(self, request):
         """Endpoint for real-time face detection"""
         serializer = FaceRecognitionSerializer(data=request.data)
@@ -155,16 +434,14 @@ class CourseViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        image = serializer.validated_data['image']
+        probe = serializer.validated_data.get('probe')
         try:
-            # Extract face encoding
-            face_encoding, confidence, face_position = extract_face_encoding(image)
-            
-            if face_encoding is None:
-                return Response({
-                    'face_detected': False,
-                    'message': 'No face detected'
-                })
+            if probe is not None:
+                # The client found the face itself; the payload was validated by the serializer
+                confidence, face_position = probe.confidence, probe.box
+            else:
+                # Detection only: the polling clients just need the bounding box
+                confidence, face_position = detect_face(serializer.validated_data['image'])
             
             if face_position:
                 x, y, w, h = face_position
@@ -222,19 +499,61 @@ class StudentViewSet(viewsets.ModelViewSet):
             )
 
     def get_queryset(self):
-        queryset = Student.objects.all()
+        # The serializer never outputs the encoding blob, so don't fetch it
+        queryset = Student.objects.select_related('user').defer('face_encoding')
         course = self.request.query_params.get('course', None)
         if course:
             queryset = queryset.filter(course_id=course)
         return queryset
 
     @action(detail=False, methods=['post'])
+    def bulk_import(self, request):
+        """Bulk-enroll students from a roster CSV plus an optional zip of their photos"""
+        if 'roster' not in request.FILES:
+            return Response(
+                {'error': 'No roster CSV provided'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            with tempfile.TemporaryDirectory() as photo_dir:
+                if 'photos' in request.FILES:
+                    try:
+                        with zipfile.ZipFile(request.FILES['photos']) as archive:
+                            archive.extractall(photo_dir)
+                    except zipfile.BadZipFile:
+                        return Response(
+                            {'error': 'Photos must be uploaded as a zip archive'},
+                            status=status.HTTP_400_BAD_REQUEST
+                        )
+
+                importer = RosterImporter(
+                    photo_dir,
+                    n_jobs=getattr(settings, 'ENROLLMENT_IMPORT_JOBS', -1),
+                    update_existing=request.data.get('update') in ('1', 'true', 'True'),
+                )
+                roster = io.TextIOWrapper(request.FILES['roster'].file, encoding='utf-8-sig', newline='')
+                report = importer.run(roster)
+
+            logger.info(f"Bulk import finished: {report['created']} created, {len(report['failed'])} failed")
+            return Response(report, status=status.HTTP_200_OK)
+
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except Exception as e:
+            logger.error(f"Error in bulk import: {str(e)}", exc_info=True)
+            return Response(
+                {'error': 'Internal server error', 'details': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+    @action(detail=False, methods=['post'])
+    @face_request_logged('upload_photo')
     def upload_photo(self, request):
-        logger.info("upload_photo endpoint called.")
         student_id = request.data.get('student_id')
+        current_request_log().set(student=student_id)
         try:
             student = Student.objects.get(student_id=student_id)
-            logger.info(f"Student {student_id} found for photo upload.")
         except Student.DoesNotExist:
             logger.error(f"Student {student_id} not found for photo upload.")
             return Response(
@@ -250,11 +569,28 @@ class StudentViewSet(viewsets.ModelViewSet):
             )
 
         photo = request.FILES['photo']
+
+        run_async = request.data.get('async', getattr(settings, 'ENROLLMENT_ASYNC', False))
+        if run_async in (True, '1', 'true', 'True'):
+            # Store the photo now and encode it in the background
+            with transaction.atomic():
+                job = EnrollmentJob.objects.create(student=student, photo=photo)
+                submit_enrollment_job(job)
+            current_request_log().set(job=str(job.pk))
+            return Response(
+                {
+                    'message': 'Photo queued for face encoding',
+                    'job_id': job.pk,
+                    'status': job.status,
+                    'status_url': reverse('enrollmentjob-detail', args=[job.pk], request=request)
+                },
+                status=status.HTTP_202_ACCEPTED
+            )
+
         student.photo = photo
         
         # Process face encoding
         try:
-            logger.info("Attempting to extract face encoding in upload_photo.")
             face_encoding, confidence, _ = extract_face_encoding(photo)
             
             if face_encoding is None:
@@ -264,23 +600,18 @@ class StudentViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            logger.info(f"Face encoding extracted successfully with confidence: {confidence}")
-            logger.info(f"Extracted face encoding snippet during upload: {face_encoding[:10]}...")
+            current_request_log().set(detection_confidence=confidence)
 
-            if confidence < 0.3:  # Minimum confidence threshold
+            if confidence < MIN_ENROLLMENT_CONFIDENCE:
                 logger.warning(f"Face detection confidence {confidence} too low during upload.")
                 return Response(
                     {'error': 'Face detection confidence too low'}, 
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            student.face_encoding = face_encoding.tobytes()
-            logger.info("Face encoding assigned to student object.")
-            student.save()
-            logger.info(f"Student {student_id} saved with face encoding.")
-
-            # Log before returning success response
-            logger.info("upload_photo function returning success response.")
+            student.set_face_encoding(face_encoding)
+            with current_request_log().stage('db_write'):
+                student.save()
 
             return Response(
                 {
@@ -296,6 +627,19 @@ class StudentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+class EnrollmentJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """Status of background upload_photo jobs"""
+    queryset = EnrollmentJob.objects.select_related('student')
+    serializer_class = EnrollmentJobSerializer
+    permission_classes = [permissions.AllowAny]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        student = self.request.query_params.get('student', None)
+        if student:
+            queryset = queryset.filter(student__student_id=student)
+        return queryset
+
 class AttendanceViewSet(viewsets.ModelViewSet):
     queryset = Attendance.objects.all()
     serializer_class = AttendanceSerializer
@@ -309,8 +653,24 @@ class AttendanceViewSet(viewsets.ModelViewSet):
             return []
         return [permission() for permission in self.permission_classes]
 
+    @property
+    def paginator(self):
+        # Opt-in keyset pagination: stable and constant-cost however deep the page
+        if not hasattr(self, '_paginator') and self.action == 'list' and (
+            self.request.query_params.get('pagination') == 'cursor' or 'cursor' in self.request.query_params
+        ):
+            self._paginator = KeysetPagination()
+        return super().paginator
+
     def get_queryset(self):
-        queryset = Attendance.objects.all()
+        # AttendanceSerializer nests the student and its user; load them in the same query
+        queryset = Attendance.objects.select_related(
+            'student__user', 'student__course'
+        ).defer('student__face_encoding')
+        return self.apply_filters(queryset)
+
+    def apply_filters(self, queryset):
+        """The student/date/course filters plus an optional start_date..end_date range"""
         student = self.request.query_params.get('student', None)
         date = self.request.query_params.get('date', None)
         course = self.request.query_params.get('course', None)
@@ -322,9 +682,153 @@ class AttendanceViewSet(viewsets.ModelViewSet):
         if course:
             queryset = queryset.filter(student__course_id=course)
 
+        for param, lookup in (('start_date', 'date__gte'), ('end_date', 'date__lte')):
+            value = self.request.query_params.get(param, None)
+            if not value:
+                continue
+            try:
+                day = parse_date(value)
+            except ValueError:
+                day = None
+            if day is None:
+                raise ValidationError({param: 'Must be a valid YYYY-MM-DD date'})
+            queryset = queryset.filter(**{lookup: day})
+
         return queryset
 
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream every matching record as CSV (default) or NDJSON (?output=ndjson)"""
+        output = request.query_params.get('output', 'csv')
+        if output not in EXPORT_FORMATS:
+            return Response(
+                {'error': f"output must be one of: {', '.join(EXPORT_FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Flat tuples from a chunked cursor: memory stays flat however many rows match
+        rows = (
+            self.apply_filters(Attendance.objects.all())
+            .order_by('date', 'time_in', 'id')
+            .values_list(*(field for field, _ in EXPORT_COLUMNS))
+            .iterator(chunk_size=EXPORT_CHUNK_SIZE)
+        )
+        content_type, render = EXPORT_FORMATS[output]
+        response = StreamingHttpResponse(render(rows), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="attendance.{output}"'
+        return response
+
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        """Dashboard analytics for a date range, aggregated in the database"""
+        today = timezone.now().date()
+        try:
+            end_date = parse_date(request.query_params.get('end_date') or '') or today
+            start_date = parse_date(request.query_params.get('start_date') or '') or end_date - timedelta(days=29)
+        except ValueError:
+            end_date = start_date = None
+        if end_date is None or start_date is None or start_date > end_date:
+            return Response(
+                {'error': 'start_date and end_date must be valid YYYY-MM-DD dates with start_date <= end_date'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        course = request.query_params.get('course', None)
+        # Daily, status and per-course figures come from the (date, course) rollup
+        summaries = DailyAttendanceSummary.objects.filter(date__range=(start_date, end_date))
+        students = Student.objects.all()
+        courses = Course.objects.all()
+        if course:
+            summaries = summaries.filter(course_id=course)
+            students = students.filter(course_id=course)
+            courses = courses.filter(pk=course)
+
+        status_sums = {name: Sum(name) for name, _ in Attendance.STATUS_CHOICES}
+        day_total = F('present') + F('late') + F('absent')
+        attended_total = F('present') + F('late')
+        daily = list(
+            summaries.values('date')
+            .annotate(**status_sums)
+            .order_by('date')
+        )
+        daily = [row for row in daily if any(row[name] for name, _ in Attendance.STATUS_CHOICES)]
+        class_days = len(daily)
+
+        totals = {name: sum(row[name] for row in daily) for name, _ in Attendance.STATUS_CHOICES}
+        today_total = summaries.filter(date=today).aggregate(n=Sum(day_total))['n'] or 0
+
+        # Days each course held class (any record) and attended records per course
+        course_activity = {
+            row['course']: row
+            for row in summaries.annotate(day_total=day_total).filter(day_total__gt=0)
+            .values('course').annotate(
+                days=Count('date', distinct=True),
+                attended=Sum(attended_total)
+            ).order_by()
+        }
+        per_course = []
+        for row in courses.annotate(enrolled=Count('student')).values('id', 'code', 'name', 'enrolled').order_by('code'):
+            activity = course_activity.get(row['id'], {'days': 0, 'attended': 0})
+            possible = row['enrolled'] * activity['days']
+            per_course.append({
+                'course_id': row['id'],
+                'code': row['code'],
+                'name': row['name'],
+                'students': row['enrolled'],
+                'class_days': activity['days'],
+                'attended': activity['attended'],
+                'rate': round(activity['attended'] / possible, 4) if possible else None,
+            })
+
+        # A student's rate is out of the days their own course held class
+        student_days = {course_id: activity['days'] for course_id, activity in course_activity.items()}
+        per_student = [
+            {
+                'id': row['id'],
+                'student_id': row['student_id'],
+                'name': f"{row['first_name']} {row['last_name']}",
+                'course_id': row['course'],
+                'attended': row['attended'],
+                'class_days': student_days.get(row['course'], 0),
+                'rate': (
+                    round(row['attended'] / student_days[row['course']], 4)
+                    if student_days.get(row['course']) else None
+                ),
+            }
+            for row in students.annotate(
+                attended=Count(
+                    'attendance',
+                    filter=Q(attendance__date__range=(start_date, end_date),
+                             attendance__status__in=ATTENDED_STATUSES)
+                )
+            ).values('id', 'student_id', 'first_name', 'last_name', 'course', 'attended')
+        ]
+
+        return Response({
+            'start_date': start_date,
+            'end_date': end_date,
+            'totals': {
+                'students': students.count(),
+                'courses': courses.count(),
+                'attendance_records': sum(totals.values()),
+                'today': today_total,
+                'class_days': class_days,
+            },
+            'status_breakdown': totals,
+            'daily': [
+                {
+                    'date': row['date'],
+                    'count': sum(row[name] for name, _ in Attendance.STATUS_CHOICES),
+                    **{name: row[name] for name, _ in Attendance.STATUS_CHOICES},
+                }
+                for row in daily
+            ],
+            'courses': per_course,
+            'students': per_student,
+        })
+
     @action(detail=False, methods=['post'], authentication_classes=[], permission_classes=[])
+    @face_request_logged('check_face')
     def check_face(self, request):
         """Endpoint for real-time face detection"""
         serializer = FaceRecognitionSerializer(data=request.data)
@@ -334,16 +838,14 @@ class AttendanceViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        image = serializer.validated_data['image']
+        probe = serializer.validated_data.get('probe')
         try:
-            # Extract face encoding
-            face_encoding, confidence, face_position = extract_face_encoding(image)
-            
-            if face_encoding is None:
-                return Response({
-                    'face_detected': False,
-                    'message': 'No face detected'
-                })
+            if probe is not None:
+                # The client found the face itself; the payload was validated by the serializer
+                confidence, face_position = probe.confidence, probe.box
+            else:
+                # Detection only: the polling clients just need the bounding box
+                confidence, face_position = detect_face(serializer.validated_data['image'])
             
             if face_position:
                 x, y, w, h = face_position
@@ -371,10 +873,12 @@ class AttendanceViewSet(viewsets.ModelViewSet):
             )
 
     @action(detail=False, methods=['post'])
+    @face_request_logged('mark_attendance')
     def mark_attendance(self, request):
+        request_log = current_request_log()
         try:
-            # Check if image is in request.FILES
-            if 'image' not in request.FILES:
+            # Check if image (or a compact face probe) is in request.FILES
+            if 'image' not in request.FILES and 'face' not in request.FILES:
                 logger.error("No image file in request.FILES")
                 return Response(
                     {'error': 'No image file was submitted. Please send the image in the request.'}, 
@@ -393,11 +897,28 @@ class AttendanceViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            image = request.FILES['image']
+            probe = serializer.validated_data.get('probe')
+            image = serializer.validated_data.get('image')
             student_id = serializer.validated_data.get('student_id')
+            today = timezone.now().date()
+
+            # Answer double taps and resent frames before paying for encoding. Only a frame that
+            # already matched counts: with student_id the face is verified first (see below)
+            digest = frame_digest(probe.data if probe is not None else read_image_buffer(image))
+            known_pk = None if student_id else match_cache.get(digest)
+            if known_pk is not None and marked_today.get((today, known_pk)):
+                request_log.set(result='already_marked', cache='hit')
+                return Response(
+                    {'error': 'Attendance already marked for today'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
 
             # Extract face encoding
-            face_encoding, confidence, _ = extract_face_encoding(image)
+            if probe is not None:
+                face_encoding, confidence, _ = encode_probe(probe)
+                request_log.set(payload='face')
+            else:
+                face_encoding, confidence, _ = extract_face_encoding(image)
             
             if face_encoding is None:
                 logger.warning("No face detected in the image")
@@ -406,9 +927,8 @@ class AttendanceViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            # Define the threshold here for logging
-            match_threshold = 0.7 # Using a higher threshold to reduce false positives
-            logger.info(f"Using matching threshold: {match_threshold}")
+            threshold = match_threshold()
+            request_log.set(detection_confidence=confidence)
 
             # If student_id is provided, verify against that student
             if student_id:
@@ -421,18 +941,21 @@ class AttendanceViewSet(viewsets.ModelViewSet):
                             status=status.HTTP_400_BAD_REQUEST
                         )
                     
-                    stored_encoding = np.frombuffer(student.face_encoding)
-                    
-                    # Log type and shape of stored encoding
-                    logger.info(f"Stored encoding type for student {student.student_id}: {type(stored_encoding)}")
-                    logger.info(f"Stored encoding shape for student {student.student_id}: {stored_encoding.shape if stored_encoding is not None else 'None'}")
-
-                    # Log snippets of the encodings before comparison
-                    logger.info(f"Mark Attendance - Comparing stored encoding snippet ({student.student_id}): {stored_encoding[:10]}... with new encoding snippet: {face_encoding[:10]}...")
+                    if student.face_encoding_model != get_descriptor().version:
+                        logger.warning(f"Student {student_id} face was encoded with {student.face_encoding_model or 'an unknown model'}")
+                        return Response(
+                            {'error': 'Student face was registered with an older model. Please re-register the student\'s face.'}, 
+                            status=status.HTTP_400_BAD_REQUEST
+                        )
 
-                    match, similarity = compare_faces(stored_encoding, face_encoding, threshold=match_threshold)
+                    stored_encoding = student.get_face_encoding()
+                    upgrade_face_encoding(student)
                     
-                    logger.info(f"Comparison for student {student_id}: Match={match}, Similarity={similarity}")
+                    logger.debug("Comparing stored encoding snippet (%s): %s... with new encoding snippet: %s...", student.student_id, stored_encoding[:10], face_encoding[:10])
+
+                    with request_log.stage('match'):
+                        match, similarity = compare_faces(stored_encoding, face_encoding, threshold=threshold)
+                    request_log.set(candidates=1, best_similarity=similarity, student=student_id)
 
                     if not match:
                         logger.warning(f"Face does not match for student {student_id}")
@@ -441,24 +964,26 @@ class AttendanceViewSet(viewsets.ModelViewSet):
                             status=status.HTTP_400_BAD_REQUEST
                         )
                     
+                    if marked_today.get((today, student.pk)):
+                        request_log.set(result='already_marked', cache='hit')
+                        return Response(
+                            {'error': 'Attendance already marked for today'},
+                            status=status.HTTP_400_BAD_REQUEST
+                        )
+
                     # Mark attendance
-                    attendance, created = Attendance.objects.get_or_create(
-                        student=student,
-                        date=timezone.now().date(),
-                        defaults={
-                            'status': 'present',
-                            'confidence_score': similarity
-                        }
-                    )
+                    with request_log.stage('db_write'):
+                        attendance, created = mark_present(student, similarity, today)
+                    marked_today.set((today, student.pk), True)
                     
                     if not created:
-                        logger.info(f"Attendance already marked for student {student_id}")
+                        request_log.set(result='already_marked')
                         return Response(
                             {'error': 'Attendance already marked for today'}, 
                             status=status.HTTP_400_BAD_REQUEST
                         )
                     
-                    logger.info(f"Successfully marked attendance for student {student_id}")
+                    request_log.set(result='marked')
                     return Response(
                         AttendanceSerializer(attendance).data,
                         status=status.HTTP_201_CREATED
@@ -472,8 +997,7 @@ class AttendanceViewSet(viewsets.ModelViewSet):
                     )
             
             # If no student_id provided, try to match against all students
-            students = Student.objects.exclude(face_encoding__isnull=True)
-            if not students.exists():
+            if not face_gallery.size:
                 logger.warning("No students registered with face data")
                 return Response(
                     {'error': 'No students registered with face data. Please register students first.'}, 
@@ -481,53 +1005,49 @@ class AttendanceViewSet(viewsets.ModelViewSet):
                 )
 
             best_match = None
-            best_confidence = 0.7  # Minimum confidence threshold - UPDATED
+            best_confidence = threshold
             highest_similarity = 0.0 # To track the highest similarity found
 
-            for student in students:
-                stored_encoding = np.frombuffer(student.face_encoding)
-                
-                # Log type and shape of stored encoding in loop
-                logger.info(f"Stored encoding type for student {student.student_id} in loop: {type(stored_encoding)}")
-                logger.info(f"Stored encoding shape for student {student.student_id} in loop: {stored_encoding.shape if stored_encoding is not None else 'None'}")
-                
-                # Log snippets of the encodings before comparison (in the loop)
-                logger.info(f"Mark Attendance - Comparing stored encoding snippet ({student.student_id}) in loop: {stored_encoding[:10]}... with new encoding snippet: {face_encoding[:10]}...")
-
-                match, similarity = compare_faces(stored_encoding, face_encoding, threshold=match_threshold)
-                highest_similarity = max(highest_similarity, similarity)
-                
-                if match and similarity > best_confidence:
-                    best_match = student
-                    best_confidence = similarity
-
-            logger.info(f"Highest similarity found among all students: {highest_similarity}")
+            # Single matrix-vector product over the pre-normalized gallery (or one course's partition)
+            course, fallback = match_scope(serializer.validated_data)
+            with request_log.stage('match'):
+                candidates = search_scoped([face_encoding], course, fallback)[0]
+            if candidates:
+                best_pk, highest_similarity = candidates[0]
+                if highest_similarity > threshold:
+                    best_match = Student.objects.filter(pk=best_pk).first()
+                    best_confidence = highest_similarity
+                    if best_match:
+                        upgrade_face_encoding(best_match)
+
+            request_log.set(
+                candidates=face_gallery.size if course is None else face_gallery.partition_size(course),
+                course=course,
+                best_similarity=highest_similarity,
+                student=best_match.student_id if best_match else None
+            )
 
             if not best_match:
-                logger.warning("No matching student found")
+                request_log.set(result='no_match')
                 return Response(
                     {'error': 'No matching student found. Please try again.'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
             # Mark attendance for the best match
-            attendance, created = Attendance.objects.get_or_create(
-                student=best_match,
-                date=timezone.now().date(),
-                defaults={
-                    'status': 'present',
-                    'confidence_score': best_confidence
-                }
-            )
+            with request_log.stage('db_write'):
+                attendance, created = mark_present(best_match, best_confidence, today)
+            marked_today.set((today, best_match.pk), True)
+            match_cache.set(digest, best_match.pk)
 
             if not created:
-                logger.info(f"Attendance already marked for student {best_match.student_id}")
+                request_log.set(result='already_marked')
                 return Response(
                     {'error': 'Attendance already marked for today'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
 
-            logger.info(f"Successfully marked attendance for student {best_match.student_id}")
+            request_log.set(result='marked')
             # Return a success response with student details
             return Response(
                 {
@@ -547,3 +1067,119 @@ class AttendanceViewSet(viewsets.ModelViewSet):
                 {'error': 'Internal server error', 'details': str(e)}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+
+    @action(detail=False, methods=['post'])
+    @face_request_logged('mark_attendance_batch')
+    def mark_attendance_batch(self, request):
+        """Mark attendance for every face in one or more classroom photos"""
+        serializer = BatchFaceRecognitionSerializer(data=request.data)
+        if not serializer.is_valid():
+            logger.error(f"Invalid batch request data: {serializer.errors}")
+            return Response(
+                {'error': 'Invalid request data', 'details': serializer.errors},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        try:
+            if not face_gallery.size:
+                return Response(
+                    {'error': 'No students registered with face data. Please register students first.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            # Encode every face in every photo
+            faces = []
+            for image_index, image in enumerate(serializer.validated_data['images']):
+                for encoding, confidence, (x, y, w, h) in extract_all_face_encodings(image):
+                    faces.append({
+                        'image': image_index,
+                        'encoding': encoding,
+                        'detection_confidence': confidence,
+                        'face_position': {'x': x, 'y': y, 'width': w, 'height': h},
+                    })
+
+            if not faces:
+                return Response(
+                    {'error': 'No faces detected in the submitted images.'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            # One batched matrix product against the whole gallery (or one course's partition)
+            course, fallback = match_scope(serializer.validated_data)
+            with current_request_log().stage('match'):
+                matches = search_scoped([face.pop('encoding') for face in faces], course, fallback)
+
+            # Keep the strongest face per student; weaker faces of the same student are duplicates
+            best_face_for = {}
+            threshold = match_threshold()
+            for index, (face, candidates) in enumerate(zip(faces, matches)):
+                face['similarity'] = candidates[0][1] if candidates else 0.0
+                if candidates and candidates[0][1] > threshold:
+                    pk = candidates[0][0]
+                    face['student_pk'] = pk
+                    current = best_face_for.get(pk)
+                    if current is None or faces[current]['similarity'] < face['similarity']:
+                        best_face_for[pk] = index
+
+            today = timezone.now().date()
+            students = Student.objects.in_bulk(list(best_face_for))
+            with current_request_log().stage('db_write'):
+                # One INSERT ... ON CONFLICT DO NOTHING for every matched student
+                created = insert_attendance([
+                    (students[pk], faces[index]['similarity'])
+                    for pk, index in best_face_for.items()
+                    if pk in students
+                ], today)
+            already_marked = set(students) - set(created)
+            for pk in students:
+                marked_today.set((today, pk), True)
+
+            results = []
+            for index, face in enumerate(faces):
+                pk = face.pop('student_pk', None)
+                student = students.get(pk)
+                if student is None:
+                    face['result'] = 'unmatched'
+                elif best_face_for[pk] != index:
+                    face['result'] = 'duplicate'
+                elif pk in already_marked:
+                    face['result'] = 'already_marked'
+                else:
+                    face['result'] = 'marked'
+                if student is not None:
+                    face['student'] = {
+                        'id': student.pk,
+                        'student_id': student.student_id,
+                        'first_name': student.first_name,
+                        'last_name': student.last_name,
+                    }
+                results.append(face)
+
+            marked = sum(1 for face in results if face['result'] == 'marked')
+            current_request_log().set(
+                faces=len(results), marked=marked, course=course,
+                candidates=face_gallery.size if course is None else face_gallery.partition_size(course)
+            )
+            return Response(
+                {
+                    'date': today,
+                    'faces_detected': len(results),
+                    'marked': marked,
+                    'results': results,
+                },
+                status=status.HTTP_201_CREATED if marked else status.HTTP_200_OK
+            )
+
+        except Exception as e:
+            logger.error(f"Error in batch attendance: {str(e)}", exc_info=True)
+            return Response(
+                {'error': 'Internal server error', 'details': str(e)},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+def metrics(request):
+    """Prometheus text exposition of the face pipeline metrics"""
+    if not metrics_enabled():
+        return HttpResponse(status=404)
+    return HttpResponse(registry.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -3,6 +3,9 @@ ASGI config for backend project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+HTTP requests go to Django; WebSocket connections to ``/ws/face-detection/``
+go to the streaming face detector in ``attendance.streaming``.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/5.0/howto/deployment/asgi/
 """
@@ -13,4 +16,18 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from attendance.streaming import face_detection_stream  # noqa: E402  (needs settings configured)
+
+FACE_STREAM_PATH = '/ws/face-detection/'
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        if scope['path'] == FACE_STREAM_PATH:
+            return await face_detection_stream(scope, receive, send)
+        # Reject unknown WebSocket paths
+        await receive()
+        return await send({'type': 'websocket.close', 'code': 4404})
+    return await django_application(scope, receive, send)
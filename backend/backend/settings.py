@@ -79,11 +79,50 @@ WSGI_APPLICATION = 'backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# SQLite by default; set DB_ENGINE=postgresql (plus DB_NAME, DB_USER,
+# DB_PASSWORD, DB_HOST, DB_PORT) to use PostgreSQL, which needs psycopg.
+# Connections are kept open for DB_CONN_MAX_AGE seconds instead of per request.
+DB_ENGINE = os.environ.get('DB_ENGINE', 'sqlite')
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 60))
+
+if DB_ENGINE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('DB_NAME', 'attendance'),
+            'USER': os.environ.get('DB_USER', ''),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST': os.environ.get('DB_HOST', ''),
+            'PORT': os.environ.get('DB_PORT', ''),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+        }
     }
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('DB_NAME') or BASE_DIR / 'db.sqlite3',
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                # Seconds to wait for a write lock before "database is locked"
+                'timeout': 20,
+            },
+        }
+    }
+
+# Applied to every new SQLite connection (see attendance/signals.py, which only
+# accepts the pragmas and values in SQLITE_PRAGMA_VALUES). WAL lets readers run
+# alongside the writer; NORMAL sync is safe with WAL. WAL mode is stored in the
+# database file and keeps -wal/-shm files next to it.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': 20000,
+    'cache_size': -20000,  # KiB, i.e. 20 MB
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'memory',
 }
 
 
@@ -155,3 +194,111 @@ SIMPLE_JWT = {
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True  # Only for development
 CORS_ALLOW_CREDENTIALS = True
+
+# Face encoding storage (see attendance/encodings.py)
+FACE_ENCODING_DTYPE = 'float32'  # 'float16', 'float32' or 'float64'
+FACE_ENCODING_COMPRESSION = False  # lz4-compress stored encodings
+
+# Face descriptor used for new encodings: 'raw', 'hog' or 'pca' (see attendance/descriptors.py).
+# Existing encodings are raw-v1; switching needs `python manage.py reencode_faces` and then
+# `python manage.py calibrate_face_threshold` (see "Face descriptors" in the README).
+FACE_DESCRIPTOR = 'raw'
+FACE_PCA_MODEL_PATH = BASE_DIR / 'face_models' / 'pca.npz'
+# Per-version overrides of the descriptors' calibrated match thresholds, e.g.
+# {'hog-v1': 0.88}; `python manage.py calibrate_face_threshold` suggests one
+FACE_MATCH_THRESHOLDS = {}
+
+# Worker threads shared by all WebSocket face detection streams (see attendance/streaming.py)
+FACE_STREAM_WORKERS = 4
+
+# Worker processes used by the bulk_import action (-1 = all cores)
+ENROLLMENT_IMPORT_JOBS = -1
+
+# Face pipeline logging (see attendance/facelog.py):
+# 'production' emits one summary record per face request; 'verbose' also
+# turns on DEBUG step-by-step logs, including encoding snippets.
+FACE_LOG_MODE = os.environ.get('FACE_LOG_MODE', 'production')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {
+            'format': '%(levelname)s:%(name)s:%(message)s',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'simple',
+        },
+    },
+    'loggers': {
+        'attendance': {
+            'handlers': ['console'],
+            'level': 'DEBUG' if FACE_LOG_MODE == 'verbose' else 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
+# Face pipeline latency metrics on /metrics, and optional Server-Timing headers
+FACE_METRICS_ENABLED = True
+FACE_SERVER_TIMING = DEBUG
+
+# Kiosk caches (see attendance/caches.py): detection results per frame hash,
+# and students already marked today. Sizes are entry counts, TTLs seconds.
+FACE_FRAME_CACHE_SIZE = 256
+FACE_FRAME_CACHE_TTL = 5.0
+FACE_MARKED_CACHE_SIZE = 10000
+FACE_MARKED_CACHE_TTL = 300.0
+
+# Share the face gallery between worker processes through a memory-mapped
+# file (see attendance/gallery_file.py). Unset keeps a private copy per process.
+FACE_GALLERY_FILE = os.environ.get('FACE_GALLERY_FILE') or None
+
+# Background face encoding for upload_photo (see attendance/jobs.py).
+# ENROLLMENT_ASYNC makes async the default; clients can also pass async=1.
+# 0 workers runs each job inline when its request commits.
+ENROLLMENT_ASYNC = False
+ENROLLMENT_JOB_WORKERS = 2
+# Seconds before a 'running' job is considered abandoned and requeued; a worker
+# still running it past then has its result discarded
+ENROLLMENT_JOB_TIMEOUT = 600
+
+# Face detection under concurrent requests (see attendance/detectors.py).
+# At most FACE_DETECTION_CONCURRENCY cascade runs at once (None = CPU count);
+# FACE_OPENCV_THREADS is passed to cv2.setNumThreads (None leaves OpenCV's default).
+FACE_CASCADE_PATH = None
+FACE_DETECTION_CONCURRENCY = None
+FACE_OPENCV_THREADS = 1
+
+# Retries when an attendance write finds SQLite locked (see attendance/marking.py);
+# the backoff doubles from ATTENDANCE_WRITE_BACKOFF seconds, with jitter
+ATTENDANCE_WRITE_RETRIES = 5
+ATTENDANCE_WRITE_BACKOFF = 0.05
+
+# Approximate 1:N face matching for very large galleries (see attendance/ann.py).
+# Galleries under FACE_ANN_MIN_SIZE are always scanned exactly. FACE_ANN_LISTS
+# is the number of k-means cells (None = sqrt of the gallery size) and
+# FACE_ANN_PROBES how many of them each search scores. A probe whose best
+# approximate match is below FACE_ANN_EXACT_BELOW (None = never, 'match' = the
+# descriptor's match threshold) is re-searched exactly, so enrolled students are
+# not rejected for landing in an unprobed cell.
+FACE_ANN_ENABLED = os.environ.get('FACE_ANN_ENABLED', '') == '1'
+FACE_ANN_MIN_SIZE = 20000
+FACE_ANN_LISTS = None
+FACE_ANN_PROBES = 8
+FACE_ANN_EXACT_BELOW = 'match'
+# Trained centroids and assignments persist here (None retrains after a restart)
+FACE_ANN_INDEX_FILE = os.environ.get('FACE_ANN_INDEX_FILE') or None
+
+# Kiosks may scope mark_attendance to one course (course=<pk>). When nobody in
+# that course matches, FACE_COURSE_FALLBACK searches every student instead;
+# requests can override it with fallback=true/false.
+FACE_COURSE_FALLBACK = False
+
+# Without FACE_GALLERY_FILE, each worker checks the database this often (seconds)
+# for students written by other workers or management commands (see
+# attendance/gallery.py). None turns the check off for single-process servers.
+FACE_GALLERY_REFRESH_INTERVAL = 2.0
@@ -37,6 +37,17 @@ interface AttendanceData {
   }>;
 }
 
+interface StatsResponse {
+  totals: {
+    students: number;
+    courses: number;
+    attendance_records: number;
+    today: number;
+  };
+  status_breakdown: Record<'present' | 'late' | 'absent', number>;
+  daily: Array<{ date: string; count: number }>;
+}
+
 interface Student {
   id: number;
   name: string;
@@ -63,7 +74,6 @@ const Dashboard: React.FC = () => {
 
   useEffect(() => {
     fetchStats();
-    fetchAttendanceData();
     fetchStudents();
   }, []);
 
@@ -77,20 +87,22 @@ const Dashboard: React.FC = () => {
 
   const fetchStats = async () => {
     try {
-      const [studentsRes, coursesRes, attendanceRes] = await Promise.all([
-        axios.get<{ count: number }>('http://localhost:8000/api/students/'),
-        axios.get<{ count: number }>('http://localhost:8000/api/courses/'),
-        axios.get<{ count: number; results: AttendanceData['raw'] }>('http://localhost:8000/api/attendance/'),
-      ]);
-      const today = new Date().toISOString().split('T')[0];
-      const todayAttendance = attendanceRes.data.results.filter(
-        (record) => record.date === today
-      ).length;
+      // One aggregated payload instead of paging through the list endpoints
+      const res = await axios.get<StatsResponse>('http://localhost:8000/api/attendance/stats/');
+      const data = res.data;
       setStats({
-        totalStudents: studentsRes.data.count,
-        totalCourses: coursesRes.data.count,
-        todayAttendance,
-        totalAttendance: attendanceRes.data.count,
+        totalStudents: data.totals.students,
+        totalCourses: data.totals.courses,
+        todayAttendance: data.totals.today,
+        totalAttendance: data.totals.attendance_records,
+      });
+      setAttendanceData({
+        bar: data.daily.map(({ date, count }) => ({ date, count })),
+        pie: [
+          { name: 'Present', value: data.status_breakdown.present },
+          { name: 'Absent', value: data.status_breakdown.absent },
+        ],
+        raw: [],
       });
     } catch (error) {
       // ignore
@@ -99,31 +111,6 @@ const Dashboard: React.FC = () => {
     }
   };
 
-  const fetchAttendanceData = async () => {
-    try {
-      const res = await axios.get<{ results: AttendanceData['raw'] }>('http://localhost:8000/api/attendance/');
-      const data = res.data.results;
-      // Group by date for bar chart
-      const dateMap: Record<string, number> = {};
-      let present = 0;
-      let absent = 0;
-      data.forEach((rec) => {
-        if (!dateMap[rec.date]) dateMap[rec.date] = 0;
-        dateMap[rec.date] += 1;
-        if (rec.status === 'present') present += 1;
-        if (rec.status === 'absent') absent += 1;
-      });
-      setAttendanceData({
-        bar: Object.entries(dateMap).map(([date, count]) => ({ date, count })),
-        pie: [
-          { name: 'Present', value: present },
-          { name: 'Absent', value: absent },
-        ],
-        raw: data,
-      });
-    } catch (error) {}
-  };
-
   const fetchStudents = async () => {
     try {
       const res = await axios.get<{ results: Student[] }>('http://localhost:8000/api/students/');
@@ -226,7 +213,7 @@ const Dashboard: React.FC = () => {
             }}
           >
             <Typography component="h2" variant="h6" color="primary" gutterBottom>
-              Total Attendance Records
+              Attendance Records (30 days)
             </Typography>
             <Typography component="p" variant="h4">
               {stats.totalAttendance}